@@ -0,0 +1,195 @@
+"""Admission control: an adaptive concurrency limit, a bounded queue and per-client rate limits"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """The request can't start in time; answer 503 with Retry-After"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Overloaded ({reason})")
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AIMDLimit:
+    """Concurrency limit tuned by additive increase, multiplicative decrease.
+
+    Every request finishing within ``latency_target`` seconds while the
+    limit is at least half used adds 1/limit (about +1 per limit's worth of
+    requests). A slower or failed request multiplies the limit by
+    ``backoff``, at most once per ``latency_target`` so one burst of slow
+    requests counts as one signal.
+    """
+
+    def __init__(self, initial=16, min_limit=2, max_limit=500, latency_target=2.0, backoff=0.9):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._last_decrease = 0.0
+        self.decreases = 0
+
+    @property
+    def value(self):
+        return int(self._limit)
+
+    def on_sample(self, latency, in_flight, dropped=False):
+        """Feed one finished request; the caller serializes calls"""
+        if dropped or latency > self.latency_target:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.latency_target:
+                self._last_decrease = now
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+                self.decreases += 1
+        elif in_flight * 2 >= self._limit:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+
+class AdmissionController:
+    """Admits requests up to the limit and queues a bounded number more.
+
+    Queued requests start in arrival order. A request is turned away at once
+    if the queue is full or the expected wait (queue position times the
+    average request time, divided by the limit) already exceeds
+    ``max_wait``, and after ``max_wait`` seconds if it still hasn't started,
+    so rejected clients hear back quickly instead of timing out in the
+    backlog after the work was paid for.
+
+    Each worker process has its own controller and limit: it protects that
+    process, and the service as a whole admits up to the sum of them.
+    """
+
+    def __init__(self, limit, queue_size=100, max_wait=2.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self._avg_latency = None
+        self._cond = threading.Condition()
+        self._counters = {'admitted': 0, 'queued': 0, 'queue_full': 0, 'deadline': 0, 'timeout': 0}
+
+    def _expected_wait(self, position):
+        return position * (self._avg_latency or 0.0) / max(1, self.limit.value)
+
+    def _reject(self, reason, retry_after):
+        self._counters[reason] += 1
+        return Overloaded(reason, retry_after)
+
+    def acquire(self):
+        """Wait for a slot; returns a token for ``release()`` or raises Overloaded"""
+        with self._cond:
+            if self.waiting == 0 and self.in_flight < self.limit.value:
+                self.in_flight += 1
+                self._counters['admitted'] += 1
+                return time.monotonic()
+            expected = self._expected_wait(self.waiting + 1)
+            if self.waiting >= self.queue_size:
+                raise self._reject('queue_full', expected)
+            if expected > self.max_wait:
+                raise self._reject('deadline', expected)
+            self.waiting += 1
+            self._counters['queued'] += 1
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self.in_flight >= self.limit.value:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject('timeout', self._expected_wait(self.waiting))
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self._counters['admitted'] += 1
+            finally:
+                self.waiting -= 1
+            return time.monotonic()
+
+    def release(self, token, dropped=False):
+        """Finish an admitted request; ``dropped`` marks it as failed (a 5xx)"""
+        latency = time.monotonic() - token
+        with self._cond:
+            self.limit.on_sample(latency, self.in_flight, dropped)
+            self.in_flight -= 1
+            self._avg_latency = latency if self._avg_latency is None else 0.9 * self._avg_latency + 0.1 * latency
+            free = self.limit.value - self.in_flight
+            if free > 0 and self.waiting:
+                self._cond.notify(free)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit.value,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'avg_latency_ms': round(self._avg_latency * 1000, 1) if self._avg_latency is not None else None,
+                'limit_decreases': self.limit.decreases,
+                **self._counters,
+            }
+
+
+class TokenBuckets:
+    """One token bucket per client: ``rate`` requests a second, bursts of up to ``burst``.
+
+    The buckets live in this process. With several worker processes sharing
+    the traffic, ``share(processes)`` gives each worker an equal part of the
+    rate and burst, so a client's limit across the whole service stays about
+    what was configured (exactly so when its requests spread evenly). Only
+    the ``max_clients`` most recently seen clients are tracked; a client
+    evicted from the table starts again with a full bucket.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.configured_rate = rate
+        self.configured_burst = burst
+        self.rate = rate
+        self.burst = burst
+        self.processes = 1
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> [tokens, updated_at]
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def share(self, processes):
+        """Split the configured limit across ``processes`` workers"""
+        with self._lock:
+            self.processes = max(1, processes)
+            self.rate = self.configured_rate / self.processes
+            self.burst = max(1.0, self.configured_burst / self.processes)
+            self._buckets.clear()
+
+    def take(self, client):
+        """0 if the client may proceed, else seconds until its next token"""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [float(self.burst), now]
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            self.limited += 1
+            return (1 - bucket[0]) / self.rate
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._buckets),
+                'limited': self.limited,
+                'rate': self.rate,
+                'burst': self.burst,
+                'processes': self.processes,
+            }
@@ -1,352 +1,648 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
-from huggingface_hub import InferenceClient
+from werkzeug.exceptions import HTTPException
+import hashlib
 import io
-from datetime import datetime
+import json
+import re
+import time
+from datetime import date, datetime, timedelta
 import os
-import sys
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import atexit
+import uuid
+import logging
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from logging_setup import configure_logging, stop_logging, start_request, request_id_var
+from db_pool import ConnectionPool
+from transaction_writer import TransactionWriter
+from prediction_cache import PredictionCache, DiskCacheTier, PostgresCacheTier
+from image_hashing import HASH_FUNCTIONS, NearDuplicateIndex
+from image_preprocess import prepare_for_inference
+from inference_batcher import MicroBatcher
+from inference_backends import create_backend
+from resilience import ResilientBackend, CircuitBreaker, CircuitOpen, CallTimeout
+import metrics
+from jobs import JobManager, JobError, JobQueueFull, MemoryJobStore, PostgresJobStore, FINISHED_STATUSES
+from migrations import LATEST_VERSION as SCHEMA_VERSION, migrate, maintain as maintain_partitions
+from rollups import SalesRollups, MEASURES as rollup_measures
+from transaction_history import list_transactions, decode_cursor, export_batches, csv_chunks, ndjson_chunks
+from menu import MenuCache
+from receipts import ReceiptService, MemoryReceiptStore, TransactionReceiptStore, new_receipt, render_receipt, receipt_etag
+from warmup import Warmup
+from uploads import UploadRequest
+from responses import ResponseCompressor, configure_json, parse_fields, select_fields
+from admission import AdmissionController, AIMDLimit, TokenBuckets, Overloaded
+from idempotency import (
+    IdempotencyService, IdempotencyConflict, IdempotencyInProgress, MemoryIdempotencyStore, PostgresIdempotencyStore
+)
+
+# Logging: LOG_FORMAT is "json" or "text"; LOG_DEBUG_SAMPLE_RATE is the share
+# of requests whose DEBUG lines are kept when LOG_LEVEL=DEBUG
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0))
+
+configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT)
+startup_log = logging.getLogger('app.startup')
+db_log = logging.getLogger('app.db')
+inference_log = logging.getLogger('app.inference')
+match_log = logging.getLogger('app.match')
+request_log = logging.getLogger('app.request')
 
 app = Flask(__name__)
 CORS(app)
 
+# Responses: JSON_ENCODER "orjson" (falls back to Flask's encoder if orjson
+# isn't installed) or "default". Bodies of COMPRESS_MIMETYPES of at least
+# COMPRESS_MIN_BYTES are sent brotli- or gzip-encoded when the client accepts it.
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'default').lower()
+COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_MIMETYPES = os.environ.get(
+    'COMPRESS_MIMETYPES', 'application/json,text/html,text/plain,text/csv,application/x-ndjson'
+).split(',')
+
+json_encoder = configure_json(app, JSON_ENCODER)
+response_compressor = ResponseCompressor(min_size=COMPRESS_MIN_BYTES, mimetypes=COMPRESS_MIMETYPES)
+
+@app.before_request
+def bind_request_context():
+    """Give every log line of this request the same request id"""
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    start_request(request_id[:64], LOG_DEBUG_SAMPLE_RATE)
+    # No-op once this worker's warmup threads are running
+    warmup.start()
+
+@app.after_request
+def add_request_id_header(response):
+    request_id = request_id_var.get()
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+@app.after_request
+def compress_response(response):
+    if not COMPRESS_ENABLED:
+        return response
+    with metrics.timed('compression'):
+        return response_compressor(response, request.accept_encodings)
+
+def shaped_json(data):
+    """JSON response of data, cut down to the ?fields= selection if the client sent one
+
+    e.g. ?fields=transaction_id,totals.total_price,items.name,items.price
+    """
+    fields = request.args.get('fields')
+    if fields:
+        data = select_fields(data, parse_fields(fields))
+    return jsonify(data)
+
 # Database configuration
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+DB_POOL_VALIDATE_AFTER = float(os.environ.get('DB_POOL_VALIDATE_AFTER', 30))
+# Seconds to wait for a new connection (libpq takes whole seconds, minimum 2)
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
 
-# Initialize database connection
-def get_db_connection():
-    """Get database connection"""
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        print(f"[DB] ERROR connecting: {e}", file=sys.stderr)
-        return None
+# Connection pool (one per gunicorn worker, connections are opened lazily)
+db_pool = ConnectionPool(
+    DATABASE_URL,
+    minconn=DB_POOL_MIN,
+    maxconn=DB_POOL_MAX,
+    timeout=DB_POOL_TIMEOUT,
+    validate_after=DB_POOL_VALIDATE_AFTER,
+    connect_timeout=DB_CONNECT_TIMEOUT
+)
+
+# Transaction persistence: "async" queues sales for a background batch writer,
+# "sync" writes them before the response is sent. Batch size is in transactions.
+DB_WRITE_MODE = os.environ.get('DB_WRITE_MODE', 'async')
+DB_WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', 200))
+DB_WRITE_FLUSH_INTERVAL = float(os.environ.get('DB_WRITE_FLUSH_INTERVAL', 1.0))
+DB_WRITE_QUEUE_SIZE = int(os.environ.get('DB_WRITE_QUEUE_SIZE', 10000))
+
+# Sales reports read hourly/daily rollups that the writer updates with every
+# batch; days are calendar days in REPORT_TIMEZONE
+REPORT_TIMEZONE = os.environ.get('REPORT_TIMEZONE', 'UTC')
+REPORT_DEFAULT_DAYS = int(os.environ.get('REPORT_DEFAULT_DAYS', 30))
+REPORT_MAX_DAYS = int(os.environ.get('REPORT_MAX_DAYS', 366))
+sales_rollups = SalesRollups(REPORT_TIMEZONE)
+
+# Transaction history API. Each streaming export holds one pooled connection
+# for its whole duration, so only a few may run at once per worker.
+TRANSACTIONS_PAGE_SIZE = int(os.environ.get('TRANSACTIONS_PAGE_SIZE', 50))
+TRANSACTIONS_MAX_PAGE_SIZE = int(os.environ.get('TRANSACTIONS_MAX_PAGE_SIZE', 500))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+EXPORT_MAX_CONCURRENT = int(os.environ.get('EXPORT_MAX_CONCURRENT', 2))
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+transaction_writer = TransactionWriter(
+    db_pool,
+    mode=DB_WRITE_MODE,
+    batch_size=DB_WRITE_BATCH_SIZE,
+    flush_interval=DB_WRITE_FLUSH_INTERVAL,
+    max_queue=DB_WRITE_QUEUE_SIZE,
+    rollups=sales_rollups
+)
+
+# Monthly partitions of transactions/transaction_items created ahead at startup;
+# run `python manage.py maintain` from cron to keep creating them and retire old ones
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+
+# /analyze-batch: images per request and concurrent inference calls per worker
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', 20))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix='analyze-batch')
+
+# Uploads are streamed, hashed and format-checked while the request is parsed
+# (uploads.py). Each image is held in memory up to UPLOAD_SPOOL_BYTES and in a
+# temporary file beyond that; one over MAX_IMAGE_BYTES, or a request over
+# MAX_REQUEST_BYTES, is cut off with 413 as soon as the limit is crossed.
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 1024 * 1024))
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', MAX_IMAGE_BYTES * BATCH_MAX_IMAGES + 64 * 1024))
+
+app.request_class = UploadRequest
+app.config.update(
+    MAX_CONTENT_LENGTH=MAX_REQUEST_BYTES,
+    MAX_IMAGE_BYTES=MAX_IMAGE_BYTES,
+    UPLOAD_SPOOL_BYTES=UPLOAD_SPOOL_BYTES
+)
+
+@app.errorhandler(413)
+@app.errorhandler(415)
+def upload_rejected(e):
+    metrics.ERRORS.labels('upload_rejected').inc()
+    return jsonify({"error": e.description}), e.code
+
+# Receipts are served from GET /receipts/<transaction id>. The "transactions"
+# store (the default with a database; "postgres" is accepted as a synonym)
+# renders them from the stored sale, so any worker can serve them and nothing
+# beyond the sale is written. "memory" keeps them in this worker only.
+# RECEIPT_INLINE_HTML=1 also embeds the rendered page in analyze responses
+# for older clients.
+RECEIPT_STORE = os.environ.get('RECEIPT_STORE', 'transactions' if DATABASE_URL else 'memory').lower()
+RECEIPT_MEMORY_SIZE = int(os.environ.get('RECEIPT_MEMORY_SIZE', 10000))
+RECEIPT_RENDER_CACHE_SIZE = int(os.environ.get('RECEIPT_RENDER_CACHE_SIZE', 256))
+RECEIPT_MAX_AGE = int(os.environ.get('RECEIPT_MAX_AGE', 86400))
+RECEIPT_INLINE_HTML = os.environ.get('RECEIPT_INLINE_HTML', '0') == '1'
+RECEIPT_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+receipt_service = ReceiptService(
+    # calculate_totals is defined further down; look it up when a receipt is read
+    TransactionReceiptStore(db_pool, lambda items: calculate_totals(items), timeout=DB_POOL_TIMEOUT)
+    if RECEIPT_STORE in ('transactions', 'postgres')
+    else MemoryReceiptStore(max_entries=RECEIPT_MEMORY_SIZE),
+    cache_size=RECEIPT_RENDER_CACHE_SIZE
+)
+
+# Async analyze jobs (POST /analyze?async=1). The postgres store (the default
+# with a database) lets any gunicorn worker answer GET /jobs/<id>.
+# An events stream holds its worker for up to ASYNC_JOB_EVENTS_TIMEOUT seconds
+# before telling the client to poll; a sync worker can't serve anything else
+# meanwhile, so the stream is kept short unless SERVING_MODE=gevent.
+ASYNC_JOB_WORKERS = int(os.environ.get('ASYNC_JOB_WORKERS', 4))
+ASYNC_JOB_QUEUE_SIZE = int(os.environ.get('ASYNC_JOB_QUEUE_SIZE', 100))
+ASYNC_JOB_RESULT_TTL = float(os.environ.get('ASYNC_JOB_RESULT_TTL', 300))
+ASYNC_JOB_STORE = os.environ.get('ASYNC_JOB_STORE', 'postgres' if DATABASE_URL else 'memory').lower()
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync').lower()
+ASYNC_JOB_EVENTS_TIMEOUT = float(os.environ.get(
+    'ASYNC_JOB_EVENTS_TIMEOUT', 120 if SERVING_MODE == 'gevent' else 10
+))
+ASYNC_JOB_POLL_INTERVAL = float(os.environ.get('ASYNC_JOB_POLL_INTERVAL', 0.25))
+
+def run_analyze_job(image_bytes):
+    """Job handler: the same pipeline /analyze runs synchronously"""
+    result = analyze_image_bytes(image_bytes)
+    if not result["success"]:
+        raise JobError(result)
+    result["transaction_id"] = uuid.uuid4().hex
+    save_transaction(result["items"], result["transaction_id"])
+    result["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    attach_receipts([result], result["timestamp"])
+    return result
+
+async_jobs = JobManager(
+    run_analyze_job,
+    PostgresJobStore(db_pool) if ASYNC_JOB_STORE == 'postgres' else MemoryJobStore(),
+    workers=ASYNC_JOB_WORKERS,
+    max_queue=ASYNC_JOB_QUEUE_SIZE,
+    result_ttl=ASYNC_JOB_RESULT_TTL
+)
+
+# Idempotency-Key support for the analyze endpoints: the first response per key
+# is replayed to retries for IDEMPOTENCY_TTL seconds, and duplicates arriving
+# while it runs wait up to IDEMPOTENCY_WAIT seconds for it. The "postgres"
+# store catches retries that land on another worker.
+IDEMPOTENCY_STORE = os.environ.get('IDEMPOTENCY_STORE', 'postgres' if DATABASE_URL else 'memory').lower()
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 86400))
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', 30))
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', 120))
+IDEMPOTENCY_MEMORY_SIZE = int(os.environ.get('IDEMPOTENCY_MEMORY_SIZE', 10000))
+
+idempotency = IdempotencyService(
+    PostgresIdempotencyStore(db_pool, timeout=DB_POOL_TIMEOUT) if IDEMPOTENCY_STORE == 'postgres'
+    else MemoryIdempotencyStore(max_entries=IDEMPOTENCY_MEMORY_SIZE),
+    ttl=IDEMPOTENCY_TTL,
+    wait_timeout=IDEMPOTENCY_WAIT,
+    lock_timeout=IDEMPOTENCY_LOCK_TIMEOUT
+)
+
+# Admission control for /analyze, /analyze-batch and /download-receipt. Each
+# worker runs up to an adaptive number of them at once: the limit grows while
+# requests finish within ADMISSION_TARGET_LATENCY_MS and shrinks when they
+# don't or fail. A bounded FIFO queue holds the overflow; requests that
+# couldn't start within ADMISSION_MAX_WAIT_MS get a fast 503 with Retry-After.
+# The limit and queue only matter with SERVING_MODE=gevent or threaded
+# workers: a sync worker never has more than one request in flight.
+# Each kiosk sending an X-Kiosk-Id header also has a token bucket of
+# CLIENT_RATE_LIMIT requests a second with bursts of CLIENT_BURST (0 = off),
+# for the whole service: the buckets are per process, so each of the gunicorn
+# workers enforces its share of the rate and burst.
+# Requests without the header aren't rate limited: behind the platform router
+# or a campus NAT their addresses are shared by every kiosk.
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_INITIAL_LIMIT = int(os.environ.get('ADMISSION_INITIAL_LIMIT', 16))
+ADMISSION_MIN_LIMIT = int(os.environ.get('ADMISSION_MIN_LIMIT', 2))
+ADMISSION_MAX_LIMIT = int(os.environ.get('ADMISSION_MAX_LIMIT', 500))
+ADMISSION_TARGET_LATENCY_MS = float(os.environ.get('ADMISSION_TARGET_LATENCY_MS', 2000))
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', 100))
+ADMISSION_MAX_WAIT_MS = float(os.environ.get('ADMISSION_MAX_WAIT_MS', 2000))
+CLIENT_RATE_LIMIT = float(os.environ.get('CLIENT_RATE_LIMIT', 2))
+CLIENT_BURST = int(os.environ.get('CLIENT_BURST', 10))
+
+admission = AdmissionController(
+    AIMDLimit(
+        initial=ADMISSION_INITIAL_LIMIT,
+        min_limit=ADMISSION_MIN_LIMIT,
+        max_limit=ADMISSION_MAX_LIMIT,
+        latency_target=ADMISSION_TARGET_LATENCY_MS / 1000
+    ),
+    queue_size=ADMISSION_QUEUE_SIZE,
+    max_wait=ADMISSION_MAX_WAIT_MS / 1000
+)
+client_buckets = TokenBuckets(CLIENT_RATE_LIMIT, CLIENT_BURST)
+
+def shutdown():
+    """Flush buffered writes and close pooled connections"""
+    warmup.stop()
+    batch_executor.shutdown(wait=False, cancel_futures=True)
+    inference_batcher.close()
+    if inference_backend is not None:
+        inference_backend.close()
+    menu_cache.stop()
+    transaction_writer.close()
+    db_pool.closeall()
+    stop_logging()
+
+atexit.register(shutdown)
+
+# Schema migrations: "auto" applies them at startup (once in the gunicorn
+# master, see gunicorn.conf.py, or else in each worker under the schema lock);
+# "off" leaves them to `python manage.py migrate` in the release step
+MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', 'auto').lower()
+# Schema version the gunicorn master migrated to; workers inherit it and skip
+# the step unless their code has a later migration (new code after a HUP reload)
+SCHEMA_MIGRATED_ENV = 'FOOD_API_SCHEMA_MIGRATED'
 
-# Initialize database tables
 def init_db():
-    """Initialize database tables if they don't exist"""
-    conn = get_db_connection()
-    if not conn:
-        print(f"[DB] ERROR: Could not initialize database", file=sys.stderr)
-        return
-    
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS food_transactions (
-                id SERIAL PRIMARY KEY,
-                food_name VARCHAR(100) NOT NULL,
-                price DECIMAL(10,2) NOT NULL,
-                calories DECIMAL(10,2) NOT NULL,
-                protein DECIMAL(10,2) NOT NULL,
-                carbs DECIMAL(10,2) NOT NULL,
-                fat DECIMAL(10,2) NOT NULL,
-                confidence DECIMAL(5,2) NOT NULL,
-                created_at TIMESTAMP DEFAULT NOW()
-            );
-            
-            CREATE INDEX IF NOT EXISTS idx_created_at ON food_transactions(created_at);
-            CREATE INDEX IF NOT EXISTS idx_food_name ON food_transactions(food_name);
-        """)
-        conn.commit()
-        cur.close()
-        conn.close()
-        print(f"[DB] Database initialized successfully", file=sys.stderr)
-    except Exception as e:
-        print(f"[DB] ERROR initializing: {e}", file=sys.stderr)
-        if conn:
-            conn.close()
+    """Apply pending migrations unless already done, then open the pool's connections
+
+    Raises on failure so the warmup thread retries it.
+    """
+    with db_pool.connection() as conn:
+        migrated = int(os.environ.get(SCHEMA_MIGRATED_ENV) or 0)
+        if MIGRATE_ON_STARTUP == 'auto' and migrated < SCHEMA_VERSION:
+            applied = migrate(conn)
+            if applied:
+                db_log.info("Applied schema migrations: %s", applied)
+            created, _ = maintain_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD)
+            if created:
+                db_log.info("Created partitions: %s", ", ".join(created))
+        else:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+    db_pool.prefill()
+    db_log.info("Database initialized")
 
 # Hugging Face configuration
 HF_API_TOKEN = os.environ.get('HF_API_TOKEN', '')
+HF_MODEL = "nateraw/food"
+
+# Inference backend: "remote" (Hugging Face API), "local" (in-process CPU model)
+# or "stub" (deterministic fake predictions for tests and load runs)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'remote').lower()
+INFERENCE_MODEL = os.environ.get('INFERENCE_MODEL', HF_MODEL)
+LOCAL_MODEL_THREADS = int(os.environ.get('LOCAL_MODEL_THREADS', 0))
+STUB_LATENCY_MS = float(os.environ.get('STUB_LATENCY_MS', 0))
+# Stub fault injection: share of calls that fail, and share that take STUB_SLOW_MS
+STUB_FAILURE_RATE = float(os.environ.get('STUB_FAILURE_RATE', 0))
+STUB_SLOW_RATE = float(os.environ.get('STUB_SLOW_RATE', 0))
+STUB_SLOW_MS = float(os.environ.get('STUB_SLOW_MS', 5000))
+
+# Model call resilience: a deadline per call, a circuit breaker that fails fast
+# once INFERENCE_BREAKER_THRESHOLD of the last INFERENCE_BREAKER_WINDOW calls
+# failed, and optional hedging (a duplicate call after the recent p95 latency)
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', 10))
+INFERENCE_BREAKER_THRESHOLD = float(os.environ.get('INFERENCE_BREAKER_THRESHOLD', 0.5))
+INFERENCE_BREAKER_WINDOW = int(os.environ.get('INFERENCE_BREAKER_WINDOW', 20))
+INFERENCE_BREAKER_MIN_CALLS = int(os.environ.get('INFERENCE_BREAKER_MIN_CALLS', 10))
+INFERENCE_BREAKER_RESET = float(os.environ.get('INFERENCE_BREAKER_RESET', 30))
+INFERENCE_HEDGE = os.environ.get('INFERENCE_HEDGE', '0') == '1'
+INFERENCE_HEDGE_MIN_DELAY_MS = float(os.environ.get('INFERENCE_HEDGE_MIN_DELAY_MS', 50))
+# Model calls in flight per worker (hedges included); raised in gevent mode
+INFERENCE_CALL_CONCURRENCY = int(os.environ.get('INFERENCE_CALL_CONCURRENCY', 32))
+
+# Upload preprocessing: downscale to the model input size and re-encode before sending
+INFERENCE_PREPROCESS = os.environ.get('INFERENCE_PREPROCESS', '1') == '1'
+INFERENCE_IMAGE_SIZE = int(os.environ.get('INFERENCE_IMAGE_SIZE', 224))
+INFERENCE_JPEG_QUALITY = int(os.environ.get('INFERENCE_JPEG_QUALITY', 90))
+
+# Inference micro-batching: coalesce concurrent calls arriving within a short window
+INFERENCE_BATCHING = os.environ.get('INFERENCE_BATCHING', '0') == '1'
+INFERENCE_BATCH_MAX = int(os.environ.get('INFERENCE_BATCH_MAX', 8))
+INFERENCE_BATCH_MAX_WAIT_MS = float(os.environ.get('INFERENCE_BATCH_MAX_WAIT_MS', 10))
+
+# Prediction cache: per-worker LRU plus an optional shared tier ("disk" or "postgres")
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 1024))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+PREDICTION_CACHE_SHARED = os.environ.get('PREDICTION_CACHE_SHARED', '').lower()
+PREDICTION_CACHE_DIR = os.environ.get('PREDICTION_CACHE_DIR', '/tmp/prediction-cache')
+PREDICTION_CACHE_SHARED_TTL = float(os.environ.get('PREDICTION_CACHE_SHARED_TTL', 86400))
 
-print(f"[STARTUP] HF_API_TOKEN is set: {bool(HF_API_TOKEN)}", file=sys.stderr)
-print(f"[STARTUP] DATABASE_URL is set: {bool(DATABASE_URL)}", file=sys.stderr)
+if PREDICTION_CACHE_SHARED == 'disk':
+    shared_cache_tier = DiskCacheTier(PREDICTION_CACHE_DIR, ttl=PREDICTION_CACHE_SHARED_TTL)
+elif PREDICTION_CACHE_SHARED == 'postgres':
+    shared_cache_tier = PostgresCacheTier(db_pool, ttl=PREDICTION_CACHE_SHARED_TTL)
+else:
+    shared_cache_tier = None
 
-# Initialize database
-init_db()
+prediction_cache = PredictionCache(
+    f"{INFERENCE_BACKEND}:{INFERENCE_MODEL}",
+    max_entries=PREDICTION_CACHE_SIZE,
+    ttl=PREDICTION_CACHE_TTL,
+    shared=shared_cache_tier
+)
 
-# Initialize Hugging Face InferenceClient
-try:
-    client = InferenceClient(
-        provider="hf-inference",
-        api_key=HF_API_TOKEN
+# Near-duplicate lookup: reuse predictions for images whose perceptual hash
+# is within NEAR_DUPLICATE_MAX_DISTANCE bits of a recently classified one.
+# Off by default: a false match bills one tray with another tray's items, and
+# the distance hasn't been tuned against real tray photos yet. Exact repeats
+# are still served from the prediction cache.
+NEAR_DUPLICATE_ENABLED = os.environ.get('NEAR_DUPLICATE_ENABLED', '0') == '1'
+NEAR_DUPLICATE_HASH = os.environ.get('NEAR_DUPLICATE_HASH', 'dhash')
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_MAX_DISTANCE', 5))
+NEAR_DUPLICATE_SIZE = int(os.environ.get('NEAR_DUPLICATE_SIZE', 4096))
+NEAR_DUPLICATE_TTL = float(os.environ.get('NEAR_DUPLICATE_TTL', 3600))
+
+image_hash_function = HASH_FUNCTIONS[NEAR_DUPLICATE_HASH]
+near_duplicate_index = NearDuplicateIndex(
+    max_distance=NEAR_DUPLICATE_MAX_DISTANCE,
+    max_entries=NEAR_DUPLICATE_SIZE,
+    ttl=NEAR_DUPLICATE_TTL
+)
+
+startup_log.info("HF_API_TOKEN is set: %s, DATABASE_URL is set: %s", bool(HF_API_TOKEN), bool(DATABASE_URL))
+
+# Initialize inference backend
+def build_inference_backend():
+    """Create the backend selected by INFERENCE_BACKEND, wrapped in deadlines and a breaker"""
+    if INFERENCE_BACKEND == 'remote':
+        backend = create_backend('remote', model=INFERENCE_MODEL, api_key=HF_API_TOKEN,
+                                 max_concurrency=INFERENCE_BATCH_MAX, timeout=INFERENCE_TIMEOUT)
+    elif INFERENCE_BACKEND == 'local':
+        backend = create_backend('local', model=INFERENCE_MODEL, num_threads=LOCAL_MODEL_THREADS or None)
+    else:
+        backend = create_backend(
+            INFERENCE_BACKEND,
+            latency=STUB_LATENCY_MS / 1000,
+            failure_rate=STUB_FAILURE_RATE,
+            slow_rate=STUB_SLOW_RATE,
+            slow_latency=STUB_SLOW_MS / 1000
+        )
+    breaker = CircuitBreaker(
+        failure_threshold=INFERENCE_BREAKER_THRESHOLD,
+        window=INFERENCE_BREAKER_WINDOW,
+        min_calls=INFERENCE_BREAKER_MIN_CALLS,
+        reset_timeout=INFERENCE_BREAKER_RESET
     )
-    print(f"[STARTUP] InferenceClient initialized successfully", file=sys.stderr)
-except Exception as e:
-    print(f"[STARTUP] ERROR initializing client: {e}", file=sys.stderr)
-    client = None
-
-# Food database with prices (MKD - Macedonian Denar)
-FOOD_DATABASE = {
-    # Main dishes
-    "pizza": {"price": 250, "calories": 266, "protein": 11, "carbs": 33, "fat": 10},
-    "burger": {"price": 180, "calories": 295, "protein": 17, "carbs": 24, "fat": 14},
-    "hamburger": {"price": 180, "calories": 295, "protein": 17, "carbs": 24, "fat": 14},
-    "cheeseburger": {"price": 200, "calories": 350, "protein": 20, "carbs": 28, "fat": 18},
-    "sandwich": {"price": 120, "calories": 304, "protein": 13, "carbs": 40, "fat": 11},
-    "salad": {"price": 150, "calories": 33, "protein": 3, "carbs": 7, "fat": 0.2},
-    "pasta": {"price": 200, "calories": 158, "protein": 6, "carbs": 31, "fat": 1},
-    "spaghetti": {"price": 220, "calories": 200, "protein": 8, "carbs": 40, "fat": 2},
-    "lasagna": {"price": 280, "calories": 350, "protein": 18, "carbs": 35, "fat": 15},
-    "macaroni": {"price": 180, "calories": 180, "protein": 7, "carbs": 38, "fat": 1.5},
-    "ravioli": {"price": 240, "calories": 220, "protein": 10, "carbs": 32, "fat": 6},
-    "rice": {"price": 80, "calories": 130, "protein": 2.7, "carbs": 28, "fat": 0.3},
-    "fried rice": {"price": 150, "calories": 228, "protein": 5, "carbs": 44, "fat": 4},
-    
-    # Meat & Protein
-    "chicken": {"price": 220, "calories": 239, "protein": 27, "carbs": 0, "fat": 14},
-    "fried chicken": {"price": 250, "calories": 320, "protein": 25, "carbs": 12, "fat": 19},
-    "grilled chicken": {"price": 240, "calories": 165, "protein": 31, "carbs": 0, "fat": 3.6},
-    "chicken breast": {"price": 260, "calories": 165, "protein": 31, "carbs": 0, "fat": 3.6},
-    "chicken wings": {"price": 230, "calories": 290, "protein": 23, "carbs": 0, "fat": 21},
-    "chicken nuggets": {"price": 180, "calories": 280, "protein": 14, "carbs": 18, "fat": 17},
-    "chicken thigh": {"price": 240, "calories": 209, "protein": 26, "carbs": 0, "fat": 11},
-    "beef": {"price": 280, "calories": 250, "protein": 26, "carbs": 0, "fat": 15},
-    "steak": {"price": 350, "calories": 271, "protein": 25, "carbs": 0, "fat": 19},
-    "meatball": {"price": 200, "calories": 250, "protein": 15, "carbs": 8, "fat": 18},
-    "meatloaf": {"price": 220, "calories": 245, "protein": 16, "carbs": 10, "fat": 15},
-    "pork": {"price": 260, "calories": 242, "protein": 27, "carbs": 0, "fat": 14},
-    "pork chop": {"price": 270, "calories": 231, "protein": 25, "carbs": 0, "fat": 14},
-    "ribs": {"price": 320, "calories": 361, "protein": 27, "carbs": 0, "fat": 28},
-    "lamb": {"price": 340, "calories": 294, "protein": 25, "carbs": 0, "fat": 21},
-    "fish": {"price": 300, "calories": 206, "protein": 22, "carbs": 0, "fat": 12},
-    "salmon": {"price": 380, "calories": 208, "protein": 20, "carbs": 0, "fat": 13},
-    "tuna": {"price": 320, "calories": 132, "protein": 28, "carbs": 0, "fat": 1},
-    "shrimp": {"price": 340, "calories": 99, "protein": 24, "carbs": 0, "fat": 0.3},
-    "seafood": {"price": 360, "calories": 150, "protein": 20, "carbs": 5, "fat": 5},
-    "hot dog": {"price": 110, "calories": 290, "protein": 10, "carbs": 23, "fat": 18},
-    "hotdog": {"price": 110, "calories": 290, "protein": 10, "carbs": 23, "fat": 18},
-    "bacon": {"price": 95, "calories": 541, "protein": 37, "carbs": 1.4, "fat": 42},
-    "sausage": {"price": 140, "calories": 301, "protein": 12, "carbs": 1.5, "fat": 27},
-    "ham": {"price": 160, "calories": 145, "protein": 21, "carbs": 1.5, "fat": 6},
-    "turkey": {"price": 240, "calories": 189, "protein": 29, "carbs": 0, "fat": 7},
-    
-    # Fast Food
-    "taco": {"price": 160, "calories": 226, "protein": 9, "carbs": 20, "fat": 13},
-    "burrito": {"price": 200, "calories": 326, "protein": 15, "carbs": 41, "fat": 11},
-    "quesadilla": {"price": 180, "calories": 380, "protein": 17, "carbs": 30, "fat": 22},
-    "nachos": {"price": 150, "calories": 346, "protein": 7, "carbs": 36, "fat": 19},
-    "wrap": {"price": 140, "calories": 280, "protein": 12, "carbs": 35, "fat": 10},
-    "kebab": {"price": 190, "calories": 350, "protein": 20, "carbs": 30, "fat": 17},
-    "gyro": {"price": 180, "calories": 400, "protein": 18, "carbs": 35, "fat": 20},
-    "falafel": {"price": 130, "calories": 333, "protein": 13, "carbs": 32, "fat": 18},
-    
-    # Soups & Stews
-    "soup": {"price": 100, "calories": 71, "protein": 4, "carbs": 9, "fat": 2},
-    "chicken soup": {"price": 120, "calories": 86, "protein": 6, "carbs": 8, "fat": 3},
-    "tomato soup": {"price": 110, "calories": 74, "protein": 2, "carbs": 16, "fat": 0.6},
-    "vegetable soup": {"price": 100, "calories": 67, "protein": 3, "carbs": 12, "fat": 0.6},
-    "noodle soup": {"price": 130, "calories": 105, "protein": 4, "carbs": 18, "fat": 2},
-    "ramen": {"price": 140, "calories": 436, "protein": 19, "carbs": 54, "fat": 14},
-    "pho": {"price": 160, "calories": 215, "protein": 15, "carbs": 29, "fat": 2.6},
-    "stew": {"price": 180, "calories": 235, "protein": 18, "carbs": 15, "fat": 11},
-    "chili": {"price": 150, "calories": 222, "protein": 13, "carbs": 21, "fat": 9},
-    
-    # Sides & Snacks
-    "french fries": {"price": 90, "calories": 312, "protein": 3.4, "carbs": 41, "fat": 15},
-    "fries": {"price": 90, "calories": 312, "protein": 3.4, "carbs": 41, "fat": 15},
-    "onion rings": {"price": 100, "calories": 276, "protein": 3.7, "carbs": 31, "fat": 16},
-    "mozzarella sticks": {"price": 130, "calories": 320, "protein": 14, "carbs": 22, "fat": 20},
-    "potato": {"price": 50, "calories": 77, "protein": 2, "carbs": 17, "fat": 0.1},
-    "baked potato": {"price": 80, "calories": 93, "protein": 2.5, "carbs": 21, "fat": 0.2},
-    "mashed potato": {"price": 90, "calories": 113, "protein": 2, "carbs": 17, "fat": 4.2},
-    "sweet potato": {"price": 70, "calories": 86, "protein": 1.6, "carbs": 20, "fat": 0.1},
-    "coleslaw": {"price": 70, "calories": 152, "protein": 1.5, "carbs": 11, "fat": 12},
-    
-    # Vegetables
-    "vegetables": {"price": 120, "calories": 65, "protein": 3, "carbs": 13, "fat": 0.4},
-    "broccoli": {"price": 70, "calories": 34, "protein": 2.8, "carbs": 7, "fat": 0.4},
-    "carrot": {"price": 40, "calories": 41, "protein": 0.9, "carbs": 10, "fat": 0.2},
-    "corn": {"price": 60, "calories": 96, "protein": 3.4, "carbs": 21, "fat": 1.5},
-    "peas": {"price": 55, "calories": 81, "protein": 5, "carbs": 14, "fat": 0.4},
-    "green beans": {"price": 65, "calories": 31, "protein": 1.8, "carbs": 7, "fat": 0.2},
-    "spinach": {"price": 80, "calories": 23, "protein": 2.9, "carbs": 3.6, "fat": 0.4},
-    "lettuce": {"price": 45, "calories": 5, "protein": 0.5, "carbs": 1, "fat": 0.1},
-    "tomato": {"price": 40, "calories": 18, "protein": 0.9, "carbs": 3.9, "fat": 0.2},
-    "cucumber": {"price": 45, "calories": 16, "protein": 0.7, "carbs": 3.6, "fat": 0.1},
-    "onion": {"price": 35, "calories": 40, "protein": 1.1, "carbs": 9, "fat": 0.1},
-    "pepper": {"price": 55, "calories": 20, "protein": 0.9, "carbs": 4.6, "fat": 0.2},
-    "bell pepper": {"price": 60, "calories": 31, "protein": 1, "carbs": 6, "fat": 0.3},
-    "mushroom": {"price": 85, "calories": 22, "protein": 3.1, "carbs": 3.3, "fat": 0.3},
-    "eggplant": {"price": 70, "calories": 25, "protein": 1, "carbs": 6, "fat": 0.2},
-    "zucchini": {"price": 65, "calories": 17, "protein": 1.2, "carbs": 3.1, "fat": 0.3},
-    "cauliflower": {"price": 75, "calories": 25, "protein": 1.9, "carbs": 5, "fat": 0.3},
-    "cabbage": {"price": 50, "calories": 25, "protein": 1.3, "carbs": 6, "fat": 0.1},
-    "asparagus": {"price": 95, "calories": 20, "protein": 2.2, "carbs": 3.9, "fat": 0.1},
-    
-    # Bread & Grains
-    "bread": {"price": 30, "calories": 265, "protein": 9, "carbs": 49, "fat": 3.2},
-    "toast": {"price": 40, "calories": 270, "protein": 9, "carbs": 50, "fat": 3.5},
-    "bagel": {"price": 60, "calories": 277, "protein": 11, "carbs": 54, "fat": 2},
-    "croissant": {"price": 80, "calories": 406, "protein": 8, "carbs": 46, "fat": 21},
-    "muffin": {"price": 70, "calories": 289, "protein": 5, "carbs": 44, "fat": 11},
-    "pancakes": {"price": 100, "calories": 227, "protein": 6, "carbs": 28, "fat": 10},
-    "waffles": {"price": 110, "calories": 291, "protein": 6, "carbs": 38, "fat": 13},
-    "cereal": {"price": 50, "calories": 379, "protein": 9, "carbs": 84, "fat": 3},
-    "oatmeal": {"price": 60, "calories": 68, "protein": 2.4, "carbs": 12, "fat": 1.4},
-    "granola": {"price": 90, "calories": 471, "protein": 11, "carbs": 61, "fat": 20},
-    
-    # Dairy & Eggs
-    "cheese": {"price": 60, "calories": 402, "protein": 25, "carbs": 1.3, "fat": 33},
-    "cheddar": {"price": 70, "calories": 403, "protein": 25, "carbs": 1.3, "fat": 33},
-    "mozzarella": {"price": 75, "calories": 280, "protein": 28, "carbs": 3, "fat": 17},
-    "parmesan": {"price": 85, "calories": 431, "protein": 38, "carbs": 4, "fat": 29},
-    "egg": {"price": 20, "calories": 155, "protein": 13, "carbs": 1.1, "fat": 11},
-    "boiled egg": {"price": 25, "calories": 155, "protein": 13, "carbs": 1.1, "fat": 11},
-    "fried egg": {"price": 30, "calories": 196, "protein": 14, "carbs": 1, "fat": 15},
-    "scrambled eggs": {"price": 50, "calories": 204, "protein": 14, "carbs": 3, "fat": 15},
-    "omelette": {"price": 90, "calories": 154, "protein": 11, "carbs": 1, "fat": 12},
-    "yogurt": {"price": 45, "calories": 59, "protein": 10, "carbs": 3.6, "fat": 0.4},
-    "milk": {"price": 55, "calories": 42, "protein": 3.4, "carbs": 5, "fat": 1},
-    "butter": {"price": 50, "calories": 717, "protein": 0.9, "carbs": 0.1, "fat": 81},
-    
-    # Beverages
-    "coffee": {"price": 70, "calories": 2, "protein": 0.3, "carbs": 0, "fat": 0},
-    "latte": {"price": 100, "calories": 103, "protein": 6, "carbs": 10, "fat": 4},
-    "cappuccino": {"price": 95, "calories": 80, "protein": 4, "carbs": 8, "fat": 4},
-    "espresso": {"price": 60, "calories": 3, "protein": 0.1, "carbs": 0.5, "fat": 0},
-    "tea": {"price": 40, "calories": 1, "protein": 0, "carbs": 0.3, "fat": 0},
-    "juice": {"price": 60, "calories": 45, "protein": 0.5, "carbs": 11, "fat": 0.1},
-    "orange juice": {"price": 65, "calories": 45, "protein": 0.7, "carbs": 10, "fat": 0.2},
-    "apple juice": {"price": 60, "calories": 46, "protein": 0.1, "carbs": 11, "fat": 0.1},
-    "smoothie": {"price": 120, "calories": 145, "protein": 3, "carbs": 32, "fat": 1.5},
-    "milkshake": {"price": 130, "calories": 350, "protein": 8, "carbs": 50, "fat": 13},
-    "soda": {"price": 50, "calories": 140, "protein": 0, "carbs": 39, "fat": 0},
-    "water": {"price": 25, "calories": 0, "protein": 0, "carbs": 0, "fat": 0},
-    
-    # Desserts
-    "cake": {"price": 130, "calories": 257, "protein": 3, "carbs": 36, "fat": 12},
-    "chocolate cake": {"price": 150, "calories": 352, "protein": 5, "carbs": 51, "fat": 15},
-    "cheesecake": {"price": 160, "calories": 321, "protein": 6, "carbs": 26, "fat": 23},
-    "cupcake": {"price": 80, "calories": 305, "protein": 3, "carbs": 45, "fat": 13},
-    "cookie": {"price": 50, "calories": 502, "protein": 5.9, "carbs": 64, "fat": 24},
-    "brownie": {"price": 90, "calories": 466, "protein": 6, "carbs": 50, "fat": 28},
-    "donut": {"price": 70, "calories": 452, "protein": 5, "carbs": 51, "fat": 25},
-    "pie": {"price": 120, "calories": 296, "protein": 2, "carbs": 44, "fat": 13},
-    "apple pie": {"price": 130, "calories": 296, "protein": 2, "carbs": 44, "fat": 13},
-    "ice cream": {"price": 80, "calories": 207, "protein": 3.5, "carbs": 24, "fat": 11},
-    "gelato": {"price": 100, "calories": 160, "protein": 3, "carbs": 20, "fat": 7},
-    "pudding": {"price": 70, "calories": 130, "protein": 3, "carbs": 20, "fat": 4},
-    "tiramisu": {"price": 140, "calories": 240, "protein": 5, "carbs": 21, "fat": 15},
-    "chocolate": {"price": 70, "calories": 546, "protein": 4.9, "carbs": 61, "fat": 31},
-    "candy": {"price": 50, "calories": 400, "protein": 0, "carbs": 100, "fat": 0},
+    return ResilientBackend(
+        backend,
+        timeout=INFERENCE_TIMEOUT,
+        breaker=breaker,
+        hedge=INFERENCE_HEDGE,
+        hedge_min_delay=INFERENCE_HEDGE_MIN_DELAY_MS / 1000,
+        max_workers=INFERENCE_CALL_CONCURRENCY
+    )
+
+# Built and warmed in the background (see warmup below); requests arriving
+# first wait up to INFERENCE_WARMUP_WAIT seconds for it
+INFERENCE_WARMUP_WAIT = float(os.environ.get('INFERENCE_WARMUP_WAIT', 10))
+inference_backend = None
+
+def warm_inference_backend():
+    global inference_backend
+    backend = build_inference_backend()
+    backend.warmup()
+    inference_backend = backend
+    startup_log.info("Inference backend '%s' initialized", backend.name)
+
+def get_inference_backend():
+    """The inference backend, waiting briefly for it on a cold worker; None if it isn't ready"""
+    if inference_backend is None:
+        warmup.start()
+        warmup.wait('inference_backend', INFERENCE_WARMUP_WAIT)
+    return inference_backend
+
+# Menu: the menu_items table, cached per worker as an immutable snapshot that is
+# swapped when a menu_changed notification arrives or the polled version moves
+MENU_POLL_INTERVAL = float(os.environ.get('MENU_POLL_INTERVAL', 5))
+MENU_LISTEN = os.environ.get('MENU_LISTEN', '1') == '1'
+
+menu_cache = MenuCache(db_pool, poll_interval=MENU_POLL_INTERVAL, listen=MENU_LISTEN)
+
+def warm_menu():
+    menu_cache.refresh(force=True)
+    menu_cache.start()
+
+# Startup work runs on background threads after the worker is up, so importing
+# the app stays fast and a database or model that is down at boot only delays
+# readiness (GET /health/ready) instead of crashing the worker. The seed menu
+# is served until the database copy loads.
+warmup = Warmup()
+warmup.add('inference_backend', warm_inference_backend)
+if DATABASE_URL:
+    warmup.add('database', init_db)
+    warmup.add('menu', warm_menu, required=False)
+
+def start_worker():
+    """Per-process startup; gunicorn calls it in each worker (see gunicorn.conf.py)"""
+    # A worker forked from a preloaded master inherits a dead log listener thread
+    configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT)
+    client_buckets.share(int(os.environ.get('GUNICORN_WORKERS') or os.environ.get('WEB_CONCURRENCY') or 1))
+    warmup.start()
+
+def classify_images(images):
+    """Classify a batch of images, returning predictions or an exception per image"""
+    return get_inference_backend().classify_batch(images)
+
+inference_batcher = MicroBatcher(
+    classify_images,
+    max_batch=INFERENCE_BATCH_MAX,
+    max_wait=INFERENCE_BATCH_MAX_WAIT_MS / 1000,
+    name='inference-batcher'
+)
+
+def query_huggingface(image_bytes, meta=None, content_sha256=None, original_bytes=None):
+    """Classify a food image with the configured inference backend
+
+    Pass original_bytes (the upload's size) when image_bytes was already
+    prepared for inference; it is then sent as is. content_sha256 must still
+    be the hash of the original upload so cache keys don't change.
+
+    If a dict is passed as meta it is filled with where the predictions came
+    from: source ("model" or "cache"), cache ("exact" or "near_duplicate"),
+    the Hamming distance of a near-duplicate hit, and the original and
+    uploaded image sizes in bytes (upload_bytes is None when nothing was sent).
+
+    Both cache tiers are consulted before the model, so cached images are
+    still answered while the model is failing. Otherwise None is returned and
+    meta gets source "degraded" with a reason ("warming", "circuit_open",
+    "timeout" or "error") and, for an open circuit, retry_after seconds.
+    """
+    if meta is None:
+        meta = {}
+    meta.update(source="model", cache=None, distance=None,
+                original_bytes=original_bytes or len(image_bytes), upload_bytes=None)
+    inference_log.debug("Classifying %d bytes with %s backend", len(image_bytes), INFERENCE_BACKEND)
     
-    # International Cuisine
-    "sushi": {"price": 350, "calories": 143, "protein": 6, "carbs": 21, "fat": 3.5},
-    "sashimi": {"price": 380, "calories": 127, "protein": 24, "carbs": 0, "fat": 3},
-    "tempura": {"price": 280, "calories": 350, "protein": 12, "carbs": 35, "fat": 18},
-    "pad thai": {"price": 220, "calories": 380, "protein": 15, "carbs": 50, "fat": 12},
-    "spring roll": {"price": 90, "calories": 140, "protein": 4, "carbs": 18, "fat": 6},
-    "dumpling": {"price": 130, "calories": 175, "protein": 7, "carbs": 22, "fat": 6},
-    "dim sum": {"price": 150, "calories": 200, "protein": 8, "carbs": 25, "fat": 7},
-    "curry": {"price": 240, "calories": 250, "protein": 12, "carbs": 20, "fat": 14},
-    "biryani": {"price": 200, "calories": 280, "protein": 15, "carbs": 38, "fat": 8},
-    "naan": {"price": 60, "calories": 262, "protein": 9, "carbs": 45, "fat": 5},
-    "paella": {"price": 300, "calories": 320, "protein": 18, "carbs": 42, "fat": 9},
-    "risotto": {"price": 250, "calories": 240, "protein": 6, "carbs": 38, "fat": 7},
+    cache_key = prediction_cache.key(image_bytes, content_sha256)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        inference_log.debug("Exact cache hit for %s", cache_key[:12])
+        meta.update(source="cache", cache="exact", distance=0)
+        metrics.PREDICTION_LOOKUPS.labels('exact_cache').inc()
+        return cached
     
-    # Misc
-    "meat": {"price": 250, "calories": 250, "protein": 26, "carbs": 0, "fat": 15},
-    "fruit": {"price": 60, "calories": 60, "protein": 0.5, "carbs": 15, "fat": 0.2},
-    "nuts": {"price": 100, "calories": 607, "protein": 20, "carbs": 21, "fat": 54},
-    "apple": {"price": 35, "calories": 52, "protein": 0.3, "carbs": 14, "fat": 0.2},
-    "banana": {"price": 30, "calories": 89, "protein": 1.1, "carbs": 23, "fat": 0.3},
-    "orange": {"price": 40, "calories": 47, "protein": 0.9, "carbs": 12, "fat": 0.1},
-    "grape": {"price": 80, "calories": 69, "protein": 0.7, "carbs": 18, "fat": 0.2},
-    "strawberry": {"price": 90, "calories": 32, "protein": 0.7, "carbs": 7.7, "fat": 0.3},
-    "watermelon": {"price": 50, "calories": 30, "protein": 0.6, "carbs": 8, "fat": 0.2},
-    "pineapple": {"price": 70, "calories": 50, "protein": 0.5, "carbs": 13, "fat": 0.1},
-    "mango": {"price": 75, "calories": 60, "protein": 0.8, "carbs": 15, "fat": 0.4},
-    "peach": {"price": 55, "calories": 39, "protein": 0.9, "carbs": 10, "fat": 0.3},
-    "pear": {"price": 50, "calories": 57, "protein": 0.4, "carbs": 15, "fat": 0.1},
-    "plum": {"price": 45, "calories": 46, "protein": 0.7, "carbs": 11, "fat": 0.3},
-    "kiwi": {"price": 60, "calories": 61, "protein": 1.1, "carbs": 15, "fat": 0.5},
-    "avocado": {"price": 95, "calories": 160, "protein": 2, "carbs": 9, "fat": 15},
-}
-
-def query_huggingface(image_bytes):
-    """Query Hugging Face API for food recognition using official client"""
-    print(f"[HF] Starting query with InferenceClient", file=sys.stderr)
-    print(f"[HF] Image size: {len(image_bytes)} bytes", file=sys.stderr)
+    image_hash = None
+    if NEAR_DUPLICATE_ENABLED:
+        try:
+            image_hash = image_hash_function(image_bytes)
+        except Exception as e:
+            inference_log.warning("Could not hash image: %s", e)
+        if image_hash is not None:
+            cached, distance = near_duplicate_index.lookup(image_hash)
+            if cached is not None:
+                inference_log.debug("Near-duplicate cache hit at distance %d", distance)
+                meta.update(source="cache", cache="near_duplicate", distance=distance)
+                metrics.PREDICTION_LOOKUPS.labels('near_duplicate').inc()
+                return cached
     
-    if not client:
-        print(f"[HF] ERROR: Client not initialized", file=sys.stderr)
+    backend = get_inference_backend()
+    if backend is None:
+        inference_log.error("Inference backend not initialized")
+        meta.update(source="degraded", reason="warming")
+        metrics.INFERENCE_DEGRADED.labels('warming').inc()
         return None
     
+    upload_bytes = image_bytes
+    if INFERENCE_PREPROCESS and original_bytes is None:
+        try:
+            upload_bytes = prepare_for_inference(
+                image_bytes,
+                target_size=INFERENCE_IMAGE_SIZE,
+                quality=INFERENCE_JPEG_QUALITY
+            )
+        except Exception as e:
+            inference_log.warning("Preprocessing failed, sending original: %s", e)
+    meta["upload_bytes"] = len(upload_bytes)
+    metrics.PREDICTION_LOOKUPS.labels('model').inc()
+    
     try:
-        print(f"[HF] Calling image_classification on nateraw/food model", file=sys.stderr)
+        inference_log.debug("Sending %d bytes to %s", len(upload_bytes), INFERENCE_MODEL)
         
-        # Save bytes to temporary file for API
-        import tempfile
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
-            tmp_file.write(image_bytes)
-            tmp_path = tmp_file.name
+        # Bytes go straight to the backend, no temporary file
+        if INFERENCE_BATCHING:
+            result = inference_batcher(upload_bytes)
+        else:
+            result = backend.classify(upload_bytes)
         
-        try:
-            # Call the image classification API with file path
-            predictions = client.image_classification(
-                image=tmp_path,
-                model="nateraw/food"
-            )
-            
-            print(f"[HF] Raw predictions: {predictions}", file=sys.stderr)
-            
-            # Convert to expected format if needed
-            if isinstance(predictions, list):
-                result = [{"label": p.get("label", ""), "score": p.get("score", 0)} for p in predictions]
-            else:
-                result = predictions
-                
-            print(f"[HF] Success! Got {len(result)} predictions", file=sys.stderr)
-            return result
-        finally:
-            # Clean up temp file
-            import os
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
+        inference_log.debug("Raw predictions: %s", result)
+        if isinstance(result, list) and result:
+            prediction_cache.set(cache_key, result)
+            if image_hash is not None:
+                near_duplicate_index.add(image_hash, result)
+        return result
         
+    except CircuitOpen as e:
+        inference_log.warning("Inference skipped: %s", e)
+        meta.update(source="degraded", reason="circuit_open", retry_after=round(e.retry_after))
+        metrics.INFERENCE_DEGRADED.labels('circuit_open').inc()
+        return None
+    except CallTimeout as e:
+        inference_log.warning("Inference timed out: %s", e)
+        meta.update(source="degraded", reason="timeout")
+        metrics.INFERENCE_DEGRADED.labels('timeout').inc()
+        return None
     except Exception as e:
-        print(f"[HF] ERROR: {type(e).__name__}: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc(file=sys.stderr)
+        inference_log.exception("Inference failed: %s: %s", type(e).__name__, e)
+        metrics.ERRORS.labels('inference').inc()
+        meta.update(source="degraded", reason="error")
+        metrics.INFERENCE_DEGRADED.labels('error').inc()
         return None
 
+def degraded_result(meta):
+    """Failure body for an image the model couldn't classify, flagged as degraded"""
+    return {
+        "success": False,
+        "degraded": True,
+        "error": "Food recognition is temporarily unavailable",
+        "details": f"Model unavailable ({meta['reason']}); enter the items manually or retry",
+        "inference": meta
+    }
+
 def match_food_items(predictions):
     """Match predictions to food database"""
-    print(f"[MATCH] Matching predictions to database", file=sys.stderr)
+    menu = menu_cache.current()
     matched_items = []
     seen_foods = set()
     
     for pred in predictions[:10]:  # Check top 10 predictions
         label = pred.get('label', '').lower()
         score = pred.get('score', 0)
-        print(f"[MATCH] Checking: {label} (score: {score})", file=sys.stderr)
+        match_log.debug("Checking: %s (score: %s)", label, score)
+        
+        if score <= 0.05:
+            continue
         
-        # Try to match with database
-        for food_key in FOOD_DATABASE.keys():
-            if food_key in label and food_key not in seen_foods and score > 0.05:
-                food_info = FOOD_DATABASE[food_key].copy()
-                food_info['name'] = food_key.capitalize()
-                food_info['confidence'] = round(score * 100, 2)
-                matched_items.append(food_info)
-                seen_foods.add(food_key)
-                print(f"[MATCH] MATCHED: {food_key}", file=sys.stderr)
-                break
+        # Longest, most specific menu phrase in the label wins
+        food_key = menu.matcher.match(label, exclude=seen_foods)
+        if food_key is not None:
+            food_info = menu.items[food_key].copy()
+            food_info['name'] = food_key.capitalize()
+            food_info['confidence'] = round(score * 100, 2)
+            matched_items.append(food_info)
+            seen_foods.add(food_key)
+            match_log.debug("Matched: %s", food_key)
     
     # If no matches found, return most common canteen items
     if not matched_items:
-        print(f"[MATCH] No matches found, using defaults", file=sys.stderr)
-        default_items = ['rice', 'chicken', 'salad']
+        match_log.info("No predictions matched the menu, using defaults")
+        metrics.DEFAULT_MATCHES.inc()
+        default_items = [item for item in ('rice', 'chicken', 'salad') if item in menu.items]
         for item in default_items:
-            food_info = FOOD_DATABASE[item].copy()
+            food_info = menu.items[item].copy()
             food_info['name'] = item.capitalize()
             food_info['confidence'] = 85.0
             matched_items.append(food_info)
     
-    print(f"[MATCH] Total matched items: {len(matched_items)}", file=sys.stderr)
+    match_log.debug("Total matched items: %d", len(matched_items))
     return matched_items
 
 def calculate_totals(items):
@@ -365,264 +661,681 @@ def calculate_totals(items):
         'total_fat': round(total_fat, 1)
     }
 
-def save_transaction(items):
-    """Save transaction items to database"""
-    conn = get_db_connection()
-    if not conn:
-        print(f"[DB] ERROR: Could not save transaction", file=sys.stderr)
-        return False
-    
+def save_transaction(items, transaction_id=None):
+    """Save a tray as one transaction (queued when DB_WRITE_MODE=async)"""
+    saved = transaction_writer.submit(items, transaction_id)
+    if saved:
+        db_log.debug("Stored %d items (%s)", len(items), transaction_writer.mode)
+    else:
+        db_log.error("Could not save transaction")
+    return saved
+
+def save_transactions(item_lists, transaction_ids=None):
+    """Save several trays in a single database transaction"""
+    saved = transaction_writer.submit_many(item_lists, transaction_ids)
+    if saved:
+        db_log.debug("Stored %d transactions (%s)", len(item_lists), transaction_writer.mode)
+    else:
+        db_log.error("Could not save %d transactions", len(item_lists))
+    return saved
+
+def attach_receipts(results, timestamp):
+    """Store a receipt for each analyzed tray and add its id and URL to the result
+
+    A receipt shares its id with the tray's transaction. If the receipts can't
+    be stored the rendered HTML is returned inline instead, so the client
+    always gets a receipt.
+    """
+    receipts = [new_receipt(r["items"], r["totals"], timestamp, r.get("transaction_id")) for r in results]
     try:
-        cur = conn.cursor()
-        for item in items:
-            cur.execute("""
-                INSERT INTO food_transactions 
-                (food_name, price, calories, protein, carbs, fat, confidence)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (
-                item['name'],
-                item['price'],
-                item['calories'],
-                item['protein'],
-                item['carbs'],
-                item['fat'],
-                item['confidence']
-            ))
-        conn.commit()
-        cur.close()
-        conn.close()
-        print(f"[DB] Saved {len(items)} items to database", file=sys.stderr)
-        return True
+        receipt_service.save_many(receipts)
+        stored = True
     except Exception as e:
-        print(f"[DB] ERROR saving transaction: {e}", file=sys.stderr)
-        if conn:
-            conn.close()
-        return False
-
-def generate_receipt_html(items, totals, timestamp):
-    """Generate HTML receipt"""
-    items_html = ""
-    for item in items:
-        items_html += f"""
-        <tr>
-            <td>{item['name']}</td>
-            <td>{item['price']} MKD</td>
-            <td>{item['calories']} kcal</td>
-            <td>{item['protein']}g</td>
-            <td>{item['carbs']}g</td>
-            <td>{item['fat']}g</td>
-            <td>{item['confidence']}%</td>
-        </tr>
-        """
-    
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{
-                font-family: 'Courier New', monospace;
-                max-width: 800px;
-                margin: 40px auto;
-                padding: 20px;
-                background: #f5f5f5;
-            }}
-            .receipt {{
-                background: white;
-                padding: 30px;
-                border: 2px dashed #333;
-                box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-            }}
-            .header {{
-                text-align: center;
-                border-bottom: 2px solid #333;
-                padding-bottom: 20px;
-                margin-bottom: 20px;
-            }}
-            .header h1 {{
-                margin: 0;
-                font-size: 28px;
-            }}
-            .header p {{
-                margin: 5px 0;
-                color: #666;
-            }}
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin: 20px 0;
-            }}
-            th, td {{
-                padding: 10px;
-                text-align: left;
-                border-bottom: 1px solid #ddd;
-            }}
-            th {{
-                background: #f0f0f0;
-                font-weight: bold;
-            }}
-            .totals {{
-                border-top: 3px double #333;
-                padding-top: 15px;
-                margin-top: 20px;
-            }}
-            .totals table {{
-                margin: 0;
-            }}
-            .totals td {{
-                border: none;
-                padding: 5px 10px;
-            }}
-            .total-row {{
-                font-weight: bold;
-                font-size: 18px;
-            }}
-            .footer {{
-                text-align: center;
-                margin-top: 30px;
-                padding-top: 20px;
-                border-top: 2px solid #333;
-                color: #666;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="receipt">
-            <div class="header">
-                <h1>🍽️ CAMPUS CANTEEN</h1>
-                <p>AI-Powered Food Recognition System</p>
-                <p>Receipt Date: {timestamp}</p>
-            </div>
-            
-            <h2>Detected Items</h2>
-            <table>
-                <thead>
-                    <tr>
-                        <th>Item</th>
-                        <th>Price</th>
-                        <th>Calories</th>
-                        <th>Protein</th>
-                        <th>Carbs</th>
-                        <th>Fat</th>
-                        <th>Confidence</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {items_html}
-                </tbody>
-            </table>
-            
-            <div class="totals">
-                <h2>Totals</h2>
-                <table>
-                    <tr>
-                        <td>Total Price:</td>
-                        <td class="total-row">{totals['total_price']} MKD</td>
-                    </tr>
-                    <tr>
-                        <td>Total Calories:</td>
-                        <td class="total-row">{totals['total_calories']} kcal</td>
-                    </tr>
-                    <tr>
-                        <td>Total Protein:</td>
-                        <td>{totals['total_protein']}g</td>
-                    </tr>
-                    <tr>
-                        <td>Total Carbohydrates:</td>
-                        <td>{totals['total_carbs']}g</td>
-                    </tr>
-                    <tr>
-                        <td>Total Fat:</td>
-                        <td>{totals['total_fat']}g</td>
-                    </tr>
-                </table>
-            </div>
-            
-            <div class="footer">
-                <p>Thank you for using our AI Food Recognition System!</p>
-                <p>Mobile Wireless Networks Project</p>
-                <p>Powered by Hugging Face AI</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    return html
+        db_log.error("Could not store %d receipts, returning them inline: %s", len(receipts), e)
+        stored = False
+    for result, receipt in zip(results, receipts):
+        if stored:
+            result["receipt_id"] = receipt["id"]
+            result["receipt_url"] = f"/receipts/{receipt['id']}"
+        if RECEIPT_INLINE_HTML or not stored:
+            result["receipt_html"] = render_receipt(result["items"], result["totals"], timestamp)
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "service": "food-recognition-api"})
+    return jsonify({
+        "status": "healthy",
+        "service": "food-recognition-api",
+        "ready": warmup.ready(),
+        "warmup": warmup.status(),
+        "inference_backend": INFERENCE_BACKEND,
+        "inference_calls": inference_backend.stats() if inference_backend is not None else None,
+        "db_pool": db_pool.stats(),
+        "db_writer": transaction_writer.stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "near_duplicate_index": near_duplicate_index.stats(),
+        "inference_batcher": inference_batcher.stats(),
+        "jobs": async_jobs.stats(),
+        "receipts": receipt_service.stats(),
+        "idempotency": idempotency.stats(),
+        "admission": dict(admission.stats(), clients=client_buckets.stats()),
+        "responses": dict(response_compressor.stats(), json_encoder=json_encoder),
+        "menu": menu_cache.stats()
+    })
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: 503 until the required warmup tasks have finished"""
+    if warmup.ready():
+        return jsonify({"status": "ready", "warmup": warmup.status()})
+    return jsonify({"status": "warming", "warmup": warmup.status()}), 503
+
+@app.route('/menu', methods=['GET'])
+def get_menu():
+    """The menu this worker is currently serving"""
+    menu = menu_cache.current()
+    return jsonify({
+        "version": menu.version,
+        "items": {name: dict(info) for name, info in menu.items.items()}
+    })
+
+def submit_analyze_job(image_bytes):
+    """Queue an analyze job and return its id without waiting for inference"""
+    try:
+        job_id = async_jobs.submit(image_bytes)
+    except JobQueueFull as e:
+        request_log.warning("Job queue full: %s", e)
+        response = jsonify({"error": "Too many queued jobs, retry later"})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    request_log.info("Queued analyze job %s", job_id, extra={'job_id': job_id})
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll an async analyze job"""
+    job = async_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events stream of an async job's status changes"""
+    if async_jobs.get(job_id) is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    
+    def generate():
+        last_status = None
+        last_sent = started = time.monotonic()
+        while True:
+            job = async_jobs.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job expired'})}\n\n"
+                return
+            now = time.monotonic()
+            if job["status"] != last_status:
+                last_status = job["status"]
+                last_sent = now
+                yield f"event: {last_status}\ndata: {json.dumps(job)}\n\n"
+                if last_status in FINISHED_STATUSES:
+                    return
+            elif now - last_sent > 15:
+                last_sent = now
+                yield ": keep-alive\n\n"
+            if now - started > ASYNC_JOB_EVENTS_TIMEOUT:
+                yield f"event: timeout\ndata: {json.dumps({'status_url': f'/jobs/{job_id}'})}\n\n"
+                return
+            time.sleep(ASYNC_JOB_POLL_INTERVAL)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def admitted(view):
+    """Route decorator: per-kiosk rate limit, then the adaptive concurrency limit"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMISSION_ENABLED:
+            return view(*args, **kwargs)
+        kiosk = request.headers.get('X-Kiosk-Id')
+        wait = client_buckets.take(kiosk[:64]) if kiosk else 0
+        if wait:
+            metrics.ADMISSION_REJECTIONS.labels('rate_limited').inc()
+            response = jsonify({"error": "Too many requests from this kiosk, slow down"})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(max(1, round(wait)))
+            return response
+        try:
+            token = admission.acquire()
+        except Overloaded as e:
+            request_log.warning("Shed request: %s", e.reason)
+            metrics.ADMISSION_REJECTIONS.labels(e.reason).inc()
+            response = jsonify({"error": "Server is busy, retry shortly", "reason": e.reason})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        status = 500
+        try:
+            response = app.make_response(view(*args, **kwargs))
+            status = response.status_code
+            return response
+        except HTTPException as e:
+            # A rejected upload (413, 415) says nothing about the server's capacity
+            status = e.code or 500
+            raise
+        finally:
+            admission.release(token, dropped=status >= 500)
+    return wrapper
+
+def request_fingerprint():
+    """SHA-256 over the query string and every uploaded file, to spot a key reused for another request"""
+    digest = hashlib.sha256(request.query_string)
+    for field, upload in request.files.items(multi=True):
+        # Uploads were hashed while they streamed in
+        digest.update(f"\0{field}\0{upload.stream.sha256}".encode('utf-8'))
+    return digest.hexdigest()
+
+def idempotent(scope):
+    """Route decorator honouring an Idempotency-Key header
+
+    Responses below 500 (except 429) are recorded and replayed, with an
+    Idempotent-Replayed header, to later requests from the same kiosk carrying
+    the same key; errors release the key so a retry runs again. If the store
+    is unreachable the request runs as if no key was sent. Apply it outside
+    @admitted, so a duplicate waiting for the first request's response
+    doesn't hold an admission slot.
+
+    Keys are scoped by the X-Kiosk-Id header, and a key sent without one is
+    rejected with 400: behind the platform router or a campus NAT the client
+    address is shared by every kiosk, so it can't tell their keys apart.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key', '')
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > 255 or not key.isprintable():
+                return jsonify({"error": "Idempotency-Key must be 1-255 printable characters"}), 400
+            kiosk = request.headers.get('X-Kiosk-Id', '')
+            if not kiosk:
+                return jsonify({"error": "Idempotency-Key needs an X-Kiosk-Id header"}), 400
+            # Keys are only unique per kiosk: two kiosks may well pick the same one
+            client_key = hashlib.sha256(f"{kiosk[:64]}\0{key}".encode('utf-8')).hexdigest()
+            key = f"{scope}:{client_key}"
+            fingerprint = request_fingerprint()
+            try:
+                recorded = idempotency.begin(key, fingerprint)
+            except IdempotencyConflict:
+                return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+            except IdempotencyInProgress:
+                response = jsonify({"error": "A request with this Idempotency-Key is still in progress"})
+                response.status_code = 409
+                response.headers['Retry-After'] = '1'
+                return response
+            except Exception as e:
+                request_log.warning("Idempotency store unavailable, running without it: %s", e)
+                idempotency.store_failed()
+                return view(*args, **kwargs)
+            if recorded is not None:
+                status, body = recorded
+                request_log.info("Replaying recorded response for Idempotency-Key")
+                response = jsonify(body)
+                response.status_code = status
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            
+            response = None
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            finally:
+                try:
+                    # 429 comes from the rate limit, not the request: let the retry run
+                    if response is not None and response.status_code < 500 and response.status_code != 429 \
+                            and response.is_json:
+                        idempotency.complete(key, response.status_code, response.get_json())
+                    else:
+                        idempotency.release(key)
+                except Exception as e:
+                    request_log.warning("Could not record response for Idempotency-Key: %s", e)
+                    idempotency.store_failed()
+            return response
+        return wrapper
+    return decorator
 
 @app.route('/analyze', methods=['POST'])
+@metrics.track_requests('analyze')
+@idempotent('analyze')
+@admitted
 def analyze_food():
     """Analyze food image and return results"""
-    print(f"\n[ANALYZE] ========== NEW REQUEST ==========", file=sys.stderr)
     try:
         if 'image' not in request.files:
-            print(f"[ANALYZE] ERROR: No image in request", file=sys.stderr)
+            request_log.warning("No image in request")
+            metrics.ERRORS.labels('no_image').inc()
             return jsonify({"error": "No image provided"}), 400
         
         image_file = request.files['image']
-        print(f"[ANALYZE] Image filename: {image_file.filename}", file=sys.stderr)
-        image_bytes = image_file.read()
-        print(f"[ANALYZE] Image size: {len(image_bytes)} bytes", file=sys.stderr)
+        with metrics.timed('upload_read'):
+            upload = image_file.stream.finish()
+        image_bytes = upload.content
+        if not image_bytes:
+            metrics.ERRORS.labels('no_image').inc()
+            return jsonify({"error": "No image provided"}), 400
+        request_log.debug("Received %s (%d bytes, %s)", image_file.filename, len(image_bytes), upload.format)
+        
+        if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            return submit_analyze_job(image_bytes)
         
         # Query Hugging Face API
-        print(f"[ANALYZE] Calling Hugging Face API...", file=sys.stderr)
-        predictions = query_huggingface(image_bytes)
+        prediction_meta = {}
+        with metrics.timed('query_huggingface'):
+            predictions = query_huggingface(image_bytes, prediction_meta, upload.sha256)
+        
+        if not predictions and prediction_meta["source"] == "degraded":
+            response = jsonify(degraded_result(prediction_meta))
+            response.status_code = 503
+            if prediction_meta.get("retry_after"):
+                response.headers['Retry-After'] = str(prediction_meta["retry_after"])
+            return response
         
         if not predictions:
-            print(f"[ANALYZE] ERROR: No predictions returned from HF", file=sys.stderr)
+            request_log.error("No predictions returned from inference")
+            metrics.ERRORS.labels('no_predictions').inc()
             return jsonify({
                 "error": "Failed to analyze image", 
                 "details": "Hugging Face API returned no predictions. Check backend logs."
             }), 500
         
-        print(f"[ANALYZE] Got {len(predictions)} predictions from HF", file=sys.stderr)
-        
         # Match predictions to food database
-        matched_items = match_food_items(predictions)
-        print(f"[ANALYZE] Matched {len(matched_items)} items", file=sys.stderr)
+        with metrics.timed('match_food_items'):
+            matched_items = match_food_items(predictions)
         
         # Calculate totals
-        totals = calculate_totals(matched_items)
-        print(f"[ANALYZE] Calculated totals: {totals}", file=sys.stderr)
+        with metrics.timed('calculate_totals'):
+            totals = calculate_totals(matched_items)
         
         # Save to database
-        save_transaction(matched_items)
+        transaction_id = uuid.uuid4().hex
+        with metrics.timed('save_transaction'):
+            save_transaction(matched_items, transaction_id)
         
         # Generate timestamp
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # Generate receipt HTML
-        receipt_html = generate_receipt_html(matched_items, totals, timestamp)
-        
-        print(f"[ANALYZE] SUCCESS! Returning results", file=sys.stderr)
-        return jsonify({
+        result = {
             "success": True,
+            "transaction_id": transaction_id,
             "items": matched_items,
             "totals": totals,
             "timestamp": timestamp,
-            "receipt_html": receipt_html
-        })
+            "inference": prediction_meta
+        }
+        
+        # Store the receipt; the client fetches it from receipt_url when needed
+        with metrics.timed('save_receipt'):
+            attach_receipts([result], timestamp)
+        
+        request_log.info(
+            "Analyzed image: %d items, %s MKD", len(matched_items), totals['total_price'],
+            extra={'prediction_source': prediction_meta['source'], 'image_bytes': len(image_bytes)}
+        )
+        with metrics.timed('json_serialization'):
+            response = shaped_json(result)
+        return response
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ANALYZE] ERROR Exception: {type(e).__name__}: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc(file=sys.stderr)
+        request_log.exception("Analyze failed: %s: %s", type(e).__name__, e)
+        metrics.ERRORS.labels('exception').inc()
         return jsonify({
             "error": "Failed to analyze image",
             "details": str(e),
             "type": type(e).__name__
         }), 500
 
+def analyze_image_bytes(image_bytes, content_sha256=None, original_bytes=None):
+    """Run inference, matching and totals for one image (nothing is persisted)"""
+    prediction_meta = {}
+    with metrics.timed('query_huggingface'):
+        predictions = query_huggingface(image_bytes, prediction_meta, content_sha256, original_bytes)
+    if not predictions and prediction_meta["source"] == "degraded":
+        return degraded_result(prediction_meta)
+    if not predictions:
+        metrics.ERRORS.labels('no_predictions').inc()
+        return {
+            "success": False,
+            "error": "Failed to analyze image",
+            "details": "Hugging Face API returned no predictions. Check backend logs."
+        }
+    with metrics.timed('match_food_items'):
+        matched_items = match_food_items(predictions)
+    with metrics.timed('calculate_totals'):
+        totals = calculate_totals(matched_items)
+    return {
+        "success": True,
+        "items": matched_items,
+        "totals": totals,
+        "inference": prediction_meta
+    }
+
+def _read_batch_upload(image_file):
+    """(filename, bytes to classify, sha256, original size) for one batch image
+
+    With preprocessing on, the image is downscaled straight from its spooled
+    file and the spool is released, so a batch holds one full-size image at a
+    time rather than all of them.
+    """
+    stream = image_file.stream
+    if INFERENCE_PREPROCESS:
+        try:
+            prepared = prepare_for_inference(
+                stream,
+                target_size=INFERENCE_IMAGE_SIZE,
+                quality=INFERENCE_JPEG_QUALITY
+            )
+            stream.close()
+            return image_file.filename, prepared, stream.sha256, stream.size
+        except Exception as e:
+            request_log.warning("Preprocessing %s failed, sending original: %s", image_file.filename, e)
+    upload = stream.finish()
+    return image_file.filename, upload.content, upload.sha256, stream.size
+
+def _analyze_batch_image(image_bytes, content_sha256, original_bytes):
+    try:
+        return analyze_image_bytes(image_bytes, content_sha256, original_bytes)
+    except Exception as e:
+        request_log.exception("Batch image failed: %s: %s", type(e).__name__, e)
+        metrics.ERRORS.labels('exception').inc()
+        return {
+            "success": False,
+            "error": "Failed to analyze image",
+            "details": str(e),
+            "type": type(e).__name__
+        }
+
+@app.route('/analyze-batch', methods=['POST'])
+@metrics.track_requests('analyze_batch')
+@idempotent('analyze_batch')
+@admitted
+def analyze_batch():
+    """Analyze several food images in one request
+
+    Images are sent as repeated "images" (or "image") multipart fields and
+    classified concurrently. Each result carries its own success flag, so one
+    bad image doesn't fail the batch. All successful trays are saved together.
+    """
+    try:
+        image_files = request.files.getlist('images') + request.files.getlist('image')
+        if not image_files:
+            request_log.warning("No images in batch request")
+            return jsonify({"error": "No images provided"}), 400
+        if len(image_files) > BATCH_MAX_IMAGES:
+            return jsonify({"error": f"Too many images (max {BATCH_MAX_IMAGES})"}), 400
+        
+        # Read uploads one by one on the request thread; file streams aren't thread-safe
+        uploads = [_read_batch_upload(f) for f in image_files]
+        request_log.debug("Batch of %d images, %d bytes",
+                          len(uploads), sum(f.stream.size for f in image_files))
+        
+        # Each task runs in a copy of this request's context so its logs keep the request id
+        futures = [
+            batch_executor.submit(contextvars.copy_context().run, _analyze_batch_image, content, sha256, size)
+            for _, content, sha256, size in uploads
+        ]
+        results = []
+        for index, ((filename, *_), future) in enumerate(zip(uploads, futures)):
+            result = future.result()
+            result["index"] = index
+            result["filename"] = filename
+            results.append(result)
+        
+        succeeded = [r for r in results if r["success"]]
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for result in succeeded:
+            result["transaction_id"] = uuid.uuid4().hex
+        if succeeded:
+            attach_receipts(succeeded, timestamp)
+        
+        saved = save_transactions(
+            [r["items"] for r in succeeded], [r["transaction_id"] for r in succeeded]
+        ) if succeeded else False
+        
+        request_log.info("Analyzed batch: %d/%d images succeeded", len(succeeded), len(results))
+        return shaped_json({
+            "success": bool(succeeded),
+            "count": len(results),
+            "succeeded": len(succeeded),
+            "failed": len(results) - len(succeeded),
+            "saved": saved,
+            "totals": calculate_totals([item for r in succeeded for item in r["items"]]),
+            "timestamp": timestamp,
+            "results": results
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        request_log.exception("Batch analyze failed: %s: %s", type(e).__name__, e)
+        return jsonify({
+            "error": "Failed to analyze images",
+            "details": str(e),
+            "type": type(e).__name__
+        }), 500
+
+def report_range():
+    """Inclusive ?from=&to= dates (YYYY-MM-DD), defaulting to the last REPORT_DEFAULT_DAYS days"""
+    end = request.args.get('to')
+    end = date.fromisoformat(end) if end else datetime.now(sales_rollups.tz).date()
+    start = request.args.get('from')
+    start = date.fromisoformat(start) if start else end - timedelta(days=REPORT_DEFAULT_DAYS - 1)
+    if start > end:
+        raise ValueError("'from' is after 'to'")
+    if (end - start).days >= REPORT_MAX_DAYS:
+        raise ValueError(f"Range is longer than {REPORT_MAX_DAYS} days")
+    return start, end
+
+def run_report(query, *args):
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            return query(cur, *args)
+
+@app.route('/reports/daily', methods=['GET'])
+def daily_report():
+    """Items, revenue and nutrition totals per day"""
+    try:
+        start, end = report_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        days = run_report(sales_rollups.daily, start, end)
+    except Exception as e:
+        db_log.error("Daily report failed: %s", e)
+        return jsonify({"error": "Reports are unavailable"}), 503
+    return jsonify({
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "timezone": REPORT_TIMEZONE,
+        "days": days
+    })
+
+@app.route('/reports/hourly', methods=['GET'])
+def hourly_report():
+    """Items, revenue and nutrition totals per hour of one day (?date=, default today)"""
+    try:
+        day = request.args.get('date')
+        day = date.fromisoformat(day) if day else datetime.now(sales_rollups.tz).date()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        hours = run_report(sales_rollups.hourly, day)
+    except Exception as e:
+        db_log.error("Hourly report failed: %s", e)
+        return jsonify({"error": "Reports are unavailable"}), 503
+    return jsonify({
+        "date": day.isoformat(),
+        "timezone": REPORT_TIMEZONE,
+        "hours": hours
+    })
+
+@app.route('/reports/top-foods', methods=['GET'])
+def top_foods_report():
+    """Best-selling foods over a date range, ranked by ?by= (default revenue)"""
+    order_by = request.args.get('by', 'revenue')
+    try:
+        start, end = report_range()
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+        if order_by not in rollup_measures:
+            raise ValueError(f"'by' must be one of {', '.join(rollup_measures)}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        foods = run_report(sales_rollups.top_foods, start, end, order_by, limit)
+    except Exception as e:
+        db_log.error("Top foods report failed: %s", e)
+        return jsonify({"error": "Reports are unavailable"}), 503
+    return jsonify({
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "timezone": REPORT_TIMEZONE,
+        "by": order_by,
+        "foods": foods
+    })
+
+def parse_time(value):
+    """ISO 8601 date or datetime; without an offset it is taken as REPORT_TIMEZONE time"""
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=sales_rollups.tz)
+
+def history_filters():
+    """?from= (inclusive), ?to= (exclusive) and ?food_name= shared by the history endpoints"""
+    return parse_time(request.args.get('from')), parse_time(request.args.get('to')), request.args.get('food_name') or None
+
+@app.route('/transactions', methods=['GET'])
+def transactions():
+    """Stored transactions, newest first; follow next_cursor for older pages"""
+    try:
+        start, end, food_name = history_filters()
+        limit = min(max(int(request.args.get('limit', TRANSACTIONS_PAGE_SIZE)), 1), TRANSACTIONS_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                page, next_cursor = list_transactions(cur, start, end, food_name, limit, after)
+    except Exception as e:
+        db_log.error("Listing transactions failed: %s", e)
+        return jsonify({"error": "Transactions are unavailable"}), 503
+    return jsonify({
+        "transactions": page,
+        "count": len(page),
+        "next_cursor": next_cursor
+    })
+
+@app.route('/transactions/export', methods=['GET'])
+def export_transactions():
+    """Stream every matching item row as CSV (default) or NDJSON (?format=ndjson)"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    try:
+        start, end, food_name = history_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if not export_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many exports running, retry later"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    try:
+        conn = db_pool.getconn()
+    except Exception as e:
+        export_slots.release()
+        db_log.error("Export failed: %s", e)
+        return jsonify({"error": "Transactions are unavailable"}), 503
+    
+    def release():
+        db_pool.putconn(conn)
+        export_slots.release()
+    
+    batches = export_batches(conn, start, end, food_name, batch_size=EXPORT_BATCH_SIZE)
+    chunks = csv_chunks(batches) if export_format == 'csv' else ndjson_chunks(batches)
+    filename = f"transactions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    response = Response(
+        stream_with_context(chunks),
+        mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Runs after the stream finishes or the client disconnects
+    response.call_on_close(release)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics, aggregated across gunicorn workers"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+def receipt_response(receipt_id, download=False):
+    """Stored receipt as HTML with caching headers, or None if it doesn't exist"""
+    etag = receipt_etag(receipt_id)
+    if request.if_none_match.contains_weak(etag):
+        # Receipts are immutable, so a matching ETag needs no lookup; compressed
+        # responses carry the weak form of it
+        response = Response(status=304)
+    else:
+        receipt_html = receipt_service.render(receipt_id)
+        if receipt_html is None:
+            return None
+        response = Response(receipt_html, mimetype='text/html')
+        if download:
+            response.headers['Content-Disposition'] = f'attachment; filename="receipt_{receipt_id}.html"'
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = RECEIPT_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/receipts/<receipt_id>', methods=['GET'])
+def get_receipt(receipt_id):
+    """Serve a stored receipt; ?download=1 sends it as a file"""
+    download = request.args.get('download', '').lower() in ('1', 'true', 'yes')
+    response = receipt_response(receipt_id, download) if RECEIPT_ID_PATTERN.fullmatch(receipt_id) else None
+    if response is None:
+        return jsonify({"error": "Receipt not found"}), 404
+    return response
+
 @app.route('/download-receipt', methods=['POST'])
+@admitted
 def download_receipt():
-    """Generate and return receipt as downloadable HTML file"""
+    """Return a receipt as a downloadable HTML file
+
+    Takes {"receipt_id": ...} for stored receipts. Posting the full
+    {"receipt_html": ...} back still works for older clients.
+    """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
+        receipt_id = data.get('receipt_id', '')
+        if receipt_id:
+            response = receipt_response(receipt_id, download=True) if RECEIPT_ID_PATTERN.fullmatch(receipt_id) else None
+            if response is None:
+                return jsonify({"error": "Receipt not found"}), 404
+            return response
+        
         receipt_html = data.get('receipt_html', '')
         
         if not receipt_html:
@@ -643,9 +1356,10 @@ def download_receipt():
         )
     
     except Exception as e:
-        print(f"Error in download_receipt: {e}", file=sys.stderr)
+        request_log.exception("Error in download_receipt: %s", e)
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
+    start_worker()
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1 @@
+"""Offline microbenchmarks for the CPU side of the request path (see run.py)"""
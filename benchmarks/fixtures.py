@@ -0,0 +1,49 @@
+"""Deterministic inputs for the benchmarks: predictions, scaled menus and trays"""
+import random
+
+from inference_backends import FOOD101_LABELS
+from menu import FOOD_ALIASES, FOOD_DATABASE
+
+# Menu variants are "<qualifier> <dish>" and "<qualifier> <qualifier> <dish>",
+# so scaled menus keep realistic multi-word phrases for the matcher
+QUALIFIERS = (
+    'grilled', 'baked', 'spicy', 'house', 'vegan', 'mini', 'large', 'smoked',
+    'stuffed', 'crispy', 'creamy', 'garlic', 'lemon', 'honey', 'roasted',
+)
+
+
+def predictions(count=200, top_k=5, seed=101):
+    """Food-101 style prediction lists: top_k labels each, scores decaying like a softmax tail"""
+    rng = random.Random(seed)
+    lists = []
+    for _ in range(count):
+        labels = rng.sample(FOOD101_LABELS, top_k)
+        weight = rng.uniform(0.4, 0.9)
+        lists.append([
+            {'label': label, 'score': round(weight * (1 - weight) ** i, 4)}
+            for i, label in enumerate(labels)
+        ])
+    return lists
+
+
+def scaled_menu(factor):
+    """(items, aliases) with ``factor`` times as many dishes as the seed menu"""
+    items = dict(FOOD_DATABASE)
+    variants = [f"{q} " for q in QUALIFIERS]
+    variants += [f"{a} {b} " for a in QUALIFIERS for b in QUALIFIERS if a != b]
+    for prefix in variants[:max(0, factor - 1)]:
+        for name, info in FOOD_DATABASE.items():
+            items[prefix + name] = dict(info, price=info['price'] + len(prefix))
+    return items, dict(FOOD_ALIASES)
+
+
+def tray(item_count, seed=7):
+    """Matched items as match_food_items() returns them, for totals and receipts"""
+    rng = random.Random(seed)
+    names = sorted(FOOD_DATABASE)
+    items = []
+    for _ in range(item_count):
+        name = rng.choice(names)
+        item = dict(FOOD_DATABASE[name], name=name.capitalize(), confidence=round(rng.uniform(20, 99), 2))
+        items.append(item)
+    return items
@@ -0,0 +1,184 @@
+"""Timing, allocation tracking and baseline comparison for the benchmarks"""
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+# Each timed sample loops the case for about this long, so timer resolution
+# and loop overhead stay well below the cost being measured
+SAMPLE_SECONDS = 0.001
+MIN_SAMPLES = 20
+
+# Peak allocations may grow this many bytes beyond the threshold before a
+# case counts as regressed, so tiny cases don't trip on a single dict resize
+ALLOC_SLACK_BYTES = 1024
+
+
+class Case:
+    """One benchmark: ``fn`` is called with no arguments after ``setup`` (if any)"""
+
+    def __init__(self, name, fn, setup=None):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _calibrate(fn):
+    """Calls per sample so one sample takes about SAMPLE_SECONDS"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= SAMPLE_SECONDS or loops >= 1 << 20:
+            return loops
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(SAMPLE_SECONDS / elapsed) + 1))
+
+
+def _sample(fn, loops, seconds):
+    """Per-call seconds of each sample taken over ``seconds`` (at least MIN_SAMPLES)"""
+    samples = []
+    deadline = time.perf_counter() + seconds
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while len(samples) < MIN_SAMPLES or time.perf_counter() < deadline:
+            started = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            samples.append((time.perf_counter() - started) / loops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return samples
+
+
+def _allocations(fn, calls):
+    """(peak bytes during one call, bytes still held per call) with tracemalloc"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        peak -= before
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(calls):
+            fn()
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, max(0, after - before) // calls
+
+
+def run(cases, seconds=0.5, rounds=3, progress=None):
+    """Measure every case; returns {name: result} in case order.
+
+    The cases are run round-robin ``rounds`` times for ``seconds / rounds``
+    each, so a stretch of host noise (another tenant, frequency scaling)
+    lands on several cases a little instead of on one case entirely. Results
+    hold ops/sec at the median and the best sample, per-call latency
+    percentiles in µs and tracemalloc allocation figures.
+    """
+    loops = {}
+    samples = {case.name: [] for case in cases}
+    for _ in range(rounds):
+        for case in cases:
+            if case.setup is not None:
+                case.setup()
+            if case.name not in loops:
+                case.fn()
+                loops[case.name] = _calibrate(case.fn)
+            samples[case.name] += _sample(case.fn, loops[case.name], seconds / rounds)
+
+    results = {}
+    for case in cases:
+        if case.setup is not None:
+            case.setup()
+        times = sorted(samples[case.name])
+        peak, retained = _allocations(case.fn, calls=min(50, loops[case.name]))
+        results[case.name] = {
+            'ops_per_sec': round(1 / _percentile(times, 0.5), 1),
+            'best_ops_per_sec': round(1 / times[0], 1),
+            'p50_us': round(_percentile(times, 0.5) * 1e6, 2),
+            'p95_us': round(_percentile(times, 0.95) * 1e6, 2),
+            'p99_us': round(_percentile(times, 0.99) * 1e6, 2),
+            'peak_alloc_bytes': peak,
+            'retained_bytes_per_call': retained,
+            'samples': len(times),
+            'loops': loops[case.name],
+        }
+        if progress is not None:
+            progress(case.name)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, results, threshold):
+    """Regressions against a baseline as (case, message) pairs.
+
+    A case regresses if its best-sample throughput drops more than
+    ``threshold`` (a fraction) below the baseline, or its peak allocation
+    grows more than ``threshold`` plus ALLOC_SLACK_BYTES above it. The best
+    sample is compared rather than the median because noise only ever makes
+    code slower. Cases missing from either side are ignored.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        relative = result['best_ops_per_sec'] / base['best_ops_per_sec']
+        if relative < 1 - threshold:
+            regressions.append((name, "%.0f ops/s, baseline %.0f (-%.0f%%)" % (
+                result['best_ops_per_sec'], base['best_ops_per_sec'], 100 * (1 - relative)
+            )))
+        ceiling = base['peak_alloc_bytes'] * (1 + threshold) + ALLOC_SLACK_BYTES
+        if result['peak_alloc_bytes'] > ceiling:
+            regressions.append((name, "peak allocation %d B, baseline %d B" % (
+                result['peak_alloc_bytes'], base['peak_alloc_bytes']
+            )))
+    return regressions
+
+
+def format_table(results, baseline=None):
+    """Results as text; "vs base" is the change in best-sample throughput"""
+    header = "%-40s %12s %10s %10s %10s %12s %10s" % (
+        'case', 'ops/s', 'p50 us', 'p95 us', 'p99 us', 'peak alloc', 'vs base'
+    )
+    lines = [header, '-' * len(header)]
+    for name, r in results.items():
+        base = (baseline or {}).get('results', {}).get(name)
+        delta = "%+.1f%%" % (100 * (r['best_ops_per_sec'] / base['best_ops_per_sec'] - 1)) if base else ''
+        lines.append("%-40s %12.1f %10.2f %10.2f %10.2f %12d %10s" % (
+            name, r['ops_per_sec'], r['p50_us'], r['p95_us'], r['p99_us'], r['peak_alloc_bytes'], delta
+        ))
+    return "\n".join(lines)
@@ -0,0 +1,183 @@
+"""Microbenchmarks for the pure request-path functions
+
+    python -m benchmarks.run                    # measure and print
+    python -m benchmarks.run --save             # measure and write the baseline
+    python -m benchmarks.run --compare          # exit 1 if anything regressed
+    python -m benchmarks.run --filter receipt --threshold 0.1
+
+Runs offline: the database is switched off and the stub model is used, so
+no Postgres or network is needed. The baseline (benchmarks/baseline.json by
+default) holds timings for one machine; save it on the machine that does the
+comparing, before the change under test.
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+
+# Before app is imported: no database, no model download, no log noise
+os.environ['DATABASE_URL'] = ''
+os.environ['INFERENCE_BACKEND'] = 'stub'
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import app  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from food_matcher import FoodMatcher  # noqa: E402
+from inference_backends import FOOD101_LABELS  # noqa: E402
+from menu import MenuSnapshot  # noqa: E402
+from receipts import render_receipt  # noqa: E402
+from responses import OrjsonProvider, orjson, parse_fields, select_fields  # noqa: E402
+from uploads import SpooledUpload  # noqa: E402
+
+from benchmarks import fixtures  # noqa: E402
+from benchmarks.harness import Case, compare, format_table, load_baseline, run, save_baseline  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+MENU_SCALES = (1, 10, 100)
+TRAY_SIZES = (5, 50, 500)
+
+
+class FixedMenu:
+    """Stands in for app.menu_cache so match_food_items sees a scaled menu"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def current(self):
+        return self.snapshot
+
+
+def cycling(fn, inputs):
+    """Case function calling fn on each input in turn, so memos see the real label mix"""
+    feed = itertools.cycle(inputs)
+    return lambda: fn(next(feed))
+
+
+def matching_cases(predictions):
+    cases = []
+    for scale in MENU_SCALES:
+        items, aliases = fixtures.scaled_menu(scale)
+        snapshot = MenuSnapshot(scale, items, aliases)
+        cases.append(Case(
+            f"match_food_items[menu x{scale}]",
+            cycling(app.match_food_items, predictions),
+            setup=lambda snapshot=snapshot: setattr(app, 'menu_cache', FixedMenu(snapshot))
+        ))
+        # memo_size=1 and a changing label: every call tokenizes and probes the index
+        matcher = FoodMatcher(items, aliases, memo_size=1)
+        cases.append(Case(
+            f"FoodMatcher.candidates cold[menu x{scale}]",
+            cycling(matcher.candidates, FOOD101_LABELS)
+        ))
+    for scale in MENU_SCALES:
+        items, aliases = fixtures.scaled_menu(scale)
+        cases.append(Case(
+            f"MenuSnapshot build[menu x{scale}]",
+            lambda scale=scale, items=items, aliases=aliases: MenuSnapshot(scale, items, aliases)
+        ))
+    return cases
+
+
+def tray_cases():
+    cases = []
+    for size in TRAY_SIZES:
+        items = fixtures.tray(size)
+        totals = app.calculate_totals(items)
+        cases.append(Case(f"calculate_totals[{size} items]", lambda items=items: app.calculate_totals(items)))
+        cases.append(Case(
+            f"render_receipt[{size} items]",
+            lambda items=items, totals=totals: render_receipt(items, totals, '2024-01-01 12:00:00')
+        ))
+    return cases
+
+
+def response_cases():
+    items = fixtures.tray(50)
+    body = {
+        'success': True,
+        'transaction_id': 'f' * 32,
+        'items': items,
+        'totals': app.calculate_totals(items),
+        'timestamp': '2024-01-01 12:00:00',
+        'inference': {'source': 'model', 'backend': 'stub', 'cached': False},
+    }
+    tree = parse_fields('transaction_id,totals.total_price,items.name,items.price')
+    cases = [Case("select_fields[50 items]", lambda: select_fields(body, tree))]
+    default_json = DefaultJSONProvider(app.app)
+    cases.append(Case("json encode default[50 items]", lambda: default_json.dumps(body)))
+    if orjson is not None:
+        fast_json = OrjsonProvider(app.app)
+        cases.append(Case("json encode orjson[50 items]", lambda: fast_json.dumps(body)))
+    return cases
+
+
+def upload_cases():
+    # A 2 MB JPEG arriving in werkzeug's 64 KB chunks: count, sniff, hash, spool
+    image = b'\xff\xd8\xff\xe0' + bytes(range(256)) * (2 * 1024 * 1024 // 256)
+    chunks = [image[i:i + 65536] for i in range(0, len(image), 65536)]
+
+    def ingest():
+        upload = SpooledUpload(10 * 1024 * 1024, 4 * 1024 * 1024)
+        for chunk in chunks:
+            upload.write(chunk)
+        upload.seek(0)
+        return upload.finish()
+
+    return [Case("SpooledUpload ingest[2 MB]", ingest)]
+
+
+def all_cases():
+    predictions = fixtures.predictions()
+    return matching_cases(predictions) + tray_cases() + response_cases() + upload_cases()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file to save or compare against')
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--compare', action='store_true', help='exit 1 if a case regressed against the baseline')
+    parser.add_argument('--threshold', type=float, default=float(os.environ.get('BENCH_THRESHOLD', 0.2)),
+                        help='allowed slowdown / allocation growth as a fraction (default 0.2)')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this text')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time spent measuring each case')
+    parser.add_argument('--rounds', type=int, default=5, help='round-robin passes over the cases')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare or os.path.exists(args.baseline):
+        try:
+            baseline = load_baseline(args.baseline)
+        except FileNotFoundError:
+            print(f"No baseline at {args.baseline}; run with --save first", file=sys.stderr)
+            return 2
+
+    logging.getLogger().setLevel(logging.WARNING)
+    original_menu = app.menu_cache
+    cases = [case for case in all_cases() if args.filter in case.name]
+    try:
+        results = run(cases, seconds=args.seconds, rounds=args.rounds,
+                      progress=lambda name: print("  %s" % name, file=sys.stderr))
+    finally:
+        app.menu_cache = original_menu
+
+    print(format_table(results, baseline))
+
+    status = 0
+    if args.compare:
+        regressions = compare(baseline, results, args.threshold)
+        for name, message in regressions:
+            print(f"REGRESSION {name}: {message}")
+        if regressions:
+            status = 1
+        else:
+            print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"Baseline written to {args.baseline}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""Per-worker PostgreSQL connection pool"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available before the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections for a single process.
+
+    Connections are opened lazily, up to ``maxconn``. When the pool is
+    exhausted, ``getconn()`` waits up to ``timeout`` seconds and then raises
+    ``PoolTimeout``. Connections that sat idle longer than ``validate_after``
+    seconds are pinged before being handed out, and connections older than
+    ``max_lifetime`` are recycled. Opening a connection gives up after
+    ``connect_timeout`` seconds, so an unreachable server can't stall a
+    checkout for the OS TCP timeout.
+
+    The pool remembers the pid that created it. After a fork (gunicorn's
+    pre-fork model) the child starts with an empty pool instead of sharing
+    sockets with its parent.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=5.0,
+                 validate_after=30.0, max_lifetime=3600.0, idle_timeout=300.0, connect_timeout=5):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool sizes must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []       # [(conn, created_at, last_used)], most recently used last
+        self._in_use = {}     # id(conn) -> (conn, created_at)
+        self._opening = 0     # connections being opened outside the lock
+        self._waiting = 0
+        self._closed = False
+        self._counters = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'connections_opened': 0,
+            'connections_discarded': 0,
+            'wait_count': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Connections inherited from the parent share its sockets. Keep a
+            # reference so they are never finalized (and closed) in the child.
+            inherited = [c for c, _, _ in self._idle] + [c for c, _ in self._in_use.values()]
+            self._orphaned = getattr(self, '_orphaned', []) + inherited
+            self._reset()
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _open(self):
+        conn = psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout)
+        with self._cond:
+            self._counters['connections_opened'] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._counters['connections_discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, created_at, last_used, now):
+        """Validate an idle connection before handing it out"""
+        if conn.closed:
+            return False
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return False
+        if self.validate_after is not None and now - last_used > self.validate_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to ``timeout`` seconds for one"""
+        self._check_fork()
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        with self._cond:
+            if self._closed:
+                raise PoolTimeout("Connection pool is closed")
+            while True:
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                    break
+                if self._size() < self.maxconn:
+                    conn = None
+                    self._opening += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {timeout:.1f}s "
+                        f"({len(self._in_use)}/{self.maxconn} in use)"
+                    )
+                waited = True
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if waited:
+                wait_time = time.monotonic() - start
+                self._counters['wait_count'] += 1
+                self._counters['wait_time_total'] += wait_time
+                self._counters['wait_time_max'] = max(self._counters['wait_time_max'], wait_time)
+
+        # Network I/O (connect / validation ping) happens outside the lock
+        if conn is None:
+            try:
+                conn = self._open()
+            finally:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+            created_at = time.monotonic()
+        elif not self._is_usable(conn, created_at, last_used, time.monotonic()):
+            with self._cond:
+                self._discard(conn)
+                self._opening += 1
+            try:
+                conn = self._open()
+            finally:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+            created_at = time.monotonic()
+
+        with self._cond:
+            self._in_use[id(conn)] = (conn, created_at)
+            self._counters['checkouts'] += 1
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, discarding it if it is broken"""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            return
+        created_at = entry[1]
+
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                # Never hand out a connection with a dangling transaction
+                try:
+                    conn.rollback()
+                except Exception:
+                    close = True
+
+        with self._cond:
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                now = time.monotonic()
+                self._idle.append((conn, created_at, now))
+                self._prune_idle(now)
+            self._cond.notify()
+
+    def _prune_idle(self, now):
+        """Close the oldest idle connections above minconn once they time out"""
+        if not self.idle_timeout:
+            return
+        while len(self._idle) > self.minconn and now - self._idle[0][2] > self.idle_timeout:
+            conn, _, _ = self._idle.pop(0)
+            self._discard(conn)
+
+    def prefill(self):
+        """Open connections until the pool holds at least minconn"""
+        self._check_fork()
+        opened = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size() + len(opened) >= self.minconn:
+                        break
+                opened.append(self._open())
+        except Exception as e:
+            logger.warning("Could not prefill pool: %s", e)
+        now = time.monotonic()
+        with self._cond:
+            self._idle.extend((conn, now, now) for conn in opened)
+            self._cond.notify_all()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks out a connection and always returns it.
+
+        Uncommitted work is rolled back on return. Connections that raised an
+        OperationalError or InterfaceError are dropped instead of reused.
+        """
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def closeall(self):
+        """Close idle connections and stop handing out new ones"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Snapshot of pool occupancy and checkout wait times"""
+        self._check_fork()
+        with self._cond:
+            counters = dict(self._counters)
+            wait_count = counters.pop('wait_count')
+            wait_total = counters.pop('wait_time_total')
+            wait_max = counters.pop('wait_time_max')
+            return {
+                'pid': self._pid,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'size': self._size(),
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                **counters,
+                'waits': wait_count,
+                'wait_time_avg_ms': round(wait_total / wait_count * 1000, 2) if wait_count else 0.0,
+                'wait_time_max_ms': round(wait_max * 1000, 2),
+            }
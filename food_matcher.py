@@ -0,0 +1,92 @@
+"""Precompiled matcher from model labels to menu items"""
+import re
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _stem(token):
+    """Cheap plural folding so "fries"/"frie" and "wings"/"wing" compare equal"""
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split on anything that is not a letter or digit, fold plurals.
+
+    Food-101 labels such as "chicken_wings" and menu keys such as
+    "chicken wings" both become ("chicken", "wing").
+    """
+    return tuple(_stem(t) for t in _TOKEN_RE.findall(text.lower()))
+
+
+class FoodMatcher:
+    """Token n-gram index over menu keys and their aliases.
+
+    Built once per menu. ``candidates()`` slides over the label's tokens and
+    probes the index with every n-gram up to the longest menu phrase, so
+    matching costs O(len(label) * max_phrase_tokens) dict lookups no matter
+    how large the menu grows. Matches whose span is covered by a longer
+    match are dropped ("pie" inside "apple pie"), and the remaining ones are
+    ranked by phrase length, then by position (the head noun of a dish name
+    comes last, as in "chicken curry"), then by character length.
+    """
+
+    def __init__(self, menu_keys, aliases=None, memo_size=4096):
+        self._index = {}
+        for key in menu_keys:
+            tokens = tokenize(key)
+            if tokens:
+                self._index.setdefault(tokens, key)
+        for alias, key in (aliases or {}).items():
+            tokens = tokenize(alias)
+            if tokens:
+                # Real menu keys win over aliases that normalize the same way
+                self._index.setdefault(tokens, key)
+        self._max_tokens = max((len(t) for t in self._index), default=0)
+        self._memo = {}
+        self._memo_size = memo_size
+
+    def __len__(self):
+        return len(self._index)
+
+    def candidates(self, label):
+        """Menu keys mentioned in a label, best match first"""
+        cached = self._memo.get(label)
+        if cached is not None:
+            return cached
+
+        tokens = tokenize(label)
+        found = []  # (start, end, key, phrase_chars)
+        for start in range(len(tokens)):
+            for n in range(min(self._max_tokens, len(tokens) - start), 0, -1):
+                phrase = tokens[start:start + n]
+                key = self._index.get(phrase)
+                if key is not None:
+                    found.append((start, start + n, key, sum(len(t) for t in phrase)))
+                    break  # shorter n-grams at this start are contained in this one
+
+        # Drop matches nested inside a longer one
+        maximal = [
+            m for m in found
+            if not any(o is not m and o[0] <= m[0] and m[1] <= o[1] for o in found)
+        ]
+        maximal.sort(key=lambda m: (m[1] - m[0], m[1], m[3]), reverse=True)
+
+        result = []
+        for m in maximal:
+            if m[2] not in result:
+                result.append(m[2])
+        result = tuple(result)
+
+        if len(self._memo) >= self._memo_size:
+            self._memo.clear()
+        self._memo[label] = result
+        return result
+
+    def match(self, label, exclude=()):
+        """Best menu key for a label that is not in ``exclude``, or None"""
+        for key in self.candidates(label):
+            if key not in exclude:
+                return key
+        return None
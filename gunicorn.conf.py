@@ -0,0 +1,112 @@
+# Gunicorn configuration (loaded automatically by `gunicorn app:app`)
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Serving mode, picked with SERVING_MODE:
+#
+#   sync    one request at a time per worker process (gunicorn's default)
+#   gevent  cooperative workers: every request is a greenlet that yields while
+#           it waits on the model or Postgres, so one process holds up to
+#           GEVENT_WORKER_CONNECTIONS requests in flight. Needs
+#           requirements-gevent.txt. Don't combine it with --preload; the app
+#           must be imported after the worker has monkey-patched the stdlib.
+#           Suits the remote backend; INFERENCE_BACKEND=local is CPU-bound and
+#           would stall every other request in the worker.
+#
+#   SERVING_MODE=gevent WEB_CONCURRENCY=2 gunicorn app:app
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync').lower()
+
+if SERVING_MODE == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GEVENT_WORKER_CONNECTIONS', 500))
+    # Long enough for a slow model call plus its hedge; a worker that misses
+    # heartbeats this long is stuck on CPU and gets restarted
+    timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+    graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+    keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+    # Hundreds of in-flight requests share one worker's pools: allow more
+    # Postgres connections and as many concurrent model calls as connections
+    os.environ.setdefault('DB_POOL_MAX', '20')
+    os.environ.setdefault('INFERENCE_CALL_CONCURRENCY', str(worker_connections))
+
+# Workers share Prometheus samples through this directory (see metrics.py).
+# It must be set before any worker imports prometheus_client.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'food-api-metrics')
+)
+
+# Longest the master waits for startup migrations before leaving them to the workers
+MIGRATE_TIMEOUT = int(os.environ.get('MIGRATE_TIMEOUT', 300))
+
+
+def migrate_schema(server):
+    """Apply schema migrations once here instead of in every worker.
+
+    Runs ``manage.py maintain`` in a child process: importing the migrations
+    would pull psycopg2 and the app's modules into the master, and workers
+    would inherit them from before gevent and psycogreen patch anything.
+    """
+    if not os.environ.get('DATABASE_URL') or os.environ.get('MIGRATE_ON_STARTUP', 'auto').lower() != 'auto':
+        return
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [
+        sys.executable, os.path.join(here, 'manage.py'), 'maintain',
+        '--months-ahead', os.environ.get('PARTITION_MONTHS_AHEAD', '3'), '--retain-months', '0',
+    ]
+    try:
+        result = subprocess.run(command, cwd=here, capture_output=True, text=True, timeout=MIGRATE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        server.log.warning("Schema migration in the master timed out after %ds", MIGRATE_TIMEOUT)
+        return
+    if result.returncode != 0:
+        # Workers fall back to migrating themselves, retrying until the database is up
+        server.log.warning("Schema migration in the master failed: %s", result.stderr.strip()[-500:])
+        return
+    for line in result.stdout.splitlines():
+        server.log.info("%s", line)
+    version = re.search(r'^Schema version: (\d+)$', result.stdout, re.MULTILINE)
+    if version is not None:
+        # The schema version, not a plain flag: after a HUP reload workers load
+        # new code, and one that knows a later migration still applies it
+        # (see app.init_db)
+        os.environ['FOOD_API_SCHEMA_MIGRATED'] = version.group(1)
+
+
+def on_starting(server):
+    """Start every deploy with an empty metrics directory and a migrated schema"""
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    # Workers split per-kiosk rate limits by this (see app.start_worker)
+    os.environ['GUNICORN_WORKERS'] = str(server.cfg.workers)
+    migrate_schema(server)
+
+
+def post_fork(server, worker):
+    """Make psycopg2 yield to other greenlets while it waits on the server"""
+    if SERVING_MODE == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def post_worker_init(worker):
+    """Restart per-process logging and kick off background warmup in the new worker"""
+    app_module = sys.modules.get('app')
+    if app_module is not None and hasattr(app_module, 'start_worker'):
+        app_module.start_worker()
+
+
+def worker_exit(server, worker):
+    """Flush write-behind buffers before a worker process exits"""
+    app_module = sys.modules.get('app')
+    if app_module is not None and hasattr(app_module, 'shutdown'):
+        app_module.shutdown()
+
+
+def child_exit(server, worker):
+    """Drop the dead worker's live gauges from the aggregated metrics"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,257 @@
+"""Idempotency-Key handling: run a request once, replay its response to retries"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from psycopg2.extras import Json
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request"""
+
+
+class IdempotencyInProgress(Exception):
+    """The first request with this key is still running"""
+
+
+class MemoryIdempotencyStore:
+    """Keys kept in this process (retries must reach the same worker to be caught)"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key, fingerprint, ttl, lock_timeout):
+        """('claimed', None) if the caller now owns the key, else ('done' or 'in_progress', record)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['expires_at'] < now or (
+                entry['status'] is None and entry['locked_until'] < now
+            ):
+                self._entries[key] = {
+                    'fingerprint': fingerprint,
+                    'status': None,
+                    'body': None,
+                    'locked_until': now + lock_timeout,
+                    'expires_at': now + ttl,
+                }
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return 'claimed', None
+            return ('in_progress' if entry['status'] is None else 'done'), dict(entry)
+
+    def complete(self, key, status, body, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.update(status=status, body=body, expires_at=time.monotonic() + ttl)
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['status'] is None:
+                del self._entries[key]
+
+    def purge(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry['expires_at'] < now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+
+class PostgresIdempotencyStore:
+    """Keys in the idempotency_keys table, so a retry is caught by any worker"""
+
+    name = 'postgres'
+
+    SCHEMA_SQL = """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key VARCHAR(300) PRIMARY KEY,
+            fingerprint CHAR(64) NOT NULL,
+            status_code SMALLINT,
+            response JSONB,
+            locked_until TIMESTAMPTZ NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
+    """
+
+    # Takes over expired keys and claims whose owner died before finishing
+    CLAIM_SQL = """
+        INSERT INTO idempotency_keys (key, fingerprint, locked_until, expires_at)
+        VALUES (%(key)s, %(fingerprint)s,
+                NOW() + make_interval(secs => %(lock_timeout)s), NOW() + make_interval(secs => %(ttl)s))
+        ON CONFLICT (key) DO UPDATE SET
+            fingerprint = EXCLUDED.fingerprint,
+            status_code = NULL,
+            response = NULL,
+            locked_until = EXCLUDED.locked_until,
+            expires_at = EXCLUDED.expires_at
+        WHERE idempotency_keys.expires_at < NOW()
+           OR (idempotency_keys.status_code IS NULL AND idempotency_keys.locked_until < NOW())
+        RETURNING key
+    """
+
+    def __init__(self, pool, timeout=1.0):
+        self.pool = pool
+        self.timeout = timeout
+
+    def claim(self, key, fingerprint, ttl, lock_timeout):
+        with self.pool.connection(timeout=self.timeout) as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.CLAIM_SQL, {
+                    'key': key, 'fingerprint': fingerprint, 'ttl': ttl, 'lock_timeout': lock_timeout,
+                })
+                if cur.fetchone() is not None:
+                    conn.commit()
+                    return 'claimed', None
+                cur.execute(
+                    "SELECT fingerprint, status_code, response FROM idempotency_keys WHERE key = %s",
+                    (key,)
+                )
+                row = cur.fetchone()
+            conn.rollback()
+        if row is None:
+            # Released between the two statements; let the caller try again
+            return 'in_progress', None
+        fingerprint, status, body = row
+        return ('in_progress' if status is None else 'done'), {
+            'fingerprint': fingerprint, 'status': status, 'body': body,
+        }
+
+    def complete(self, key, status, body, ttl):
+        with self.pool.connection(timeout=self.timeout) as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE idempotency_keys
+                    SET status_code = %s, response = %s, expires_at = NOW() + make_interval(secs => %s)
+                    WHERE key = %s
+                """, (status, Json(body), ttl, key))
+            conn.commit()
+
+    def release(self, key):
+        with self.pool.connection(timeout=self.timeout) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM idempotency_keys WHERE key = %s AND status_code IS NULL", (key,))
+            conn.commit()
+
+    def purge(self):
+        with self.pool.connection(timeout=self.timeout) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM idempotency_keys WHERE expires_at < NOW()")
+                deleted = cur.rowcount
+            conn.commit()
+        return deleted
+
+
+class IdempotencyService:
+    """Runs each keyed request once and hands its recorded response to retries.
+
+    ``begin()`` either claims the key for the caller, who runs the request
+    and then calls ``complete()`` (or ``release()`` if the outcome shouldn't
+    be replayed, e.g. a 5xx), or returns the stored (status, body). A
+    duplicate that arrives while the first request is still running waits
+    up to ``wait_timeout`` seconds for its response; in the same worker it
+    is woken as soon as the response is recorded, across workers it polls
+    the store. A claim not completed within ``lock_timeout`` is treated as
+    abandoned (its worker died) and can be taken over.
+    """
+
+    def __init__(self, store, ttl=86400.0, wait_timeout=30.0, lock_timeout=120.0,
+                 poll_interval=0.1, purge_interval=60.0):
+        self.store = store
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._events = {}
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+        self._counters = {'claimed': 0, 'replayed': 0, 'waited': 0, 'conflicts': 0, 'store_errors': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < self.purge_interval:
+                return
+            self._last_purge = now
+        purged = self.store.purge()
+        if purged:
+            logger.debug("Purged %d expired idempotency keys", purged)
+
+    def begin(self, key, fingerprint):
+        """None if the caller owns the key, else the recorded (status, body).
+
+        Raises IdempotencyConflict if the key was used with another request
+        and IdempotencyInProgress if the first request outlasts the wait.
+        """
+        self._maybe_purge()
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            state, record = self.store.claim(key, fingerprint, self.ttl, self.lock_timeout)
+            if state == 'claimed':
+                with self._lock:
+                    self._events[key] = threading.Event()
+                self._count('claimed')
+                return None
+            if record is not None and record['fingerprint'] != fingerprint:
+                self._count('conflicts')
+                raise IdempotencyConflict(key)
+            if state == 'done':
+                self._count('replayed')
+                return record['status'], record['body']
+            if not waited:
+                waited = True
+                self._count('waited')
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IdempotencyInProgress(key)
+            event = self._events.get(key)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+
+    def _finish(self, key):
+        with self._lock:
+            event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def complete(self, key, status, body):
+        """Record the response to replay for this key"""
+        try:
+            self.store.complete(key, status, body, self.ttl)
+        finally:
+            self._finish(key)
+
+    def release(self, key):
+        """Give the key up without a response, so the next retry runs again"""
+        try:
+            self.store.release(key)
+        finally:
+            self._finish(key)
+
+    def store_failed(self):
+        self._count('store_errors')
+
+    def stats(self):
+        with self._lock:
+            return {'store': self.store.name, 'pending': len(self._events), **self._counters}
@@ -0,0 +1,182 @@
+"""Perceptual image hashes and a near-duplicate index over them"""
+import io
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+HASH_BITS = 64
+
+
+def _grayscale(image_bytes, size):
+    """Decode, orient and shrink an image to a grayscale pixel list"""
+    image = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder downscale while decoding; much cheaper than a full decode
+    image.draft('L', (size[0] * 4, size[1] * 4))
+    image = ImageOps.exif_transpose(image).convert('L')
+    image = image.resize(size, Image.Resampling.BILINEAR)
+    return list(image.getdata())
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bit
+    return value
+
+
+def average_hash(image_bytes):
+    """aHash: 8x8 pixels compared against their mean"""
+    pixels = _grayscale(image_bytes, (8, 8))
+    mean = sum(pixels) / len(pixels)
+    return _bits_to_int(1 if p > mean else 0 for p in pixels)
+
+
+def difference_hash(image_bytes):
+    """dHash: sign of the horizontal gradient on a 9x8 thumbnail"""
+    pixels = _grayscale(image_bytes, (9, 8))
+    bits = []
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            bits.append(1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return _bits_to_int(bits)
+
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_DCT_COS = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(_DCT_KEEP)
+]
+
+
+def perceptual_hash(image_bytes):
+    """pHash: low-frequency 8x8 DCT coefficients compared against their median"""
+    pixels = _grayscale(image_bytes, (_DCT_SIZE, _DCT_SIZE))
+    rows = [pixels[r * _DCT_SIZE:(r + 1) * _DCT_SIZE] for r in range(_DCT_SIZE)]
+    # Separable 2-D DCT, computing only the coefficients we keep
+    row_dct = [[sum(c * p for c, p in zip(cos_u, row)) for cos_u in _DCT_COS] for row in rows]
+    coeffs = []
+    for u in range(_DCT_KEEP):
+        cos_u = _DCT_COS[u]
+        for v in range(_DCT_KEEP):
+            coeffs.append(sum(cos_u[x] * row_dct[x][v] for x in range(_DCT_SIZE)))
+    # Ignore the DC term when picking the threshold
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]
+    return _bits_to_int(1 if c > median else 0 for c in coeffs)
+
+
+HASH_FUNCTIONS = {
+    'ahash': average_hash,
+    'dhash': difference_hash,
+    'phash': perceptual_hash,
+}
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class NearDuplicateIndex:
+    """Bounded index of image hashes supporting Hamming-radius lookups.
+
+    Uses multi-index hashing: each 64-bit hash is split into
+    ``max_distance + 1`` disjoint chunks, and each chunk is an exact-match
+    key in its own table. By the pigeonhole principle any hash within
+    ``max_distance`` bits of a query shares at least one chunk with it, so
+    a lookup only compares against the few entries in those buckets.
+    Entries expire after ``ttl`` seconds and the least recently used entry
+    is evicted once ``max_entries`` is reached.
+    """
+
+    def __init__(self, max_distance=5, max_entries=4096, ttl=3600.0):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError("max_distance must be between 0 and 63")
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        chunks = max_distance + 1
+        widths = [HASH_BITS // chunks + (1 if i < HASH_BITS % chunks else 0) for i in range(chunks)]
+        self._chunks = []
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self._chunks.append((shift, (1 << width) - 1))
+        self._tables = [{} for _ in self._chunks]
+        self._entries = OrderedDict()  # hash -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._chunks]
+
+    def _remove(self, image_hash):
+        self._entries.pop(image_hash, None)
+        for table, key in zip(self._tables, self._keys(image_hash)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(image_hash)
+                if not bucket:
+                    del table[key]
+
+    def add(self, image_hash, value):
+        with self._lock:
+            if image_hash in self._entries:
+                self._remove(image_hash)
+            self._entries[image_hash] = (time.monotonic() + self.ttl, value)
+            for table, key in zip(self._tables, self._keys(image_hash)):
+                table.setdefault(key, set()).add(image_hash)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def lookup(self, image_hash, max_distance=None):
+        """Return (value, distance) for the closest entry within range, or (None, None)"""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        now = time.monotonic()
+        best_hash, best_distance = None, None
+        with self._lock:
+            candidates = set()
+            for table, key in zip(self._tables, self._keys(image_hash)):
+                bucket = table.get(key)
+                if bucket:
+                    candidates.update(bucket)
+            for candidate in candidates:
+                distance = hamming_distance(image_hash, candidate)
+                if distance > max_distance:
+                    continue
+                if self._entries[candidate][0] < now:
+                    self._remove(candidate)
+                    self.expirations += 1
+                    continue
+                if best_distance is None or distance < best_distance:
+                    best_hash, best_distance = candidate, distance
+                    if distance == 0:
+                        break
+            if best_hash is None:
+                self.misses += 1
+                return None, None
+            self.hits += 1
+            self._entries.move_to_end(best_hash)
+            return self._entries[best_hash][1], best_distance
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'max_distance': self.max_distance,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,56 @@
+"""Shrink uploads to the model's input resolution before inference"""
+import io
+
+from PIL import Image, ImageOps
+
+
+def _original(source):
+    if isinstance(source, bytes):
+        return source
+    source.seek(0)
+    return source.read()
+
+
+def prepare_for_inference(source, target_size=224, quality=90):
+    """Decode, apply EXIF orientation, downscale and re-encode as JPEG.
+
+    ``source`` is the image as bytes or as a seekable binary file; a file is
+    decoded straight from the handle, so a large upload is never read into
+    memory as a whole. The shorter side is scaled down to ``target_size``
+    (the classifier resizes to its input resolution anyway, so extra pixels
+    are only upload cost). Returns the original bytes when the image is
+    already small enough or when re-encoding would not make it smaller.
+    """
+    if isinstance(source, bytes):
+        original_size = len(source)
+        image = Image.open(io.BytesIO(source))
+    else:
+        source.seek(0, io.SEEK_END)
+        original_size = source.tell()
+        source.seek(0)
+        image = Image.open(source)
+    original_format = image.format
+    # JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding
+    image.draft('RGB', (target_size, target_size))
+
+    orientation = image.getexif().get(0x0112, 1)
+    width, height = image.size
+    if original_format == 'JPEG' and orientation == 1 and min(width, height) <= target_size:
+        return _original(source)
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    width, height = image.size
+    scale = target_size / min(width, height)
+    if scale < 1:
+        new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    encoded = output.getvalue()
+    if len(encoded) >= original_size and orientation == 1:
+        return _original(source)
+    return encoded
@@ -0,0 +1,234 @@
+"""Interchangeable image classification backends"""
+import hashlib
+import io
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Class names of the Food-101 dataset, as returned by nateraw/food
+FOOD101_LABELS = (
+    "apple_pie", "baby_back_ribs", "baklava", "beef_carpaccio", "beef_tartare",
+    "beet_salad", "beignets", "bibimbap", "bread_pudding", "breakfast_burrito",
+    "bruschetta", "caesar_salad", "cannoli", "caprese_salad", "carrot_cake",
+    "ceviche", "cheese_plate", "cheesecake", "chicken_curry", "chicken_quesadilla",
+    "chicken_wings", "chocolate_cake", "chocolate_mousse", "churros", "clam_chowder",
+    "club_sandwich", "crab_cakes", "creme_brulee", "croque_madame", "cup_cakes",
+    "deviled_eggs", "donuts", "dumplings", "edamame", "eggs_benedict",
+    "escargots", "falafel", "filet_mignon", "fish_and_chips", "foie_gras",
+    "french_fries", "french_onion_soup", "french_toast", "fried_calamari", "fried_rice",
+    "frozen_yogurt", "garlic_bread", "gnocchi", "greek_salad", "grilled_cheese_sandwich",
+    "grilled_salmon", "guacamole", "gyoza", "hamburger", "hot_and_sour_soup",
+    "hot_dog", "huevos_rancheros", "hummus", "ice_cream", "lasagna",
+    "lobster_bisque", "lobster_roll_sandwich", "macaroni_and_cheese", "macarons", "miso_soup",
+    "mussels", "nachos", "omelette", "onion_rings", "oysters",
+    "pad_thai", "paella", "pancakes", "panna_cotta", "peking_duck",
+    "pho", "pizza", "pork_chop", "poutine", "prime_rib",
+    "pulled_pork_sandwich", "ramen", "ravioli", "red_velvet_cake", "risotto",
+    "samosa", "sashimi", "scallops", "seaweed_salad", "shrimp_and_grits",
+    "spaghetti_bolognese", "spaghetti_carbonara", "spring_rolls", "steak", "strawberry_shortcake",
+    "sushi", "tacos", "takoyaki", "tiramisu", "tuna_tartare",
+    "waffles",
+)
+
+
+def normalize_predictions(predictions):
+    """Plain [{"label", "score"}] dicts, whatever the backend returned"""
+    return [{"label": p.get("label", ""), "score": float(p.get("score", 0))} for p in predictions]
+
+
+class InferenceBackend:
+    """Interface every backend implements"""
+
+    name = 'base'
+    model = None
+
+    def classify(self, image_bytes):
+        """Return normalized predictions for one image, best first"""
+        raise NotImplementedError
+
+    def classify_batch(self, images):
+        """Classify several images, returning predictions or an exception per image"""
+        results = []
+        for image in images:
+            try:
+                results.append(self.classify(image))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def warmup(self):
+        """Load whatever the backend needs before the first request"""
+
+    def close(self):
+        """Release backend resources"""
+
+
+class RemoteBackend(InferenceBackend):
+    """Hugging Face hosted inference through huggingface_hub's InferenceClient"""
+
+    name = 'remote'
+
+    def __init__(self, model, api_key, provider='hf-inference', max_concurrency=8, timeout=None):
+        from huggingface_hub import InferenceClient
+
+        self.model = model
+        self.client = InferenceClient(provider=provider, api_key=api_key, timeout=timeout)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='inference')
+
+    def classify(self, image_bytes):
+        return normalize_predictions(self.client.image_classification(image=image_bytes, model=self.model))
+
+    def classify_batch(self, images):
+        # The hosted image_classification task takes one image per call, so a
+        # batch goes out as concurrent requests sharing the client's connections
+        futures = [self._executor.submit(self.classify, image) for image in images]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LocalBackend(InferenceBackend):
+    """In-process CPU classifier using a transformers image-classification pipeline.
+
+    Requires the optional ``transformers`` and ``torch`` packages (see
+    requirements-local.txt). The model is loaded once per worker on first use
+    or by ``warmup()``; batches run as a single batched forward pass.
+    """
+
+    name = 'local'
+
+    def __init__(self, model, top_k=5, num_threads=None):
+        self.model = model
+        self.top_k = top_k
+        self.num_threads = num_threads
+        self._pipeline = None
+        self._lock = threading.Lock()
+
+    def warmup(self):
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        if self._pipeline is not None:
+            return
+        try:
+            import torch
+            from transformers import pipeline
+        except ImportError as e:
+            raise RuntimeError(
+                "INFERENCE_BACKEND=local needs transformers and torch (pip install -r requirements-local.txt)"
+            ) from e
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        started = time.monotonic()
+        self._pipeline = pipeline('image-classification', model=self.model, device='cpu')
+        logger.info("Loaded %s in %.1fs", self.model, time.monotonic() - started)
+
+    @staticmethod
+    def _decode(image_bytes):
+        from PIL import Image
+
+        return Image.open(io.BytesIO(image_bytes)).convert('RGB')
+
+    def classify(self, image_bytes):
+        return self.classify_batch([image_bytes])[0]
+
+    def classify_batch(self, images):
+        results = [None] * len(images)
+        decoded, positions = [], []
+        for i, image_bytes in enumerate(images):
+            try:
+                decoded.append(self._decode(image_bytes))
+                positions.append(i)
+            except Exception as e:
+                results[i] = e
+        if decoded:
+            # One forward pass at a time; torch already uses every core for it
+            with self._lock:
+                self._load()
+                outputs = self._pipeline(decoded, top_k=self.top_k, batch_size=len(decoded))
+            for i, output in zip(positions, outputs):
+                results[i] = normalize_predictions(output)
+        return results
+
+
+class StubBackend(InferenceBackend):
+    """Deterministic fake classifier for tests, benchmarks and offline runs.
+
+    The same image bytes always yield the same Food-101 predictions. An
+    optional fixed ``latency`` (seconds) simulates model time. For exercising
+    timeouts and the circuit breaker offline, ``failure_rate`` of calls raise
+    and ``slow_rate`` of calls take ``slow_latency`` seconds instead; pass a
+    ``seed`` to make the injected faults repeatable.
+    """
+
+    name = 'stub'
+
+    def __init__(self, model='stub', top_k=5, latency=0.0, failure_rate=0.0, slow_rate=0.0,
+                 slow_latency=5.0, seed=None):
+        self.model = model
+        self.top_k = top_k
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._random = random.Random(seed)
+
+    def _simulate(self):
+        latency = self.latency
+        if self.slow_rate and self._random.random() < self.slow_rate:
+            latency = self.slow_latency
+        if latency:
+            time.sleep(latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise RuntimeError("Injected stub backend failure")
+
+    def _predict(self, image_bytes):
+        digest = hashlib.sha256(image_bytes).digest()
+        picks = []
+        for byte in digest:
+            label = FOOD101_LABELS[byte % len(FOOD101_LABELS)]
+            if label not in picks:
+                picks.append(label)
+            if len(picks) == self.top_k:
+                break
+        # Scores decay geometrically and sum to just under 1, like a softmax tail
+        weight = 0.5 + digest[-1] / 1024
+        scores = [weight * (1 - weight) ** i for i in range(len(picks))]
+        return [{"label": label, "score": round(score, 4)} for label, score in zip(picks, scores)]
+
+    def classify(self, image_bytes):
+        self._simulate()
+        return self._predict(image_bytes)
+
+    def classify_batch(self, images):
+        # One simulated forward pass per batch, not per image
+        self._simulate()
+        return [self._predict(image) for image in images]
+
+
+BACKENDS = {
+    'remote': RemoteBackend,
+    'local': LocalBackend,
+    'stub': StubBackend,
+}
+
+
+def create_backend(name, **options):
+    """Instantiate a backend by its INFERENCE_BACKEND name"""
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend: {name} (expected one of {', '.join(BACKENDS)})")
+    return backend_class(**options)
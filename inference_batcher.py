@@ -0,0 +1,141 @@
+"""Coalesce concurrent inference requests into batched backend calls"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collects items submitted from many request threads into batches.
+
+    A dispatcher thread waits for the first pending item, then keeps
+    collecting until ``max_batch`` items are pending or ``max_wait`` seconds
+    have passed since the first one arrived, and hands the whole batch to
+    ``dispatch(items)``. ``dispatch`` must return one result per item, in
+    order; an Exception instance in that list fails only its own caller.
+    """
+
+    def __init__(self, dispatch, max_batch=8, max_wait=0.01, name='micro-batcher'):
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        self.dispatch = dispatch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+        self._pending = deque()  # (item, future, enqueued_at)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._batch_sizes = {}
+        self._counters = {
+            'batches': 0,
+            'items': 0,
+            'dispatch_errors': 0,
+            'queue_delay_total': 0.0,
+            'queue_delay_max': 0.0,
+        }
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item):
+        """Queue one item and return a Future for its result"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._ensure_thread()
+            self._pending.append((item, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Submit an item and block until its result is ready"""
+        return self.submit(item).result(timeout)
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._pending), self.max_batch)
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _record(self, batch, started_at):
+        with self._cond:
+            size = len(batch)
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._counters['batches'] += 1
+            self._counters['items'] += size
+            for _, _, enqueued_at in batch:
+                delay = started_at - enqueued_at
+                self._counters['queue_delay_total'] += delay
+                self._counters['queue_delay_max'] = max(self._counters['queue_delay_max'], delay)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started_at = time.monotonic()
+            self._record(batch, started_at)
+            live = [(item, future) for item, future, _ in batch if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                results = self.dispatch([item for item, _ in live])
+                if len(results) != len(live):
+                    raise RuntimeError(f"dispatch returned {len(results)} results for {len(live)} items")
+            except Exception as e:
+                with self._cond:
+                    self._counters['dispatch_errors'] += 1
+                logger.exception("%s dispatch failed: %s: %s", self.name, type(e).__name__, e)
+                for _, future in live:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(live, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def close(self, timeout=5.0):
+        """Dispatch whatever is pending and stop the dispatcher thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Batch size distribution and queueing delay"""
+        with self._cond:
+            counters = dict(self._counters)
+            sizes = dict(sorted(self._batch_sizes.items()))
+            pending = len(self._pending)
+        batches = counters['batches']
+        items = counters['items']
+        return {
+            'max_batch': self.max_batch,
+            'max_wait_ms': round(self.max_wait * 1000, 2),
+            'pending': pending,
+            'batches': batches,
+            'items': items,
+            'dispatch_errors': counters['dispatch_errors'],
+            'avg_batch_size': round(items / batches, 2) if batches else 0.0,
+            'batch_sizes': sizes,
+            'queue_delay_avg_ms': round(counters['queue_delay_total'] / items * 1000, 2) if items else 0.0,
+            'queue_delay_max_ms': round(counters['queue_delay_max'] * 1000, 2),
+        }
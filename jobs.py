@@ -0,0 +1,270 @@
+"""Background analyze jobs with pollable results"""
+import contextvars
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from psycopg2.extras import Json
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ('succeeded', 'failed')
+
+
+class JobQueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+class JobError(Exception):
+    """Raised by a job handler to fail a job with a structured error payload"""
+
+    def __init__(self, payload):
+        super().__init__(payload.get('error', 'Job failed'))
+        self.payload = payload
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class MemoryJobStore:
+    """Job state kept in this process (jobs are only visible to the worker that ran them)"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job, _updated=time.monotonic())
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, _updated=time.monotonic())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: v for k, v in job.items() if not k.startswith('_')}
+
+    def purge(self, ttl):
+        cutoff = time.monotonic() - ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job['status'] in FINISHED_STATUSES and job['_updated'] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+
+class PostgresJobStore:
+    """Job state in the analyze_jobs table, so any worker can answer a poll"""
+
+    name = 'postgres'
+
+    SCHEMA_SQL = """
+        CREATE TABLE IF NOT EXISTS analyze_jobs (
+            id VARCHAR(32) PRIMARY KEY,
+            status VARCHAR(16) NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL,
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            result JSONB,
+            error JSONB,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_analyze_jobs_updated ON analyze_jobs(updated_at);
+    """
+
+    COLUMNS = ('id', 'status', 'created_at', 'started_at', 'finished_at', 'result', 'error')
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def ensure_schema(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(self.SCHEMA_SQL)
+
+    @staticmethod
+    def _adapt(key, value):
+        return Json(value) if key in ('result', 'error') and value is not None else value
+
+    def create(self, job):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO analyze_jobs (id, status, created_at) VALUES (%s, %s, %s)",
+                    (job['id'], job['status'], job['created_at'])
+                )
+            conn.commit()
+
+    def update(self, job_id, **fields):
+        columns = [k for k in fields if k in self.COLUMNS and k != 'id']
+        assignments = ", ".join(f"{column} = %s" for column in columns)
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"UPDATE analyze_jobs SET {assignments}, updated_at = NOW() WHERE id = %s",
+                    [self._adapt(c, fields[c]) for c in columns] + [job_id]
+                )
+            conn.commit()
+
+    def get(self, job_id):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT {', '.join(self.COLUMNS)} FROM analyze_jobs WHERE id = %s",
+                    (job_id,)
+                )
+                row = cur.fetchone()
+            conn.rollback()
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        for key in ('created_at', 'started_at', 'finished_at'):
+            if job[key] is not None:
+                job[key] = job[key].isoformat()
+        return job
+
+    def purge(self, ttl):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM analyze_jobs
+                    WHERE status IN %s AND updated_at < NOW() - make_interval(secs => %s)
+                """, (FINISHED_STATUSES, ttl))
+                deleted = cur.rowcount
+            conn.commit()
+        return deleted
+
+
+class JobManager:
+    """Runs a handler for submitted payloads on a pool of worker threads.
+
+    ``submit()`` never blocks: once ``max_queue`` jobs are waiting it raises
+    ``JobQueueFull``. Finished jobs stay readable for ``result_ttl`` seconds.
+    """
+
+    def __init__(self, handler, store, workers=4, max_queue=100, result_ttl=300.0):
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._running = 0
+        self._last_purge = time.monotonic()
+        self._counters = {
+            'submitted': 0,
+            'rejected': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'expired': 0,
+        }
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(self.workers - len(self._threads)):
+                thread = threading.Thread(target=self._run, name=f'analyze-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, payload):
+        """Queue a payload and return its job id"""
+        self._ensure_workers()
+        if self._queue.full():
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise JobQueueFull(f"{self._queue.maxsize} jobs already queued")
+        job_id = uuid.uuid4().hex
+        self.store.create({'id': job_id, 'status': 'queued', 'created_at': _now()})
+        try:
+            # The job runs in a copy of the submitter's context, so its logs keep the request id
+            self._queue.put_nowait((job_id, payload, contextvars.copy_context()))
+        except queue.Full:
+            self.store.update(job_id, status='failed', finished_at=_now(),
+                              error={'error': 'Job queue is full'})
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise JobQueueFull(f"{self._queue.maxsize} jobs already queued")
+        with self._lock:
+            self._counters['submitted'] += 1
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _run(self):
+        while True:
+            try:
+                job_id, payload, context = self._queue.get(timeout=self.result_ttl / 4 or 1)
+            except queue.Empty:
+                self._purge()
+                continue
+            with self._lock:
+                self._running += 1
+            try:
+                context.run(self._execute, job_id, payload)
+            finally:
+                with self._lock:
+                    self._running -= 1
+            self._purge()
+
+    def _execute(self, job_id, payload):
+        try:
+            self.store.update(job_id, status='running', started_at=_now())
+            result = self.handler(payload)
+        except JobError as e:
+            self._finish(job_id, 'failed', error=e.payload)
+        except Exception as e:
+            logger.exception("Job %s failed: %s: %s", job_id, type(e).__name__, e)
+            self._finish(job_id, 'failed', error={'error': str(e), 'type': type(e).__name__})
+        else:
+            self._finish(job_id, 'succeeded', result=result)
+
+    def _finish(self, job_id, status, **fields):
+        try:
+            self.store.update(job_id, status=status, finished_at=_now(), **fields)
+        except Exception as e:
+            logger.error("Could not store result of job %s: %s", job_id, e)
+        with self._lock:
+            self._counters[status] += 1
+
+    def _purge(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < min(self.result_ttl / 4, 30):
+                return
+            self._last_purge = now
+        try:
+            expired = self.store.purge(self.result_ttl)
+        except Exception as e:
+            logger.warning("Could not purge expired jobs: %s", e)
+            return
+        with self._lock:
+            self._counters['expired'] += expired
+
+    def stats(self):
+        with self._lock:
+            return {
+                'store': self.store.name,
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self._queue.maxsize,
+                'running': self._running,
+                **self._counters,
+            }
@@ -0,0 +1,137 @@
+"""Structured, non-blocking logging with per-request context"""
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+sampled_var = contextvars.ContextVar('log_sampled', default=True)
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id', 'taskName'}
+
+
+def start_request(request_id, sample_rate=1.0):
+    """Bind a request id and a debug-sampling decision to the current context"""
+    request_id_var.set(request_id)
+    sampled_var.set(sample_rate >= 1.0 or random.random() < sample_rate)
+
+
+class ContextFilter(logging.Filter):
+    """Stamps the request id on records and drops DEBUG records of unsampled requests"""
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and not sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development"""
+
+    def format(self, record):
+        line = super().format(record)
+        request_id = getattr(record, 'request_id', None)
+        return f"[{request_id}] {line}" if request_id else line
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread without ever blocking the caller.
+
+    The message is interpolated here, because arguments may change after the
+    call returns. JSON encoding and the actual write happen on the listener
+    thread. Records are dropped, and counted, if the queue is full.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def configure_logging(level='INFO', fmt='json', queue_size=10000, quiet_loggers=('urllib3', 'httpx', 'huggingface_hub')):
+    """Route all logging through a background writer thread.
+
+    Call again in a forked child: the parent's writer thread doesn't survive
+    the fork, so it is abandoned rather than stopped.
+    """
+    global _listener, _listener_pid
+    with _listener_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(
+            JsonFormatter() if fmt == 'json'
+            else TextFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+        )
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+        for name in quiet_loggers:
+            logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+        _listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+        _listener = None
@@ -0,0 +1,76 @@
+"""Database maintenance commands
+
+    python manage.py migrate
+    python manage.py maintain [--months-ahead 3] [--retain-months 24] [--drop]
+    python manage.py rebuild-rollups
+    python manage.py check-matches
+
+Run ``maintain`` daily from cron: it creates the coming months' partitions
+and, with --retain-months, detaches older ones (or drops them with --drop).
+``check-matches`` needs no database: it exits 1 if any Food-101 label now
+matches a different seed menu item than pinned in food101_matches.py.
+"""
+import argparse
+import os
+import sys
+
+import psycopg2
+
+import food101_matches
+from migrations import LATEST_VERSION, maintain, migrate
+from rollups import SalesRollups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('migrate', help='apply pending schema migrations')
+
+    maintain_parser = commands.add_parser('maintain', help='create upcoming partitions and retire old ones')
+    maintain_parser.add_argument('--months-ahead', type=int,
+                                 default=int(os.environ.get('PARTITION_MONTHS_AHEAD', 3)))
+    maintain_parser.add_argument('--retain-months', type=int,
+                                 default=int(os.environ.get('TRANSACTION_RETENTION_MONTHS', 0)),
+                                 help='keep this many past months attached (0 keeps everything)')
+    maintain_parser.add_argument('--drop', action='store_true',
+                                 help='drop retired partitions instead of only detaching them')
+
+    commands.add_parser('rebuild-rollups',
+                        help='recompute sales rollups from raw rows (after changing REPORT_TIMEZONE)')
+
+    commands.add_parser('check-matches',
+                        help='compare Food-101 label matches on the seed menu with the pinned table')
+
+    args = parser.parse_args(argv)
+    if args.command == 'check-matches':
+        mismatches = food101_matches.mismatches()
+        for label, expected, actual in mismatches:
+            print(f"{label}: expected {expected}, now {actual}")
+        print(f"{len(mismatches)} of {len(food101_matches.EXPECTED)} labels changed")
+        return 1 if mismatches else 0
+
+    conn = psycopg2.connect(args.database_url, connect_timeout=int(os.environ.get('DB_CONNECT_TIMEOUT', 10)))
+    try:
+        applied = migrate(conn)
+        print(f"Applied migrations: {applied or 'none'}")
+        print(f"Schema version: {LATEST_VERSION}")
+        if args.command == 'maintain':
+            created, removed = maintain(
+                conn, months_ahead=args.months_ahead, retain_months=args.retain_months, drop=args.drop
+            )
+            print(f"Created partitions: {', '.join(created) or 'none'}")
+            print(f"{'Dropped' if args.drop else 'Detached'} partitions: {', '.join(removed) or 'none'}")
+        elif args.command == 'rebuild-rollups':
+            with conn.cursor() as cur:
+                SalesRollups(os.environ.get('REPORT_TIMEZONE', 'UTC')).rebuild(cur)
+            conn.commit()
+            print("Rebuilt sales rollups")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
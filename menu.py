@@ -0,0 +1,454 @@
+"""Database-backed menu with an immutable, hot-swapped in-process snapshot
+
+Requests read ``MenuCache.current()``, a plain attribute read, and use the
+snapshot's dict and matcher without taking any lock. A background thread
+LISTENs for menu_changed notifications (sent by triggers on the menu tables)
+and also polls menu_version as a fallback. When the version moves it loads
+the menu, builds a new snapshot with its matcher and swaps it in with a
+single assignment.
+"""
+import logging
+import os
+import select
+import threading
+import time
+from types import MappingProxyType
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from food_matcher import FoodMatcher
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'menu_changed'
+
+# Seed menu with prices (MKD - Macedonian Denar). The live menu is the
+# menu_items table; this seeds it and serves when the database is unreachable.
+FOOD_DATABASE = {
+    # Main dishes
+    "pizza": {"price": 250, "calories": 266, "protein": 11, "carbs": 33, "fat": 10},
+    "burger": {"price": 180, "calories": 295, "protein": 17, "carbs": 24, "fat": 14},
+    "hamburger": {"price": 180, "calories": 295, "protein": 17, "carbs": 24, "fat": 14},
+    "cheeseburger": {"price": 200, "calories": 350, "protein": 20, "carbs": 28, "fat": 18},
+    "sandwich": {"price": 120, "calories": 304, "protein": 13, "carbs": 40, "fat": 11},
+    "salad": {"price": 150, "calories": 33, "protein": 3, "carbs": 7, "fat": 0.2},
+    "pasta": {"price": 200, "calories": 158, "protein": 6, "carbs": 31, "fat": 1},
+    "spaghetti": {"price": 220, "calories": 200, "protein": 8, "carbs": 40, "fat": 2},
+    "lasagna": {"price": 280, "calories": 350, "protein": 18, "carbs": 35, "fat": 15},
+    "macaroni": {"price": 180, "calories": 180, "protein": 7, "carbs": 38, "fat": 1.5},
+    "ravioli": {"price": 240, "calories": 220, "protein": 10, "carbs": 32, "fat": 6},
+    "rice": {"price": 80, "calories": 130, "protein": 2.7, "carbs": 28, "fat": 0.3},
+    "fried rice": {"price": 150, "calories": 228, "protein": 5, "carbs": 44, "fat": 4},
+    
+    # Meat & Protein
+    "chicken": {"price": 220, "calories": 239, "protein": 27, "carbs": 0, "fat": 14},
+    "fried chicken": {"price": 250, "calories": 320, "protein": 25, "carbs": 12, "fat": 19},
+    "grilled chicken": {"price": 240, "calories": 165, "protein": 31, "carbs": 0, "fat": 3.6},
+    "chicken breast": {"price": 260, "calories": 165, "protein": 31, "carbs": 0, "fat": 3.6},
+    "chicken wings": {"price": 230, "calories": 290, "protein": 23, "carbs": 0, "fat": 21},
+    "chicken nuggets": {"price": 180, "calories": 280, "protein": 14, "carbs": 18, "fat": 17},
+    "chicken thigh": {"price": 240, "calories": 209, "protein": 26, "carbs": 0, "fat": 11},
+    "beef": {"price": 280, "calories": 250, "protein": 26, "carbs": 0, "fat": 15},
+    "steak": {"price": 350, "calories": 271, "protein": 25, "carbs": 0, "fat": 19},
+    "meatball": {"price": 200, "calories": 250, "protein": 15, "carbs": 8, "fat": 18},
+    "meatloaf": {"price": 220, "calories": 245, "protein": 16, "carbs": 10, "fat": 15},
+    "pork": {"price": 260, "calories": 242, "protein": 27, "carbs": 0, "fat": 14},
+    "pork chop": {"price": 270, "calories": 231, "protein": 25, "carbs": 0, "fat": 14},
+    "ribs": {"price": 320, "calories": 361, "protein": 27, "carbs": 0, "fat": 28},
+    "lamb": {"price": 340, "calories": 294, "protein": 25, "carbs": 0, "fat": 21},
+    "fish": {"price": 300, "calories": 206, "protein": 22, "carbs": 0, "fat": 12},
+    "salmon": {"price": 380, "calories": 208, "protein": 20, "carbs": 0, "fat": 13},
+    "tuna": {"price": 320, "calories": 132, "protein": 28, "carbs": 0, "fat": 1},
+    "shrimp": {"price": 340, "calories": 99, "protein": 24, "carbs": 0, "fat": 0.3},
+    "seafood": {"price": 360, "calories": 150, "protein": 20, "carbs": 5, "fat": 5},
+    "hot dog": {"price": 110, "calories": 290, "protein": 10, "carbs": 23, "fat": 18},
+    "hotdog": {"price": 110, "calories": 290, "protein": 10, "carbs": 23, "fat": 18},
+    "bacon": {"price": 95, "calories": 541, "protein": 37, "carbs": 1.4, "fat": 42},
+    "sausage": {"price": 140, "calories": 301, "protein": 12, "carbs": 1.5, "fat": 27},
+    "ham": {"price": 160, "calories": 145, "protein": 21, "carbs": 1.5, "fat": 6},
+    "turkey": {"price": 240, "calories": 189, "protein": 29, "carbs": 0, "fat": 7},
+    
+    # Fast Food
+    "taco": {"price": 160, "calories": 226, "protein": 9, "carbs": 20, "fat": 13},
+    "burrito": {"price": 200, "calories": 326, "protein": 15, "carbs": 41, "fat": 11},
+    "quesadilla": {"price": 180, "calories": 380, "protein": 17, "carbs": 30, "fat": 22},
+    "nachos": {"price": 150, "calories": 346, "protein": 7, "carbs": 36, "fat": 19},
+    "wrap": {"price": 140, "calories": 280, "protein": 12, "carbs": 35, "fat": 10},
+    "kebab": {"price": 190, "calories": 350, "protein": 20, "carbs": 30, "fat": 17},
+    "gyro": {"price": 180, "calories": 400, "protein": 18, "carbs": 35, "fat": 20},
+    "falafel": {"price": 130, "calories": 333, "protein": 13, "carbs": 32, "fat": 18},
+    
+    # Soups & Stews
+    "soup": {"price": 100, "calories": 71, "protein": 4, "carbs": 9, "fat": 2},
+    "chicken soup": {"price": 120, "calories": 86, "protein": 6, "carbs": 8, "fat": 3},
+    "tomato soup": {"price": 110, "calories": 74, "protein": 2, "carbs": 16, "fat": 0.6},
+    "vegetable soup": {"price": 100, "calories": 67, "protein": 3, "carbs": 12, "fat": 0.6},
+    "noodle soup": {"price": 130, "calories": 105, "protein": 4, "carbs": 18, "fat": 2},
+    "ramen": {"price": 140, "calories": 436, "protein": 19, "carbs": 54, "fat": 14},
+    "pho": {"price": 160, "calories": 215, "protein": 15, "carbs": 29, "fat": 2.6},
+    "stew": {"price": 180, "calories": 235, "protein": 18, "carbs": 15, "fat": 11},
+    "chili": {"price": 150, "calories": 222, "protein": 13, "carbs": 21, "fat": 9},
+    
+    # Sides & Snacks
+    "french fries": {"price": 90, "calories": 312, "protein": 3.4, "carbs": 41, "fat": 15},
+    "fries": {"price": 90, "calories": 312, "protein": 3.4, "carbs": 41, "fat": 15},
+    "onion rings": {"price": 100, "calories": 276, "protein": 3.7, "carbs": 31, "fat": 16},
+    "mozzarella sticks": {"price": 130, "calories": 320, "protein": 14, "carbs": 22, "fat": 20},
+    "potato": {"price": 50, "calories": 77, "protein": 2, "carbs": 17, "fat": 0.1},
+    "baked potato": {"price": 80, "calories": 93, "protein": 2.5, "carbs": 21, "fat": 0.2},
+    "mashed potato": {"price": 90, "calories": 113, "protein": 2, "carbs": 17, "fat": 4.2},
+    "sweet potato": {"price": 70, "calories": 86, "protein": 1.6, "carbs": 20, "fat": 0.1},
+    "coleslaw": {"price": 70, "calories": 152, "protein": 1.5, "carbs": 11, "fat": 12},
+    
+    # Vegetables
+    "vegetables": {"price": 120, "calories": 65, "protein": 3, "carbs": 13, "fat": 0.4},
+    "broccoli": {"price": 70, "calories": 34, "protein": 2.8, "carbs": 7, "fat": 0.4},
+    "carrot": {"price": 40, "calories": 41, "protein": 0.9, "carbs": 10, "fat": 0.2},
+    "corn": {"price": 60, "calories": 96, "protein": 3.4, "carbs": 21, "fat": 1.5},
+    "peas": {"price": 55, "calories": 81, "protein": 5, "carbs": 14, "fat": 0.4},
+    "green beans": {"price": 65, "calories": 31, "protein": 1.8, "carbs": 7, "fat": 0.2},
+    "spinach": {"price": 80, "calories": 23, "protein": 2.9, "carbs": 3.6, "fat": 0.4},
+    "lettuce": {"price": 45, "calories": 5, "protein": 0.5, "carbs": 1, "fat": 0.1},
+    "tomato": {"price": 40, "calories": 18, "protein": 0.9, "carbs": 3.9, "fat": 0.2},
+    "cucumber": {"price": 45, "calories": 16, "protein": 0.7, "carbs": 3.6, "fat": 0.1},
+    "onion": {"price": 35, "calories": 40, "protein": 1.1, "carbs": 9, "fat": 0.1},
+    "pepper": {"price": 55, "calories": 20, "protein": 0.9, "carbs": 4.6, "fat": 0.2},
+    "bell pepper": {"price": 60, "calories": 31, "protein": 1, "carbs": 6, "fat": 0.3},
+    "mushroom": {"price": 85, "calories": 22, "protein": 3.1, "carbs": 3.3, "fat": 0.3},
+    "eggplant": {"price": 70, "calories": 25, "protein": 1, "carbs": 6, "fat": 0.2},
+    "zucchini": {"price": 65, "calories": 17, "protein": 1.2, "carbs": 3.1, "fat": 0.3},
+    "cauliflower": {"price": 75, "calories": 25, "protein": 1.9, "carbs": 5, "fat": 0.3},
+    "cabbage": {"price": 50, "calories": 25, "protein": 1.3, "carbs": 6, "fat": 0.1},
+    "asparagus": {"price": 95, "calories": 20, "protein": 2.2, "carbs": 3.9, "fat": 0.1},
+    
+    # Bread & Grains
+    "bread": {"price": 30, "calories": 265, "protein": 9, "carbs": 49, "fat": 3.2},
+    "toast": {"price": 40, "calories": 270, "protein": 9, "carbs": 50, "fat": 3.5},
+    "bagel": {"price": 60, "calories": 277, "protein": 11, "carbs": 54, "fat": 2},
+    "croissant": {"price": 80, "calories": 406, "protein": 8, "carbs": 46, "fat": 21},
+    "muffin": {"price": 70, "calories": 289, "protein": 5, "carbs": 44, "fat": 11},
+    "pancakes": {"price": 100, "calories": 227, "protein": 6, "carbs": 28, "fat": 10},
+    "waffles": {"price": 110, "calories": 291, "protein": 6, "carbs": 38, "fat": 13},
+    "cereal": {"price": 50, "calories": 379, "protein": 9, "carbs": 84, "fat": 3},
+    "oatmeal": {"price": 60, "calories": 68, "protein": 2.4, "carbs": 12, "fat": 1.4},
+    "granola": {"price": 90, "calories": 471, "protein": 11, "carbs": 61, "fat": 20},
+    
+    # Dairy & Eggs
+    "cheese": {"price": 60, "calories": 402, "protein": 25, "carbs": 1.3, "fat": 33},
+    "cheddar": {"price": 70, "calories": 403, "protein": 25, "carbs": 1.3, "fat": 33},
+    "mozzarella": {"price": 75, "calories": 280, "protein": 28, "carbs": 3, "fat": 17},
+    "parmesan": {"price": 85, "calories": 431, "protein": 38, "carbs": 4, "fat": 29},
+    "egg": {"price": 20, "calories": 155, "protein": 13, "carbs": 1.1, "fat": 11},
+    "boiled egg": {"price": 25, "calories": 155, "protein": 13, "carbs": 1.1, "fat": 11},
+    "fried egg": {"price": 30, "calories": 196, "protein": 14, "carbs": 1, "fat": 15},
+    "scrambled eggs": {"price": 50, "calories": 204, "protein": 14, "carbs": 3, "fat": 15},
+    "omelette": {"price": 90, "calories": 154, "protein": 11, "carbs": 1, "fat": 12},
+    "yogurt": {"price": 45, "calories": 59, "protein": 10, "carbs": 3.6, "fat": 0.4},
+    "milk": {"price": 55, "calories": 42, "protein": 3.4, "carbs": 5, "fat": 1},
+    "butter": {"price": 50, "calories": 717, "protein": 0.9, "carbs": 0.1, "fat": 81},
+    
+    # Beverages
+    "coffee": {"price": 70, "calories": 2, "protein": 0.3, "carbs": 0, "fat": 0},
+    "latte": {"price": 100, "calories": 103, "protein": 6, "carbs": 10, "fat": 4},
+    "cappuccino": {"price": 95, "calories": 80, "protein": 4, "carbs": 8, "fat": 4},
+    "espresso": {"price": 60, "calories": 3, "protein": 0.1, "carbs": 0.5, "fat": 0},
+    "tea": {"price": 40, "calories": 1, "protein": 0, "carbs": 0.3, "fat": 0},
+    "juice": {"price": 60, "calories": 45, "protein": 0.5, "carbs": 11, "fat": 0.1},
+    "orange juice": {"price": 65, "calories": 45, "protein": 0.7, "carbs": 10, "fat": 0.2},
+    "apple juice": {"price": 60, "calories": 46, "protein": 0.1, "carbs": 11, "fat": 0.1},
+    "smoothie": {"price": 120, "calories": 145, "protein": 3, "carbs": 32, "fat": 1.5},
+    "milkshake": {"price": 130, "calories": 350, "protein": 8, "carbs": 50, "fat": 13},
+    "soda": {"price": 50, "calories": 140, "protein": 0, "carbs": 39, "fat": 0},
+    "water": {"price": 25, "calories": 0, "protein": 0, "carbs": 0, "fat": 0},
+    
+    # Desserts
+    "cake": {"price": 130, "calories": 257, "protein": 3, "carbs": 36, "fat": 12},
+    "chocolate cake": {"price": 150, "calories": 352, "protein": 5, "carbs": 51, "fat": 15},
+    "cheesecake": {"price": 160, "calories": 321, "protein": 6, "carbs": 26, "fat": 23},
+    "cupcake": {"price": 80, "calories": 305, "protein": 3, "carbs": 45, "fat": 13},
+    "cookie": {"price": 50, "calories": 502, "protein": 5.9, "carbs": 64, "fat": 24},
+    "brownie": {"price": 90, "calories": 466, "protein": 6, "carbs": 50, "fat": 28},
+    "donut": {"price": 70, "calories": 452, "protein": 5, "carbs": 51, "fat": 25},
+    "pie": {"price": 120, "calories": 296, "protein": 2, "carbs": 44, "fat": 13},
+    "apple pie": {"price": 130, "calories": 296, "protein": 2, "carbs": 44, "fat": 13},
+    "ice cream": {"price": 80, "calories": 207, "protein": 3.5, "carbs": 24, "fat": 11},
+    "gelato": {"price": 100, "calories": 160, "protein": 3, "carbs": 20, "fat": 7},
+    "pudding": {"price": 70, "calories": 130, "protein": 3, "carbs": 20, "fat": 4},
+    "tiramisu": {"price": 140, "calories": 240, "protein": 5, "carbs": 21, "fat": 15},
+    "chocolate": {"price": 70, "calories": 546, "protein": 4.9, "carbs": 61, "fat": 31},
+    "candy": {"price": 50, "calories": 400, "protein": 0, "carbs": 100, "fat": 0},
+    
+    # International Cuisine
+    "sushi": {"price": 350, "calories": 143, "protein": 6, "carbs": 21, "fat": 3.5},
+    "sashimi": {"price": 380, "calories": 127, "protein": 24, "carbs": 0, "fat": 3},
+    "tempura": {"price": 280, "calories": 350, "protein": 12, "carbs": 35, "fat": 18},
+    "pad thai": {"price": 220, "calories": 380, "protein": 15, "carbs": 50, "fat": 12},
+    "spring roll": {"price": 90, "calories": 140, "protein": 4, "carbs": 18, "fat": 6},
+    "dumpling": {"price": 130, "calories": 175, "protein": 7, "carbs": 22, "fat": 6},
+    "dim sum": {"price": 150, "calories": 200, "protein": 8, "carbs": 25, "fat": 7},
+    "curry": {"price": 240, "calories": 250, "protein": 12, "carbs": 20, "fat": 14},
+    "biryani": {"price": 200, "calories": 280, "protein": 15, "carbs": 38, "fat": 8},
+    "naan": {"price": 60, "calories": 262, "protein": 9, "carbs": 45, "fat": 5},
+    "paella": {"price": 300, "calories": 320, "protein": 18, "carbs": 42, "fat": 9},
+    "risotto": {"price": 250, "calories": 240, "protein": 6, "carbs": 38, "fat": 7},
+    
+    # Misc
+    "meat": {"price": 250, "calories": 250, "protein": 26, "carbs": 0, "fat": 15},
+    "fruit": {"price": 60, "calories": 60, "protein": 0.5, "carbs": 15, "fat": 0.2},
+    "nuts": {"price": 100, "calories": 607, "protein": 20, "carbs": 21, "fat": 54},
+    "apple": {"price": 35, "calories": 52, "protein": 0.3, "carbs": 14, "fat": 0.2},
+    "banana": {"price": 30, "calories": 89, "protein": 1.1, "carbs": 23, "fat": 0.3},
+    "orange": {"price": 40, "calories": 47, "protein": 0.9, "carbs": 12, "fat": 0.1},
+    "grape": {"price": 80, "calories": 69, "protein": 0.7, "carbs": 18, "fat": 0.2},
+    "strawberry": {"price": 90, "calories": 32, "protein": 0.7, "carbs": 7.7, "fat": 0.3},
+    "watermelon": {"price": 50, "calories": 30, "protein": 0.6, "carbs": 8, "fat": 0.2},
+    "pineapple": {"price": 70, "calories": 50, "protein": 0.5, "carbs": 13, "fat": 0.1},
+    "mango": {"price": 75, "calories": 60, "protein": 0.8, "carbs": 15, "fat": 0.4},
+    "peach": {"price": 55, "calories": 39, "protein": 0.9, "carbs": 10, "fat": 0.3},
+    "pear": {"price": 50, "calories": 57, "protein": 0.4, "carbs": 15, "fat": 0.1},
+    "plum": {"price": 45, "calories": 46, "protein": 0.7, "carbs": 11, "fat": 0.3},
+    "kiwi": {"price": 60, "calories": 61, "protein": 1.1, "carbs": 15, "fat": 0.5},
+    "avocado": {"price": 95, "calories": 160, "protein": 2, "carbs": 9, "fat": 15},
+}
+
+# Food-101 labels (and other phrasings) that don't contain a menu key verbatim
+FOOD_ALIASES = {
+    "cup cakes": "cupcake",
+    "macaroni and cheese": "macaroni",
+    "gnocchi": "pasta",
+    "bibimbap": "rice",
+    "poutine": "fries",
+    "guacamole": "avocado",
+    "macarons": "cookie",
+    "beignets": "donut",
+    "churros": "donut",
+    "panna cotta": "pudding",
+    "creme brulee": "pudding",
+    "croque madame": "sandwich",
+    "ceviche": "fish",
+    "mussels": "seafood",
+    "oysters": "seafood",
+    "scallops": "seafood",
+    "lobster": "seafood",
+    "crab cakes": "seafood",
+    # Otherwise "strawberry shortcake" is charged as the fruit
+    "shortcake": "cake",
+    "clam chowder": "soup",
+    "lobster bisque": "soup",
+    "hot and sour soup": "soup",
+    "gyoza": "dumpling",
+    "filet mignon": "steak",
+    "prime rib": "beef",
+}
+
+SCHEMA_SQL = """
+    CREATE TABLE menu_items (
+        name VARCHAR(100) PRIMARY KEY,
+        price DECIMAL(10,2) NOT NULL,
+        calories DECIMAL(10,2) NOT NULL,
+        protein DECIMAL(10,2) NOT NULL,
+        carbs DECIMAL(10,2) NOT NULL,
+        fat DECIMAL(10,2) NOT NULL,
+        active BOOLEAN NOT NULL DEFAULT TRUE,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+
+    CREATE TABLE menu_aliases (
+        alias VARCHAR(100) PRIMARY KEY,
+        name VARCHAR(100) NOT NULL REFERENCES menu_items(name) ON UPDATE CASCADE ON DELETE CASCADE
+    );
+
+    -- Single row, bumped by every statement that changes the menu
+    CREATE TABLE menu_version (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL
+    );
+    INSERT INTO menu_version (version) VALUES (0);
+
+    CREATE FUNCTION bump_menu_version() RETURNS trigger AS $$
+    DECLARE
+        new_version BIGINT;
+    BEGIN
+        UPDATE menu_version SET version = version + 1 RETURNING version INTO new_version;
+        PERFORM pg_notify('menu_changed', new_version::text);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER menu_items_changed
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON menu_items
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_menu_version();
+    CREATE TRIGGER menu_aliases_changed
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON menu_aliases
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_menu_version();
+"""
+
+NUTRITION_FIELDS = ('price', 'calories', 'protein', 'carbs', 'fat')
+
+
+def seed(cur, items=None, aliases=None):
+    """Insert the seed menu, leaving existing rows untouched"""
+    items = FOOD_DATABASE if items is None else items
+    aliases = FOOD_ALIASES if aliases is None else aliases
+    execute_values(cur, """
+        INSERT INTO menu_items (name, price, calories, protein, carbs, fat) VALUES %s
+        ON CONFLICT (name) DO NOTHING
+    """, [(name, *(info[field] for field in NUTRITION_FIELDS)) for name, info in items.items()])
+    execute_values(cur, """
+        INSERT INTO menu_aliases (alias, name) VALUES %s
+        ON CONFLICT (alias) DO NOTHING
+    """, list(aliases.items()))
+
+
+def _number(value):
+    """Decimal from the database as the int or float the seed menu uses"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class MenuSnapshot:
+    """One immutable version of the menu plus the matcher built from it"""
+
+    __slots__ = ('version', 'items', 'matcher', 'loaded_at')
+
+    def __init__(self, version, items, aliases):
+        self.version = version
+        self.items = MappingProxyType({name: MappingProxyType(dict(info)) for name, info in items.items()})
+        self.matcher = FoodMatcher(self.items, {a: n for a, n in aliases.items() if n in self.items})
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.items)
+
+
+def load_snapshot(conn):
+    """Read the active menu and its version from one consistent database snapshot"""
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cur.execute("SELECT version FROM menu_version")
+        version = cur.fetchone()[0]
+        cur.execute(f"SELECT name, {', '.join(NUTRITION_FIELDS)} FROM menu_items WHERE active")
+        items = {
+            row[0]: dict(zip(NUTRITION_FIELDS, (_number(v) for v in row[1:])))
+            for row in cur.fetchall()
+        }
+        cur.execute("SELECT alias, name FROM menu_aliases")
+        aliases = dict(cur.fetchall())
+    conn.rollback()
+    return MenuSnapshot(version, items, aliases)
+
+
+class MenuCache:
+    """Holds the current MenuSnapshot and keeps it in step with the database.
+
+    Until the first successful load, and whenever the database is not
+    configured, the seed menu is served as version 0.
+    """
+
+    def __init__(self, pool, poll_interval=5.0, listen=True):
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.listen = listen
+        self._snapshot = MenuSnapshot(0, FOOD_DATABASE, FOOD_ALIASES)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._counters = {
+            'reloads': 0,
+            'notifications': 0,
+            'errors': 0,
+        }
+
+    def current(self):
+        """The live snapshot; hold on to it for the whole request"""
+        if self._pid != os.getpid():
+            self.start()
+        return self._snapshot
+
+    def refresh(self, force=False):
+        """Swap in a new snapshot if the database version moved; returns True if it did"""
+        if not force:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT version FROM menu_version")
+                    version = cur.fetchone()[0]
+                conn.rollback()
+            if version == self._snapshot.version:
+                return False
+        with self.pool.connection() as conn:
+            snapshot = load_snapshot(conn)
+        # Readers see either the old snapshot or the new one, never a mix
+        self._snapshot = snapshot
+        with self._lock:
+            self._counters['reloads'] += 1
+        logger.info("Loaded menu version %s (%d items)", snapshot.version, len(snapshot))
+        return True
+
+    def start(self):
+        """Start the watcher thread in this process (after a fork, too)"""
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            if not self.pool.dsn:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='menu-watcher', daemon=True)
+            self._thread.start()
+
+    def _listen_connection(self):
+        conn = psycopg2.connect(self.pool.dsn, connect_timeout=self.pool.connect_timeout)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return conn
+
+    def _wait(self, conn):
+        """Block until a notification arrives or the poll interval passes"""
+        if conn is None:
+            self._stopping.wait(self.poll_interval)
+            return
+        if select.select([conn], [], [], self.poll_interval)[0]:
+            conn.poll()
+            if conn.notifies:
+                with self._lock:
+                    self._counters['notifications'] += len(conn.notifies)
+                conn.notifies.clear()
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = self._listen_connection() if self.listen else None
+                # Catch up on anything missed before LISTEN took effect
+                self.refresh()
+                backoff = 1.0
+                while not self._stopping.is_set():
+                    self._wait(conn)
+                    self.refresh()
+            except Exception as e:
+                with self._lock:
+                    self._counters['errors'] += 1
+                logger.warning("Menu watcher error, retrying in %.0fs: %s", backoff, e)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self):
+        snapshot = self._snapshot
+        with self._lock:
+            return {
+                'version': snapshot.version,
+                'items': len(snapshot),
+                'loaded_at': snapshot.loaded_at,
+                'listening': self.listen,
+                **self._counters,
+            }
@@ -0,0 +1,110 @@
+"""Prometheus metrics for the analyze pipeline
+
+When PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py does this), every
+worker writes its samples to that directory and /metrics aggregates all of
+them, so a scrape sees the whole service no matter which worker answers.
+"""
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client import multiprocess
+from werkzeug.exceptions import HTTPException
+
+# Sub-millisecond CPU stages up to multi-second remote inference
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+STAGE_LATENCY = Histogram(
+    'analyze_stage_duration_seconds',
+    'Time spent in each stage of the analyze pipeline',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'End-to-end request latency',
+    ['endpoint', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'Requests currently being handled',
+    ['endpoint'],
+    multiprocess_mode='livesum'
+)
+ERRORS = Counter(
+    'analyze_errors_total',
+    'Analyze failures by stage',
+    ['stage']
+)
+PREDICTION_LOOKUPS = Counter(
+    'prediction_lookups_total',
+    'Where predictions came from: exact cache, near-duplicate cache or the model',
+    ['source']
+)
+INFERENCE_DEGRADED = Counter(
+    'inference_degraded_total',
+    'Model calls that failed and were answered with a degraded response, by reason',
+    ['reason']
+)
+ADMISSION_REJECTIONS = Counter(
+    'admission_rejections_total',
+    'Requests turned away before any work: queue_full, deadline, timeout or rate_limited',
+    ['reason']
+)
+DEFAULT_MATCHES = Counter(
+    'match_default_fallback_total',
+    'Analyses where no prediction matched the menu and default items were used'
+)
+
+
+@contextmanager
+def timed(stage):
+    """Observe the duration of a pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - started)
+
+
+def track_requests(endpoint):
+    """Route decorator recording in-flight requests and end-to-end latency"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            gauge = IN_FLIGHT.labels(endpoint)
+            gauge.inc()
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = view(*args, **kwargs)
+                status = response[1] if isinstance(response, tuple) else getattr(response, 'status_code', 200)
+                return response
+            except HTTPException as e:
+                # Rejections raised while the request is parsed (413, 415) aren't server errors
+                status = e.code or 500
+                raise
+            finally:
+                gauge.dec()
+                REQUEST_LATENCY.labels(endpoint, str(status)).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def render():
+    """Exposition body and content type for the /metrics endpoint"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
@@ -0,0 +1,283 @@
+"""Versioned schema migrations and monthly partition maintenance
+
+``migrate()`` applies pending migrations in order inside one transaction,
+holding an advisory lock so several workers starting at once don't race.
+Applied versions are recorded in schema_migrations, so running it again is
+a no-op.
+
+Sales live in two tables range-partitioned by month on created_at:
+``transactions`` (one header row per tray) and ``transaction_items`` (one
+row per item, keyed to its header). Rows outside every monthly partition
+land in a DEFAULT partition and are moved out when their month's partition
+is created.
+"""
+import os
+import re
+from datetime import datetime, timezone
+
+from idempotency import PostgresIdempotencyStore
+from jobs import PostgresJobStore
+from menu import SCHEMA_SQL as MENU_SQL, seed as seed_menu
+from prediction_cache import PostgresCacheTier
+from rollups import SCHEMA_SQL as ROLLUPS_SQL, SalesRollups
+
+# Arbitrary key for pg_advisory_xact_lock, shared by every schema change
+SCHEMA_LOCK_ID = 72_014_001
+
+PARTITIONED_TABLES = ('transactions', 'transaction_items')
+
+MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+"""
+
+TRANSACTIONS_SQL = """
+    CREATE TABLE transactions (
+        id UUID NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL,
+        item_count SMALLINT NOT NULL,
+        total_price DECIMAL(10,2) NOT NULL,
+        total_calories DECIMAL(10,2) NOT NULL,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE TABLE transaction_items (
+        transaction_id UUID NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL,
+        position SMALLINT NOT NULL,
+        food_name VARCHAR(100) NOT NULL,
+        price DECIMAL(10,2) NOT NULL,
+        calories DECIMAL(10,2) NOT NULL,
+        protein DECIMAL(10,2) NOT NULL,
+        carbs DECIMAL(10,2) NOT NULL,
+        fat DECIMAL(10,2) NOT NULL,
+        confidence DECIMAL(5,2) NOT NULL,
+        PRIMARY KEY (transaction_id, created_at, position)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE TABLE transactions_default PARTITION OF transactions DEFAULT;
+    CREATE TABLE transaction_items_default PARTITION OF transaction_items DEFAULT;
+
+    -- Rows arrive in time order, so BRIN stays tiny and still prunes time scans
+    CREATE INDEX idx_transactions_created_brin ON transactions USING brin (created_at);
+    CREATE INDEX idx_transaction_items_created_brin ON transaction_items USING brin (created_at);
+"""
+
+# Receipts table of migration 5, superseded by rendering from transaction_items
+RECEIPTS_SQL = """
+    CREATE TABLE IF NOT EXISTS receipts (
+        id VARCHAR(32) PRIMARY KEY,
+        created_at TIMESTAMPTZ NOT NULL,
+        receipt_timestamp VARCHAR(32) NOT NULL,
+        items JSONB NOT NULL,
+        totals JSONB NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_receipts_created_at ON receipts(created_at);
+"""
+
+# Items written by the old code in one request share a created_at, which is
+# the only grouping the legacy table has
+LEGACY_COPY_SQL = """
+    CREATE TEMPORARY TABLE legacy_transactions ON COMMIT DROP AS
+    SELECT gen_random_uuid() AS id, created_at
+    FROM (SELECT DISTINCT created_at FROM food_transactions WHERE created_at IS NOT NULL) AS sales;
+
+    INSERT INTO transactions (id, created_at, item_count, total_price, total_calories)
+    SELECT t.id, t.created_at::timestamptz, COUNT(*), SUM(f.price), SUM(f.calories)
+    FROM food_transactions f JOIN legacy_transactions t USING (created_at)
+    GROUP BY t.id, t.created_at;
+
+    INSERT INTO transaction_items
+    (transaction_id, created_at, position, food_name, price, calories, protein, carbs, fat, confidence)
+    SELECT t.id, t.created_at::timestamptz,
+           ROW_NUMBER() OVER (PARTITION BY t.id ORDER BY f.id) - 1,
+           f.food_name, f.price, f.calories, f.protein, f.carbs, f.fat, f.confidence
+    FROM food_transactions f JOIN legacy_transactions t USING (created_at);
+"""
+
+# Old reporting queries keep working against the item rows
+COMPAT_VIEW_SQL = """
+    CREATE VIEW food_transactions AS
+    SELECT transaction_id, food_name, price, calories, protein, carbs, fat, confidence, created_at
+    FROM transaction_items
+"""
+
+
+def _partitioned_transactions(cur):
+    cur.execute(TRANSACTIONS_SQL)
+    cur.execute("""
+        SELECT relkind FROM pg_class
+        WHERE oid = to_regclass('food_transactions')
+    """)
+    legacy = cur.fetchone()
+    if legacy is not None and legacy[0] == 'r':
+        cur.execute("SELECT MIN(created_at)::timestamptz, MAX(created_at)::timestamptz FROM food_transactions")
+        first, last = cur.fetchone()
+        if first is not None:
+            ensure_partitions(cur, first, last)
+            cur.execute(LEGACY_COPY_SQL)
+        cur.execute("ALTER TABLE food_transactions RENAME TO food_transactions_legacy")
+    cur.execute(COMPAT_VIEW_SQL)
+
+
+def _sales_rollups(cur):
+    cur.execute(ROLLUPS_SQL)
+    # One-off backfill; from here on the transaction writer keeps them current
+    SalesRollups(os.environ.get('REPORT_TIMEZONE', 'UTC')).rebuild(cur)
+
+
+def _menu(cur):
+    cur.execute(MENU_SQL)
+    seed_menu(cur)
+
+
+# (version, name, SQL string or callable taking a cursor); append only
+MIGRATIONS = [
+    (1, 'partitioned transactions', _partitioned_transactions),
+    (2, 'sales rollups', _sales_rollups),
+    # Keyset pagination of GET /transactions walks (created_at, id) in order
+    (3, 'transactions keyset index',
+     "CREATE INDEX idx_transactions_created_id ON transactions (created_at, id)"),
+    (4, 'menu tables', _menu),
+    # Tables of the optional Postgres-backed stores, previously created by each worker
+    (5, 'shared store tables',
+     PostgresCacheTier.SCHEMA_SQL + PostgresJobStore.SCHEMA_SQL + RECEIPTS_SQL),
+    (6, 'idempotency keys', PostgresIdempotencyStore.SCHEMA_SQL),
+    # Seeded menus predate the alias; skipped if cake was taken off the menu
+    (7, 'shortcake alias', """
+        INSERT INTO menu_aliases (alias, name)
+        SELECT 'shortcake', name FROM menu_items WHERE name = 'cake'
+        ON CONFLICT (alias) DO NOTHING
+    """),
+    # Receipts are rendered from their transaction's item rows now
+    (8, 'drop receipts table', "DROP TABLE IF EXISTS receipts"),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def lock_schema(cur):
+    """Serialize schema changes across processes until the transaction ends"""
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+
+
+def migrate(conn):
+    """Apply pending migrations and commit; returns the versions applied"""
+    applied = []
+    with conn.cursor() as cur:
+        lock_schema(cur)
+        cur.execute(MIGRATIONS_TABLE_SQL)
+        cur.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cur.fetchall()}
+        for version, name, step in MIGRATIONS:
+            if version in done:
+                continue
+            if callable(step):
+                step(cur)
+            else:
+                cur.execute(step)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name)
+            )
+            applied.append(version)
+    conn.commit()
+    return applied
+
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+def create_partition(cur, table, month):
+    """Create and attach the partition of ``table`` for a month; False if it exists"""
+    name = partition_name(table, month)
+    cur.execute("SELECT to_regclass(%s)", (name,))
+    if cur.fetchone()[0] is not None:
+        return False
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    # Attaching fails while the default partition holds rows of this month
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE created_at >= %s AND created_at < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (lower, upper))
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+    return True
+
+
+def ensure_partitions(cur, start, end):
+    """Make sure every month from ``start`` to ``end`` has its partitions"""
+    created = []
+    month, last = month_start(start), month_start(end)
+    while month <= last:
+        for table in PARTITIONED_TABLES:
+            if create_partition(cur, table, month):
+                created.append(partition_name(table, month))
+        month = add_months(month, 1)
+    return created
+
+
+def monthly_partitions(cur, table):
+    """(month, partition name) for every monthly partition attached to ``table``"""
+    cur.execute("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+    """, (table,))
+    pattern = re.compile(rf"{table}_p(\d{{4}})_(\d{{2}})")
+    partitions = []
+    for (name,) in cur.fetchall():
+        match = pattern.fullmatch(name)
+        if match:
+            partitions.append((datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc), name))
+    return sorted(partitions)
+
+
+def detach_partitions(cur, before, drop=False):
+    """Detach (or drop) monthly partitions that end on or before ``before``
+
+    Detached partitions stay in the database as plain tables, ready to be
+    archived with pg_dump and dropped.
+    """
+    cutoff = month_start(before)
+    removed = []
+    for table in PARTITIONED_TABLES:
+        for month, name in monthly_partitions(cur, table):
+            if month >= cutoff:
+                continue
+            cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            if drop:
+                cur.execute(f"DROP TABLE {name}")
+            removed.append(name)
+    return removed
+
+
+def maintain(conn, months_ahead=3, retain_months=0, drop=False, now=None):
+    """Create upcoming partitions and, with ``retain_months``, retire old ones
+
+    Returns (created, removed) partition names. Commits.
+    """
+    now = now or datetime.now(timezone.utc)
+    with conn.cursor() as cur:
+        lock_schema(cur)
+        created = ensure_partitions(cur, now, add_months(month_start(now), months_ahead))
+        removed = []
+        if retain_months:
+            removed = detach_partitions(cur, add_months(month_start(now), -retain_months), drop=drop)
+    conn.commit()
+    return created, removed
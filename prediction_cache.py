@@ -0,0 +1,240 @@
+"""Content-addressed cache for model predictions"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from psycopg2.extras import Json
+
+logger = logging.getLogger(__name__)
+
+
+def image_key(content_sha256, namespace=''):
+    """Cache key for an image given the SHA-256 (hex) of its bytes, scoped to a model name"""
+    return hashlib.sha256(f"{namespace}\0{content_sha256}".encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries=1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCacheTier:
+    """Shared cache tier backed by JSON files in a local directory.
+
+    Every gunicorn worker on the host sees the same files. Writes go to a
+    temporary file that is renamed into place, so readers never see partial
+    entries.
+    """
+
+    name = 'disk'
+
+    def __init__(self, directory, ttl=86400.0):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('expires_at', 0) < time.time():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        return entry.get('predictions')
+
+    def set(self, key, predictions):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {'expires_at': time.time() + self.ttl, 'predictions': predictions}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+class PostgresCacheTier:
+    """Shared cache tier stored in the prediction_cache table"""
+
+    name = 'postgres'
+
+    SCHEMA_SQL = """
+        CREATE TABLE IF NOT EXISTS prediction_cache (
+            cache_key CHAR(64) PRIMARY KEY,
+            predictions JSONB NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_prediction_cache_expires ON prediction_cache(expires_at);
+    """
+
+    def __init__(self, pool, ttl=86400.0, timeout=0.5):
+        self.pool = pool
+        self.ttl = ttl
+        self.timeout = timeout
+
+    def ensure_schema(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(self.SCHEMA_SQL)
+
+    def get(self, key):
+        with self.pool.connection(timeout=self.timeout) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT predictions FROM prediction_cache WHERE cache_key = %s AND expires_at > NOW()",
+                    (key,)
+                )
+                row = cur.fetchone()
+            conn.rollback()
+        return row[0] if row else None
+
+    def set(self, key, predictions):
+        with self.pool.connection(timeout=self.timeout) as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO prediction_cache (cache_key, predictions, expires_at)
+                    VALUES (%s, %s, NOW() + make_interval(secs => %s))
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET predictions = EXCLUDED.predictions, expires_at = EXCLUDED.expires_at
+                """, (key, Json(predictions), self.ttl))
+            conn.commit()
+
+    def purge_expired(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM prediction_cache WHERE expires_at <= NOW()")
+                deleted = cur.rowcount
+            conn.commit()
+        return deleted
+
+
+class PredictionCache:
+    """Two-tier prediction cache keyed by a hash of the image bytes.
+
+    Lookups hit the per-worker LRU first and then the optional shared tier
+    (disk or Postgres). Shared-tier hits are copied into the LRU. Shared
+    tier failures are logged and treated as misses so the cache can never
+    fail a request.
+    """
+
+    def __init__(self, namespace, max_entries=1024, ttl=3600.0, shared=None):
+        self.namespace = namespace
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'memory_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'shared_errors': 0,
+        }
+
+    def _count(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._counters[key] += 1
+
+    def key(self, image_bytes, content_sha256=None):
+        """Cache key for an image; pass content_sha256 if the bytes were already hashed"""
+        if content_sha256 is None:
+            content_sha256 = hashlib.sha256(image_bytes).hexdigest()
+        return image_key(content_sha256, self.namespace)
+
+    def get(self, key):
+        """Return cached predictions for a key, or None"""
+        predictions = self.memory.get(key)
+        if predictions is not None:
+            self._count('hits', 'memory_hits')
+            return predictions
+
+        if self.shared is not None:
+            try:
+                predictions = self.shared.get(key)
+            except Exception as e:
+                self._count('shared_errors')
+                logger.warning("%s tier read failed: %s", self.shared.name, e)
+                predictions = None
+            if predictions is not None:
+                self.memory.set(key, predictions)
+                self._count('hits', 'shared_hits')
+                return predictions
+
+        self._count('misses')
+        return None
+
+    def set(self, key, predictions):
+        """Store normalized predictions in every tier"""
+        self.memory.set(key, predictions)
+        self._count('sets')
+        if self.shared is not None:
+            try:
+                self.shared.set(key, predictions)
+            except Exception as e:
+                self._count('shared_errors')
+                logger.warning("%s tier write failed: %s", self.shared.name, e)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters['hits'] + counters['misses']
+        return {
+            'entries': len(self.memory),
+            'max_entries': self.memory.max_entries,
+            'shared_tier': self.shared.name if self.shared is not None else None,
+            **counters,
+            'evictions': self.memory.evictions,
+            'expirations': self.memory.expirations,
+            'hit_ratio': round(counters['hits'] / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,345 @@
+"""Receipt rendering and storage
+
+Receipts are kept as their items and totals under their transaction's id
+and rendered on request. The static part of the page is parsed once at import; rendering
+only formats the item rows and totals.
+"""
+import html
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from string import Formatter
+
+
+RECEIPT_TEMPLATE = """\
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body {{
+            font-family: 'Courier New', monospace;
+            max-width: 800px;
+            margin: 40px auto;
+            padding: 20px;
+            background: #f5f5f5;
+        }}
+        .receipt {{
+            background: white;
+            padding: 30px;
+            border: 2px dashed #333;
+            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
+        }}
+        .header {{
+            text-align: center;
+            border-bottom: 2px solid #333;
+            padding-bottom: 20px;
+            margin-bottom: 20px;
+        }}
+        .header h1 {{
+            margin: 0;
+            font-size: 28px;
+        }}
+        .header p {{
+            margin: 5px 0;
+            color: #666;
+        }}
+        table {{
+            width: 100%;
+            border-collapse: collapse;
+            margin: 20px 0;
+        }}
+        th, td {{
+            padding: 10px;
+            text-align: left;
+            border-bottom: 1px solid #ddd;
+        }}
+        th {{
+            background: #f0f0f0;
+            font-weight: bold;
+        }}
+        .totals {{
+            border-top: 3px double #333;
+            padding-top: 15px;
+            margin-top: 20px;
+        }}
+        .totals table {{
+            margin: 0;
+        }}
+        .totals td {{
+            border: none;
+            padding: 5px 10px;
+        }}
+        .total-row {{
+            font-weight: bold;
+            font-size: 18px;
+        }}
+        .footer {{
+            text-align: center;
+            margin-top: 30px;
+            padding-top: 20px;
+            border-top: 2px solid #333;
+            color: #666;
+        }}
+    </style>
+</head>
+<body>
+    <div class="receipt">
+        <div class="header">
+            <h1>🍽️ CAMPUS CANTEEN</h1>
+            <p>AI-Powered Food Recognition System</p>
+            <p>Receipt Date: {timestamp}</p>
+        </div>
+
+        <h2>Detected Items</h2>
+        <table>
+            <thead>
+                <tr>
+                    <th>Item</th>
+                    <th>Price</th>
+                    <th>Calories</th>
+                    <th>Protein</th>
+                    <th>Carbs</th>
+                    <th>Fat</th>
+                    <th>Confidence</th>
+                </tr>
+            </thead>
+            <tbody>
+                {items}
+            </tbody>
+        </table>
+
+        <div class="totals">
+            <h2>Totals</h2>
+            <table>
+                <tr>
+                    <td>Total Price:</td>
+                    <td class="total-row">{total_price} MKD</td>
+                </tr>
+                <tr>
+                    <td>Total Calories:</td>
+                    <td class="total-row">{total_calories} kcal</td>
+                </tr>
+                <tr>
+                    <td>Total Protein:</td>
+                    <td>{total_protein}g</td>
+                </tr>
+                <tr>
+                    <td>Total Carbohydrates:</td>
+                    <td>{total_carbs}g</td>
+                </tr>
+                <tr>
+                    <td>Total Fat:</td>
+                    <td>{total_fat}g</td>
+                </tr>
+            </table>
+        </div>
+
+        <div class="footer">
+            <p>Thank you for using our AI Food Recognition System!</p>
+            <p>Mobile Wireless Networks Project</p>
+            <p>Powered by Hugging Face AI</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+# Bump when the template changes so clients drop cached copies (part of the ETag)
+TEMPLATE_VERSION = 1
+
+ROW_TEMPLATE = (
+    "<tr><td>{name}</td><td>{price} MKD</td><td>{calories} kcal</td>"
+    "<td>{protein}g</td><td>{carbs}g</td><td>{fat}g</td><td>{confidence}%</td></tr>"
+)
+
+
+def _compile(template):
+    """Split a str.format template into (literal, field) pairs, dropping indentation"""
+    compact = "\n".join(line.strip() for line in template.splitlines() if line.strip())
+    return [(literal, field) for literal, field, _, _ in Formatter().parse(compact)]
+
+
+_COMPILED = _compile(RECEIPT_TEMPLATE)
+
+
+def render_receipt(items, totals, timestamp):
+    """Full HTML receipt for a tray"""
+    values = {
+        'timestamp': html.escape(str(timestamp)),
+        'items': "\n".join(
+            ROW_TEMPLATE.format(**dict(item, name=html.escape(str(item['name'])))) for item in items
+        ),
+        'total_price': totals['total_price'],
+        'total_calories': totals['total_calories'],
+        'total_protein': totals['total_protein'],
+        'total_carbs': totals['total_carbs'],
+        'total_fat': totals['total_fat'],
+    }
+    parts = []
+    for literal, field in _COMPILED:
+        parts.append(literal)
+        if field is not None:
+            parts.append(str(values[field]))
+    return "".join(parts)
+
+
+def new_receipt(items, totals, timestamp, receipt_id=None):
+    """Receipt record ready to be stored"""
+    return {
+        'id': receipt_id or uuid.uuid4().hex,
+        'created_at': datetime.now(timezone.utc),
+        'timestamp': timestamp,
+        'items': items,
+        'totals': totals,
+    }
+
+
+def receipt_etag(receipt_id):
+    """Receipts never change once stored, so the id and template version identify the body"""
+    return f"{receipt_id}-v{TEMPLATE_VERSION}"
+
+
+class MemoryReceiptStore:
+    """Most recent receipts kept in this process (only the worker that stored one can serve it)"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._receipts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save_many(self, receipts):
+        with self._lock:
+            for receipt in receipts:
+                self._receipts[receipt['id']] = receipt
+            while len(self._receipts) > self.max_entries:
+                self._receipts.popitem(last=False)
+
+    def get(self, receipt_id):
+        with self._lock:
+            return self._receipts.get(receipt_id)
+
+    def __len__(self):
+        return len(self._receipts)
+
+
+def _number(value):
+    """Decimal from the database as the int or float the analyze response had"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+class TransactionReceiptStore:
+    """Receipts read back from their tray's transaction rows, from any worker.
+
+    A receipt's id is its transaction's id and the transaction writer already
+    stores every item, so saving writes nothing more to the database and a
+    receipt lives exactly as long as its sale. ``totals`` computes the totals
+    from the items (app.calculate_totals). With DB_WRITE_MODE=async a sale
+    reaches the table up to a flush interval after the response, so receipts
+    saved by this worker are also kept in memory for that window.
+    """
+
+    name = 'transactions'
+
+    ITEMS_SQL = """
+        SELECT created_at, food_name, price, calories, protein, carbs, fat, confidence
+        FROM transaction_items
+        WHERE transaction_id = %s::uuid
+        ORDER BY position
+    """
+
+    def __init__(self, pool, totals, timeout=None, recent_size=1024):
+        self.pool = pool
+        self.totals = totals
+        self.timeout = timeout
+        self.recent = MemoryReceiptStore(max_entries=recent_size)
+
+    def save_many(self, receipts):
+        self.recent.save_many(receipts)
+
+    def get(self, receipt_id):
+        receipt = self.recent.get(receipt_id)
+        if receipt is not None:
+            return receipt
+        with self.pool.connection(timeout=self.timeout) as conn:
+            with conn.cursor() as cur:
+                cur.execute(self.ITEMS_SQL, (receipt_id,))
+                rows = cur.fetchall()
+            conn.rollback()
+        if not rows:
+            return None
+        items = [
+            dict(zip(('name', 'price', 'calories', 'protein', 'carbs', 'fat', 'confidence'),
+                     (row[1], *(_number(value) for value in row[2:]))))
+            for row in rows
+        ]
+        created_at = rows[0][0]
+        return {
+            'id': receipt_id,
+            'created_at': created_at,
+            'timestamp': created_at.astimezone().strftime("%Y-%m-%d %H:%M:%S"),
+            'items': items,
+            'totals': self.totals(items),
+        }
+
+
+class ReceiptService:
+    """Stores receipts and renders them, with a small per-worker cache of rendered pages"""
+
+    def __init__(self, store, cache_size=256):
+        self.store = store
+        self.cache_size = cache_size
+        self._rendered = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'saved': 0,
+            'save_errors': 0,
+            'rendered': 0,
+            'render_cache_hits': 0,
+        }
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._counters[key] += n
+
+    def save_many(self, receipts):
+        """Persist receipts; raises whatever the store raises"""
+        try:
+            self.store.save_many(receipts)
+        except Exception:
+            self._count('save_errors', len(receipts))
+            raise
+        self._count('saved', len(receipts))
+
+    def save(self, receipt):
+        self.save_many([receipt])
+
+    def render(self, receipt_id):
+        """HTML for a stored receipt, or None if there is no such receipt"""
+        with self._lock:
+            page = self._rendered.get(receipt_id)
+            if page is not None:
+                self._rendered.move_to_end(receipt_id)
+                self._counters['render_cache_hits'] += 1
+                return page
+        receipt = self.store.get(receipt_id)
+        if receipt is None:
+            return None
+        page = render_receipt(receipt['items'], receipt['totals'], receipt['timestamp'])
+        with self._lock:
+            self._counters['rendered'] += 1
+            self._rendered[receipt_id] = page
+            while len(self._rendered) > self.cache_size:
+                self._rendered.popitem(last=False)
+        return page
+
+    def stats(self):
+        with self._lock:
+            stats = {'store': self.store.name, 'cached_pages': len(self._rendered), **self._counters}
+        if isinstance(self.store, MemoryReceiptStore):
+            stats['stored'] = len(self.store)
+        return stats
@@ -0,0 +1,306 @@
+"""Deadlines, a circuit breaker and hedged requests around model calls"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+
+from inference_backends import InferenceBackend
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import UnidentifiedImageError
+except ImportError:
+    UnidentifiedImageError = None
+
+# Client errors that still mean the upstream is overloaded or slow
+RETRYABLE_STATUSES = frozenset((408, 429))
+
+
+class CallTimeout(Exception):
+    """The model didn't answer within the call deadline"""
+
+
+class CircuitOpen(Exception):
+    """The breaker is open; the call was rejected without reaching the model"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Inference circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def upstream_failure(error):
+    """True if an error says the model service is unhealthy, False if it's about the request.
+
+    Timeouts, connection errors, 5xx (and 408/429) answers and anything
+    unrecognised count against the upstream. A 4xx answer or an image that
+    can't be decoded is the upload's fault: the upstream did its job, so it
+    must not push the breaker towards open for every kiosk.
+    """
+    if not isinstance(error, Exception):
+        return False
+    if UnidentifiedImageError is not None and isinstance(error, UnidentifiedImageError):
+        return False
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int) and 400 <= status < 500:
+        return status in RETRYABLE_STATUSES
+    return True
+
+
+class CircuitBreaker:
+    """Fails fast once too many recent calls failed.
+
+    While closed, the outcomes of the last ``window`` calls are kept. Once at
+    least ``min_calls`` are recorded and the failed share reaches
+    ``failure_threshold`` the breaker opens and rejects calls for
+    ``reset_timeout`` seconds. It then half-opens and lets one probe call
+    through: success closes it again, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold=0.5, window=20, min_calls=10, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """True if a call may go ahead; a True in half-open state claims the probe"""
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open':
+                if self._probing:
+                    self.rejected += 1
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, success):
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+                if success:
+                    self.state = 'closed'
+                    self._outcomes.clear()
+                    logger.info("Inference circuit closed")
+                else:
+                    self._open()
+                return
+            if self.state != 'closed':
+                return
+            self._outcomes.append(success)
+            if len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_threshold:
+                    self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        logger.warning("Inference circuit opened for %.0fs", self.reset_timeout)
+
+    def retry_after(self):
+        """Seconds until the breaker lets a probe through (0 unless open)"""
+        if self.state != 'open':
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'recent_calls': len(self._outcomes),
+                'recent_failures': self._outcomes.count(False),
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+class LatencyTracker:
+    """Quantiles over the latencies of the last ``window`` successful calls"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class ResilientBackend(InferenceBackend):
+    """Wraps another backend with a per-call deadline, a breaker and optional hedging.
+
+    Calls run on a private thread pool so the caller stops waiting at the
+    deadline even if the backend blocks; the stuck call finishes (or hits its
+    own client timeout) in the background. With ``hedge`` on, a single-image
+    call that is still running after the recent p95 latency is sent again
+    and the first answer wins, which cuts the tail when the upstream has
+    occasional slow responses. Hedging waits for ``hedge_min_samples``
+    latencies before it kicks in and is skipped unless the breaker is closed.
+    Only upstream failures (see ``upstream_failure()``) count against the
+    breaker. Raises CircuitOpen, CallTimeout or the backend's own exception.
+    """
+
+    def __init__(self, backend, timeout=10.0, breaker=None, hedge=False, hedge_quantile=0.95,
+                 hedge_min_delay=0.05, hedge_min_samples=20, max_workers=32):
+        self.backend = backend
+        self.name = backend.name
+        self.model = backend.model
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inference-call')
+        self._lock = threading.Lock()
+        self._counters = {
+            'calls': 0, 'failures': 0, 'timeouts': 0, 'rejected_inputs': 0, 'hedged': 0, 'hedge_wins': 0,
+        }
+
+    def _count(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._counters[key] += 1
+
+    def _hedge_delay(self):
+        if not self.hedge or self.breaker.state != 'closed' or len(self.latency) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latency.quantile(self.hedge_quantile))
+
+    def _admit(self):
+        if not self.breaker.allow():
+            raise CircuitOpen(self.breaker.retry_after())
+        self._count('calls')
+
+    def _failed(self, timeout=False):
+        if timeout:
+            self._count('failures', 'timeouts')
+        else:
+            self._count('failures')
+        self.breaker.record(False)
+
+    def _submit(self, fn, *args):
+        """Start a call admitted by _admit(); if it can't start, its outcome is still recorded"""
+        try:
+            return self._executor.submit(fn, *args)
+        except Exception:
+            # Otherwise a half-open probe claimed by allow() is never released
+            # and the breaker rejects every call from then on
+            self.breaker.record(False)
+            raise
+
+    def classify(self, image_bytes):
+        self._admit()
+        started = time.monotonic()
+        deadline = started + self.timeout
+        hedge_delay = self._hedge_delay()
+        primary = self._submit(self.backend.classify, image_bytes)
+        pending = {primary}
+        error = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_for = deadline - now
+            if hedge_delay is not None:
+                wait_for = min(wait_for, max(0.0, started + hedge_delay - now))
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is not primary:
+                        self._count('hedge_wins')
+                    self.latency.add(time.monotonic() - started)
+                    self.breaker.record(True)
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                break
+            if hedge_delay is not None and time.monotonic() >= started + hedge_delay:
+                hedge_delay = None
+                self._count('hedged')
+                try:
+                    pending.add(self._executor.submit(self.backend.classify, image_bytes))
+                except RuntimeError:
+                    pass  # Shutting down; the primary call carries on alone
+        if error is not None and not pending:
+            if upstream_failure(error):
+                self._failed()
+            else:
+                self._count('rejected_inputs')
+                self.breaker.record(True)
+            raise error
+        for future in pending:
+            future.cancel()
+        self._failed(timeout=True)
+        raise CallTimeout(f"No answer from the {self.name} backend within {self.timeout:.1f}s")
+
+    def classify_batch(self, images):
+        try:
+            self._admit()
+        except CircuitOpen as e:
+            return [e] * len(images)
+        future = self._submit(self.backend.classify_batch, images)
+        try:
+            results = future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            future.cancel()
+            self._failed(timeout=True)
+            return [CallTimeout(f"No answer from the {self.name} backend within {self.timeout:.1f}s")] * len(images)
+        except Exception as e:
+            if upstream_failure(e):
+                self._failed()
+            else:
+                self.breaker.record(True)
+            return [e] * len(images)
+        # Per-image errors (a corrupt upload) don't say anything about the upstream
+        if results and all(upstream_failure(result) for result in results):
+            self._failed()
+        else:
+            self.breaker.record(True)
+        return results
+
+    def warmup(self):
+        self.backend.warmup()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.backend.close()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        p95 = self.latency.quantile(0.95)
+        return {
+            **counters,
+            'timeout_s': self.timeout,
+            'hedging': self.hedge,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'breaker': self.breaker.stats(),
+        }
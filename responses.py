@@ -0,0 +1,139 @@
+"""Response shaping: a faster JSON encoder, ?fields= selection and compression"""
+import gzip
+import logging
+import threading
+
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson.
+
+    Types orjson doesn't know (Decimal, date, ...) go through Flask's
+    default conversions. Keys aren't sorted: the order doesn't matter to
+    clients and sorting costs time on every response.
+    """
+
+    options = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.options).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.options),
+            mimetype=self.mimetype
+        )
+
+
+def configure_json(app, encoder):
+    """Install the "orjson" or "default" encoder; returns the one in use"""
+    if encoder == 'orjson':
+        if orjson is not None:
+            app.json = OrjsonProvider(app)
+            return 'orjson'
+        logger.warning("JSON_ENCODER=orjson but orjson is not installed, using the default encoder")
+    return 'default'
+
+
+def parse_fields(spec):
+    """Field tree from a ?fields= value: "items.food_name,totals" -> {'items': {'food_name': {}}, 'totals': {}}"""
+    tree = {}
+    for path in spec.split(','):
+        node = tree
+        for name in filter(None, (part.strip() for part in path.split('.'))):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def select_fields(data, tree):
+    """Copy of data keeping only the fields in tree; lists are filtered item by item"""
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [select_fields(item, tree) for item in data]
+    if isinstance(data, dict):
+        return {name: select_fields(data[name], subtree) for name, subtree in tree.items() if name in data}
+    return data
+
+
+class ResponseCompressor:
+    """Compresses eligible responses with brotli or gzip, whichever the client prefers.
+
+    Only complete (non-streamed) responses of ``mimetypes`` that are at
+    least ``min_size`` bytes are compressed; below that the headers cost
+    more than they save. Brotli is offered only when the package is
+    installed. Strong ETags become weak, since the bytes on the wire change.
+    """
+
+    def __init__(self, min_size=1024, mimetypes=(), gzip_level=5, brotli_quality=4):
+        self.min_size = min_size
+        self.mimetypes = frozenset(mimetypes)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        self._lock = threading.Lock()
+        self._counters = {'compressed': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def choose(self, accept_encodings):
+        """Best encoding the client accepts, or None"""
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def _encode(self, encoding, body):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def __call__(self, response, accept_encodings):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in self.mimetypes
+        ):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose(accept_encodings)
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        compressed = self._encode(encoding, body)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        with self._lock:
+            self._counters['compressed'] += 1
+            self._counters['bytes_in'] += len(body)
+            self._counters['bytes_out'] += len(compressed)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {'encodings': list(self.encodings), 'min_size': self.min_size, **self._counters}
@@ -0,0 +1,178 @@
+"""Hourly and daily sales rollups per food, maintained as sales are written
+
+Every batch the transaction writer commits is pre-aggregated here and
+upserted into sales_rollup_hourly (UTC hour buckets) and sales_rollup_daily
+(calendar days in the reporting time zone) in the same database
+transaction, so the rollups never drift from the raw rows and reports never
+scan them.
+"""
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from psycopg2.extras import execute_values
+
+MEASURES = ('items', 'revenue', 'calories', 'protein', 'carbs', 'fat')
+
+SCHEMA_SQL = """
+    CREATE TABLE sales_rollup_hourly (
+        bucket TIMESTAMPTZ NOT NULL,
+        food_name VARCHAR(100) NOT NULL,
+        items INTEGER NOT NULL,
+        revenue DECIMAL(14,2) NOT NULL,
+        calories DECIMAL(14,2) NOT NULL,
+        protein DECIMAL(14,2) NOT NULL,
+        carbs DECIMAL(14,2) NOT NULL,
+        fat DECIMAL(14,2) NOT NULL,
+        PRIMARY KEY (bucket, food_name)
+    );
+
+    CREATE TABLE sales_rollup_daily (
+        day DATE NOT NULL,
+        food_name VARCHAR(100) NOT NULL,
+        items INTEGER NOT NULL,
+        revenue DECIMAL(14,2) NOT NULL,
+        calories DECIMAL(14,2) NOT NULL,
+        protein DECIMAL(14,2) NOT NULL,
+        carbs DECIMAL(14,2) NOT NULL,
+        fat DECIMAL(14,2) NOT NULL,
+        PRIMARY KEY (day, food_name)
+    );
+"""
+
+UPSERT_SQL = """
+    INSERT INTO {table} ({key}, food_name, items, revenue, calories, protein, carbs, fat)
+    VALUES %s
+    ON CONFLICT ({key}, food_name) DO UPDATE SET
+        items = {table}.items + EXCLUDED.items,
+        revenue = {table}.revenue + EXCLUDED.revenue,
+        calories = {table}.calories + EXCLUDED.calories,
+        protein = {table}.protein + EXCLUDED.protein,
+        carbs = {table}.carbs + EXCLUDED.carbs,
+        fat = {table}.fat + EXCLUDED.fat
+"""
+
+REBUILD_SQL = """
+    TRUNCATE sales_rollup_hourly, sales_rollup_daily;
+
+    INSERT INTO sales_rollup_hourly (bucket, food_name, items, revenue, calories, protein, carbs, fat)
+    SELECT date_trunc('hour', created_at, 'UTC'), food_name,
+           COUNT(*), SUM(price), SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+    FROM transaction_items
+    GROUP BY 1, 2;
+
+    INSERT INTO sales_rollup_daily (day, food_name, items, revenue, calories, protein, carbs, fat)
+    SELECT (created_at AT TIME ZONE %(tz)s)::date, food_name,
+           COUNT(*), SUM(price), SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+    FROM transaction_items
+    GROUP BY 1, 2;
+"""
+
+# Item row layout produced by transaction_writer.transaction_rows()
+_CREATED_AT, _FOOD_NAME, _PRICE, _CALORIES, _PROTEIN, _CARBS, _FAT = 1, 3, 4, 5, 6, 7, 8
+
+
+def _accumulate(totals, key, row):
+    sums = totals.get(key)
+    if sums is None:
+        sums = totals[key] = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    sums[0] += 1
+    sums[1] += float(row[_PRICE])
+    sums[2] += float(row[_CALORIES])
+    sums[3] += float(row[_PROTEIN])
+    sums[4] += float(row[_CARBS])
+    sums[5] += float(row[_FAT])
+
+
+def _rows(totals):
+    # Sorted so concurrent writers lock rollup rows in the same order
+    return [
+        (bucket, food_name, sums[0], *(round(value, 2) for value in sums[1:]))
+        for (bucket, food_name), sums in sorted(totals.items())
+    ]
+
+
+class SalesRollups:
+    """Maintains and queries the rollup tables"""
+
+    def __init__(self, tz='UTC'):
+        self.tz_name = tz
+        self.tz = ZoneInfo(tz)
+
+    def aggregate(self, batch):
+        """Pre-aggregate a writer batch into (hourly rows, daily rows)"""
+        hourly, daily = {}, {}
+        for _, item_rows in batch:
+            for row in item_rows:
+                created_at = row[_CREATED_AT].astimezone(timezone.utc)
+                food_name = row[_FOOD_NAME]
+                _accumulate(hourly, (created_at.replace(minute=0, second=0, microsecond=0), food_name), row)
+                _accumulate(daily, (created_at.astimezone(self.tz).date(), food_name), row)
+        return _rows(hourly), _rows(daily)
+
+    def apply(self, cur, batch):
+        """Add a batch of (header, item rows) to the rollups; call inside the write transaction"""
+        hourly, daily = self.aggregate(batch)
+        if hourly:
+            execute_values(cur, UPSERT_SQL.format(table='sales_rollup_hourly', key='bucket'),
+                           hourly, page_size=len(hourly))
+        if daily:
+            execute_values(cur, UPSERT_SQL.format(table='sales_rollup_daily', key='day'),
+                           daily, page_size=len(daily))
+
+    def rebuild(self, cur):
+        """Recompute both rollups from transaction_items (a full scan; for backfills only)"""
+        cur.execute("LOCK TABLE sales_rollup_hourly, sales_rollup_daily IN EXCLUSIVE MODE")
+        cur.execute(REBUILD_SQL, {'tz': self.tz_name})
+
+    def daily(self, cur, start, end):
+        """Per-day totals for local dates start..end inclusive"""
+        cur.execute("""
+            SELECT day, SUM(items), SUM(revenue), SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+            FROM sales_rollup_daily
+            WHERE day BETWEEN %s AND %s
+            GROUP BY day
+            ORDER BY day
+        """, (start, end))
+        return [
+            {'date': row[0].isoformat(), **dict(zip(MEASURES, _numbers(row[1:])))}
+            for row in cur.fetchall()
+        ]
+
+    def hourly(self, cur, day):
+        """Per-hour totals for one local date, labelled in local time"""
+        start = datetime.combine(day, datetime.min.time(), self.tz)
+        end = datetime.combine(day + timedelta(days=1), datetime.min.time(), self.tz)
+        cur.execute("""
+            SELECT bucket, SUM(items), SUM(revenue), SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+            FROM sales_rollup_hourly
+            WHERE bucket >= %s AND bucket < %s
+            GROUP BY bucket
+            ORDER BY bucket
+        """, (start, end))
+        return [
+            {'hour': row[0].astimezone(self.tz).isoformat(), **dict(zip(MEASURES, _numbers(row[1:])))}
+            for row in cur.fetchall()
+        ]
+
+    def top_foods(self, cur, start, end, order_by='revenue', limit=10):
+        """Foods ranked by a measure over local dates start..end inclusive"""
+        if order_by not in MEASURES:
+            raise ValueError(f"Unknown measure: {order_by}")
+        cur.execute(f"""
+            SELECT food_name, SUM(items), SUM(revenue), SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+            FROM sales_rollup_daily
+            WHERE day BETWEEN %s AND %s
+            GROUP BY food_name
+            ORDER BY SUM({order_by}) DESC, food_name
+            LIMIT %s
+        """, (start, end, limit))
+        return [
+            {'food_name': row[0], **dict(zip(MEASURES, _numbers(row[1:])))}
+            for row in cur.fetchall()
+        ]
+
+
+def _numbers(values):
+    """Rollup sums as JSON-friendly numbers"""
+    items, *amounts = values
+    return [int(items)] + [float(amount) for amount in amounts]
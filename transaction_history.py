@@ -0,0 +1,162 @@
+"""Read access to stored sales: keyset-paginated listing and streaming export"""
+import base64
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+
+EXPORT_COLUMNS = (
+    'transaction_id', 'created_at', 'position', 'food_name',
+    'price', 'calories', 'protein', 'carbs', 'fat', 'confidence',
+)
+
+ITEM_FIELDS = ('food_name', 'price', 'calories', 'protein', 'carbs', 'fat', 'confidence')
+
+
+def encode_cursor(created_at, transaction_id):
+    """Opaque page token for the last transaction of a page"""
+    raw = json.dumps([created_at.isoformat(), transaction_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """(created_at, transaction id) from a page token; ValueError if it's malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, transaction_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(transaction_id).hex
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _filters(start, end, food_name, alias):
+    clauses, params = [], []
+    if start is not None:
+        clauses.append(f"{alias}.created_at >= %s")
+        params.append(start)
+    if end is not None:
+        clauses.append(f"{alias}.created_at < %s")
+        params.append(end)
+    if food_name:
+        if alias == 't':
+            clauses.append("""EXISTS (
+                SELECT 1 FROM transaction_items i
+                WHERE i.transaction_id = t.id AND i.created_at = t.created_at
+                  AND lower(i.food_name) = lower(%s)
+            )""")
+        else:
+            clauses.append(f"lower({alias}.food_name) = lower(%s)")
+        params.append(food_name)
+    return clauses, params
+
+
+def list_transactions(cur, start=None, end=None, food_name=None, limit=50, after=None):
+    """One page of transactions, newest first, with their items.
+
+    ``after`` is a decoded cursor; rows strictly older than it are returned,
+    so every page is an index range scan no matter how deep it is. Returns
+    (transactions, next cursor or None).
+    """
+    clauses, params = _filters(start, end, food_name, 't')
+    if after is not None:
+        clauses.append("(t.created_at, t.id) < (%s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    cur.execute(f"""
+        SELECT t.id, t.created_at, t.item_count, t.total_price, t.total_calories
+        FROM transactions t
+        {where}
+        ORDER BY t.created_at DESC, t.id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    headers = cur.fetchall()
+    has_more = len(headers) > limit
+    headers = headers[:limit]
+    if not headers:
+        return [], None
+
+    # Bounding created_at lets Postgres prune partitions for the item lookup
+    cur.execute("""
+        SELECT transaction_id, food_name, price, calories, protein, carbs, fat, confidence
+        FROM transaction_items
+        WHERE transaction_id = ANY(%s::uuid[]) AND created_at BETWEEN %s AND %s
+        ORDER BY transaction_id, position
+    """, ([h[0] for h in headers], headers[-1][1], headers[0][1]))
+    items = {}
+    for row in cur.fetchall():
+        items.setdefault(row[0], []).append({
+            field: (value if field == 'food_name' else float(value))
+            for field, value in zip(ITEM_FIELDS, row[1:])
+        })
+
+    transactions = [
+        {
+            'id': uuid.UUID(str(transaction_id)).hex,
+            'created_at': created_at.isoformat(),
+            'item_count': item_count,
+            'total_price': float(total_price),
+            'total_calories': float(total_calories),
+            'items': items.get(transaction_id, []),
+        }
+        for transaction_id, created_at, item_count, total_price, total_calories in headers
+    ]
+    last = headers[-1]
+    next_cursor = encode_cursor(last[1], uuid.UUID(str(last[0])).hex) if has_more else None
+    return transactions, next_cursor
+
+
+def export_batches(conn, start=None, end=None, food_name=None, batch_size=2000):
+    """Yield lists of item rows (EXPORT_COLUMNS) oldest first via a server-side cursor.
+
+    Only ``batch_size`` rows are held in memory at a time. The caller owns
+    ``conn`` and must keep it checked out until the generator is exhausted.
+    """
+    clauses, params = _filters(start, end, food_name, 'i')
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cur:
+        cur.itersize = batch_size
+        cur.execute(f"""
+            SELECT replace(i.transaction_id::text, '-', ''), i.created_at, i.position, i.food_name,
+                   i.price, i.calories, i.protein, i.carbs, i.fat, i.confidence
+            FROM transaction_items i
+            {where}
+            ORDER BY i.created_at, i.transaction_id, i.position
+        """, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def csv_chunks(batches):
+    """CSV text, one chunk per batch, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(
+            (transaction_id, created_at.isoformat(), *rest)
+            for transaction_id, created_at, *rest in rows
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(batches):
+    """One JSON object per line, one chunk per batch"""
+    for rows in batches:
+        yield "".join(
+            json.dumps({
+                'transaction_id': row[0],
+                'created_at': row[1].isoformat(),
+                'position': row[2],
+                'food_name': row[3],
+                **{field: float(value) for field, value in zip(EXPORT_COLUMNS[4:], row[4:])},
+            }) + "\n"
+            for row in rows
+        )
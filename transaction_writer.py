@@ -0,0 +1,273 @@
+"""Write-behind persistence for sales (transactions plus their item rows)"""
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+HEADER_SQL = """
+    INSERT INTO transactions
+    (id, created_at, item_count, total_price, total_calories)
+    VALUES %s
+"""
+
+ITEMS_SQL = """
+    INSERT INTO transaction_items
+    (transaction_id, created_at, position, food_name, price, calories, protein, carbs, fat, confidence)
+    VALUES %s
+"""
+
+
+def transaction_rows(items, transaction_id=None, created_at=None):
+    """Header row and item rows for one tray, stamped with the request time"""
+    transaction_id = transaction_id or uuid.uuid4().hex
+    created_at = created_at or datetime.now(timezone.utc)
+    header = (
+        transaction_id,
+        created_at,
+        len(items),
+        round(sum(item['price'] for item in items), 2),
+        round(sum(item['calories'] for item in items), 2)
+    )
+    rows = [
+        (
+            transaction_id,
+            created_at,
+            position,
+            item['name'],
+            item['price'],
+            item['calories'],
+            item['protein'],
+            item['carbs'],
+            item['fat'],
+            item['confidence']
+        )
+        for position, item in enumerate(items)
+    ]
+    return header, rows
+
+
+# Errors about the rows themselves, as opposed to the connection or server
+REJECTED_ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+
+class TransactionWriter:
+    """Buffers sales and writes them in multi-row batches.
+
+    In ``async`` mode ``submit()`` only enqueues the rows; a background
+    thread flushes them with ``execute_values`` once ``batch_size``
+    transactions are pending or ``flush_interval`` seconds have passed since
+    the oldest one. Each flush is one database transaction with one INSERT
+    for the headers and one for the items. When the bounded queue is full,
+    ``submit()`` blocks for up to ``put_timeout`` seconds and then writes
+    synchronously, so a slow database slows requests down instead of losing
+    sales. In ``sync`` mode every ``submit()`` is written immediately.
+
+    ``rollups``, if given, is applied to every batch inside the same database
+    transaction (see rollups.SalesRollups).
+
+    A flush that fails is retried ``max_retries`` times. A batch the database
+    rejects because of its contents (a price out of range, a name too long)
+    is instead split in halves until only the offending trays remain, so the
+    other requests' sales in that batch are still stored.
+    """
+
+    def __init__(self, pool, mode='async', batch_size=200, flush_interval=1.0,
+                 max_queue=10000, put_timeout=0.05, max_retries=3, rollups=None):
+        if mode not in ('async', 'sync'):
+            raise ValueError(f"Unknown write mode: {mode}")
+        self.pool = pool
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.rollups = rollups
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._counters = {
+            'submitted_transactions': 0,
+            'written_transactions': 0,
+            'written_rows': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'dropped_transactions': 0,
+            'sync_fallbacks': 0,
+            'last_flush_ms': 0.0,
+        }
+
+    def start(self):
+        """Start the background flusher (no-op in sync mode)"""
+        if self.mode != 'async':
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='transaction-writer', daemon=True
+            )
+            self._thread.start()
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._counters[key] += value
+
+    def submit(self, items, transaction_id=None, created_at=None):
+        """Persist one tray, returning False only if it could not be stored"""
+        return self.submit_many([items], [transaction_id], created_at)
+
+    def submit_many(self, item_lists, transaction_ids=None, created_at=None):
+        """Persist several trays together: one queue entry, one database transaction"""
+        created_at = created_at or datetime.now(timezone.utc)
+        transaction_ids = transaction_ids or [None] * len(item_lists)
+        batch = [
+            transaction_rows(items, transaction_id, created_at)
+            for items, transaction_id in zip(item_lists, transaction_ids) if items
+        ]
+        if not batch:
+            return True
+        self._count('submitted_transactions', len(batch))
+
+        if self.mode == 'sync' or self._stopping.is_set():
+            return self.write(batch)
+
+        self.start()
+        try:
+            self._queue.put(batch, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            # Backpressure: the flusher can't keep up, write on the caller's thread
+            self._count('sync_fallbacks')
+            logger.warning("Write queue full, writing %d transactions synchronously", len(batch))
+            return self.write(batch)
+
+    def write(self, batch):
+        """Insert (header, item rows) pairs with one statement per table and commit"""
+        return self._write(batch) is None
+
+    def _write(self, batch):
+        """As write(), returning the exception on failure and None on success"""
+        start = time.monotonic()
+        headers = [header for header, _ in batch]
+        rows = [row for _, item_rows in batch for row in item_rows]
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, HEADER_SQL, headers, page_size=max(len(headers), 1))
+                    execute_values(cur, ITEMS_SQL, rows, page_size=max(len(rows), 1))
+                    if self.rollups is not None:
+                        self.rollups.apply(cur, batch)
+                conn.commit()
+        except Exception as e:
+            self._count('failed_batches')
+            logger.error("Could not write %d transactions: %s", len(batch), e)
+            return e
+        with self._lock:
+            self._counters['written_transactions'] += len(batch)
+            self._counters['written_rows'] += len(rows)
+            self._counters['batches'] += 1
+            self._counters['last_flush_ms'] = round((time.monotonic() - start) * 1000, 2)
+        return None
+
+    def _drain(self, first):
+        """Collect queued transactions until the batch is full or the interval elapses"""
+        batch = list(first)
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.extend(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Once stopping, take everything that is already queued
+        while len(batch) < self.batch_size:
+            try:
+                batch.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush_batch(self, batch):
+        for attempt in range(self.max_retries):
+            error = self._write(batch)
+            if error is None:
+                return
+            if isinstance(error, REJECTED_ROW_ERRORS):
+                # Retrying won't help; write around the bad rows instead
+                self._split(batch)
+                return
+            if self._stopping.is_set():
+                break
+            time.sleep(min(2 ** attempt * 0.5, 5))
+        self._drop(batch, "after retries")
+
+    def _split(self, batch):
+        """Write a rejected batch in halves until the trays that can't be stored are isolated"""
+        if len(batch) == 1:
+            self._drop(batch, f"rejected by the database (transaction {batch[0][0][0]})")
+            return
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            error = self._write(half)
+            if error is None:
+                continue
+            if isinstance(error, REJECTED_ROW_ERRORS):
+                self._split(half)
+            else:
+                self._drop(half, "while isolating a rejected row")
+
+    def _drop(self, batch, reason):
+        self._count('dropped_transactions', len(batch))
+        logger.error("Dropped %d transactions %s", len(batch), reason)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._flush_batch(self._drain(first))
+
+    def flush(self):
+        """Synchronously write everything that is currently queued"""
+        batch = []
+        while True:
+            try:
+                batch.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._flush_batch(batch)
+                batch = []
+        if batch:
+            self._flush_batch(batch)
+
+    def close(self, timeout=10.0):
+        """Stop the flusher and persist any transactions still buffered"""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        """Queue depth and write counters"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'queued_transactions': self._queue.qsize(),
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+                **self._counters,
+            }
@@ -0,0 +1,147 @@
+"""Streaming ingestion of image uploads
+
+Flask normally buffers each uploaded file and the app then reads it into
+bytes. ``UploadRequest`` instead has werkzeug stream every file part into a
+``SpooledUpload`` while it parses the request: chunks are counted, hashed
+and the first bytes sniffed as they arrive, so an oversized or non-image
+upload is rejected before the rest of it is read. ``finish()`` then hands
+the content to the pipeline as a single bytes object; the batch endpoint
+instead downscales each image straight from its ``SpooledUpload`` and closes
+it, so only the small prepared images stay in memory.
+"""
+import hashlib
+import tempfile
+from collections import namedtuple
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+# (format, offset, magic bytes); WebP is a RIFF container with WEBP at byte 8
+SIGNATURES = (
+    ('jpeg', 0, b'\xff\xd8\xff'),
+    ('png', 0, b'\x89PNG\r\n\x1a\n'),
+    ('gif', 0, b'GIF87a'),
+    ('gif', 0, b'GIF89a'),
+    ('webp', 8, b'WEBP'),
+    ('bmp', 0, b'BM'),
+    ('tiff', 0, b'II*\x00'),
+    ('tiff', 0, b'MM\x00*'),
+    ('heic', 4, b'ftypheic'),
+    ('heic', 4, b'ftypheix'),
+    ('heic', 4, b'ftypmif1'),
+)
+SNIFF_BYTES = 16
+
+Upload = namedtuple('Upload', ['content', 'sha256', 'format'])
+
+
+def sniff_format(head):
+    """Image format named by the leading bytes, or None"""
+    for name, offset, magic in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            if name == 'webp' and not head.startswith(b'RIFF'):
+                continue
+            return name
+    return None
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    description = "Image is too large"
+
+
+class UnsupportedImage(UnsupportedMediaType):
+    description = "Upload is not a supported image (JPEG, PNG, GIF, WebP, BMP, TIFF or HEIC)"
+
+
+class SpooledUpload:
+    """File object werkzeug writes one uploaded file into.
+
+    Holds up to ``spool_bytes`` in memory and spills larger uploads to a
+    temporary file, so parsing never holds more than that per file beyond
+    what ``finish()`` later returns. Raises UploadTooLarge past
+    ``max_bytes`` and UnsupportedImage as soon as the first bytes don't
+    match a known image format.
+    """
+
+    def __init__(self, max_bytes, spool_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.format = None
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self._hash = hashlib.sha256()
+        self._head = b''
+        self._upload = None
+
+    def _sniff(self):
+        self.format = sniff_format(self._head)
+        if self.format is None:
+            raise UnsupportedImage()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"Image is larger than {self.max_bytes} bytes")
+        if self.format is None and len(self._head) < SNIFF_BYTES:
+            self._head += data[:SNIFF_BYTES - len(self._head)]
+            if len(self._head) == SNIFF_BYTES:
+                self._sniff()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def seek(self, offset, whence=0):
+        # werkzeug rewinds the file once its part is complete
+        if self.format is None and self.size:
+            self._sniff()
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def finish(self):
+        """The upload as Upload(content, sha256, format); releases the spool.
+
+        An in-memory upload's buffer becomes the content without a copy; a
+        spilled one is read back in a single call.
+        """
+        if self._upload is None:
+            self._file.seek(0)
+            self._upload = Upload(self._file.read(), self.sha256, self.format)
+            self._file.close()
+        return self._upload
+
+
+class UploadRequest(Request):
+    """Request class streaming uploaded files into SpooledUpload.
+
+    Limits come from the app config: MAX_IMAGE_BYTES per file and
+    UPLOAD_SPOOL_BYTES kept in memory before spilling to disk.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        return SpooledUpload(
+            config.get('MAX_IMAGE_BYTES', 10 * 1024 * 1024),
+            config.get('UPLOAD_SPOOL_BYTES', 1024 * 1024)
+        )
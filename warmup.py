@@ -0,0 +1,104 @@
+"""Background startup tasks with retry and a readiness view"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Task:
+    __slots__ = ('name', 'fn', 'required', 'state', 'attempts', 'error', 'duration_ms', 'ready')
+
+    def __init__(self, name, fn, required):
+        self.name = name
+        self.fn = fn
+        self.required = required
+        self.state = 'cold'
+        self.attempts = 0
+        self.error = None
+        self.duration_ms = None
+        self.ready = threading.Event()
+
+
+class Warmup:
+    """Runs each registered task on its own background thread.
+
+    Failed tasks are retried with exponential backoff (capped at
+    ``max_backoff`` seconds) until they succeed, so a database or model
+    server that is down at boot only delays readiness, and a slow task never
+    holds up the others. ``start()`` is cheap and fork-aware: call it from
+    anywhere that may run first in a worker.
+    """
+
+    def __init__(self, max_backoff=60.0):
+        self.max_backoff = max_backoff
+        self._tasks = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def add(self, name, fn, required=True):
+        self._tasks.append(_Task(name, fn, required))
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            for task in self._tasks:
+                if task.state != 'warm':
+                    threading.Thread(target=self._run, args=(task,), name=f'warmup-{task.name}', daemon=True).start()
+
+    def _attempt(self, task):
+        task.state = 'warming'
+        task.attempts += 1
+        started = time.monotonic()
+        try:
+            task.fn()
+        except Exception as e:
+            task.state = 'failed'
+            task.error = f"{type(e).__name__}: {e}"
+            logger.warning("Warmup of %s failed (attempt %d): %s", task.name, task.attempts, e)
+            return False
+        task.duration_ms = round((time.monotonic() - started) * 1000, 1)
+        task.state = 'warm'
+        task.error = None
+        task.ready.set()
+        logger.info("%s warm in %.0f ms", task.name, task.duration_ms)
+        return True
+
+    def _run(self, task):
+        backoff = 1.0
+        while not self._stopping.is_set() and not self._attempt(task):
+            self._stopping.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def wait(self, name, timeout=None):
+        """Block until a task is warm; returns False on timeout"""
+        for task in self._tasks:
+            if task.name == name:
+                return task.ready.wait(timeout)
+        raise KeyError(name)
+
+    def ready(self):
+        """True once every required task is warm"""
+        return all(task.state == 'warm' for task in self._tasks if task.required)
+
+    def stop(self):
+        self._stopping.set()
+
+    def status(self):
+        return {
+            task.name: {
+                'state': task.state,
+                'required': task.required,
+                'attempts': task.attempts,
+                'duration_ms': task.duration_ms,
+                'error': task.error,
+            }
+            for task in self._tasks
+        }